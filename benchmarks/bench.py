@@ -0,0 +1,287 @@
+"""Benchmark dotbackup with synthetic home directories.
+
+Each scenario is a generated home directory of some shape and scale, which is backed
+up and set up by Config.backup() and Config.setup(). Every measurement runs in a new
+process so that its peak RSS is not shared with other measurements.
+
+Usage:
+    python benchmarks/bench.py [--scale 1k] [--shape wide] [-o results.json]
+
+Scales are file counts (1k, 100k, 1m). Shapes are:
+    wide   -- a few directory levels with many files in each directory
+    deep   -- directories nested 32 levels deep
+    tiny   -- many 64 bytes files
+    large  -- few 1 MiB files, the file count is the scale divided by 1000
+    ignore -- like wide, but a quarter of the files are ignored by 200 patterns
+
+Results are written as JSON with sorted keys, and each result is identified by its
+scenario and operation, so that results of different versions can be compared. File
+and byte counts, and thus rates, are of backed up files only, ignored files are
+counted separately.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src")
+RESULT_FORMAT = 2
+SCALES = {"1k": 10**3, "100k": 10**5, "1m": 10**6}
+SHAPES = ("wide", "deep", "tiny", "large", "ignore")
+OPERATIONS = ("backup", "backup-incremental", "setup")
+APPS = 10
+DIR_FILES = 100
+DEEP_LEVELS = 32
+IGNORE_PATTERNS = 200
+META_FILE = "bench.json"
+
+
+def get_config_dict(shape) -> dict:
+    """Return the configuration of the scenario shape."""
+
+    apps = dict()
+    for i in range(APPS):
+        app = {"files": [f"~/.config/app{i}"]}
+        if shape == "ignore":
+            # only the last pattern matches generated files
+            app["ignore"] = [f"*.tmp{j}" for j in range(IGNORE_PATTERNS - 1)]
+            app["ignore"].append("*.log")
+        apps[f"app{i}"] = app
+
+    return {"backup_dir": "~/backup", "apps": apps, "selected_apps": []}
+
+
+def iter_files(shape, count, rand):
+    """Yield (relative path, size, whether the file is ignored) of the scenario
+    files.
+    """
+
+    if shape == "large":
+        count = max(count // 1000, APPS)
+    for i in range(count):
+        app, j = i % APPS, i // APPS
+        if shape == "deep":
+            parent = "/".join(f"d{k}" for k in range(j % DEEP_LEVELS))
+        else:
+            parent = f"{j // DIR_FILES // DIR_FILES}/{j // DIR_FILES % DIR_FILES}"
+        ignored = shape == "ignore" and j % 4 == 0
+        name = f"{j}.log" if ignored else f"{j}.txt"
+
+        if shape == "tiny":
+            size = 64
+        elif shape == "large":
+            size = 2**20
+        else:
+            size = rand.randint(1, 4096)
+        yield os.path.join(f".config/app{app}", parent, name), size, ignored
+
+
+def generate(home, shape, count) -> dict:
+    """Generate the home directory of the scenario if necessary and return its
+    metadata."""
+
+    meta_path = os.path.join(home, META_FILE)
+    if os.path.isfile(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        # scenarios generated by older versions are counted differently
+        if meta.get("format") == RESULT_FORMAT:
+            return meta
+
+    shutil.rmtree(home, ignore_errors=True)
+    rand = random.Random(f"{shape}-{count}")
+    data = rand.randbytes(2**20) if hasattr(rand, "randbytes") else os.urandom(2**20)
+    meta = {
+        "format": RESULT_FORMAT,
+        "files": 0,
+        "bytes": 0,
+        "ignored_files": 0,
+        "ignored_bytes": 0,
+    }
+    for path, size, ignored in iter_files(shape, count, rand):
+        path = os.path.join(home, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data[:size])
+        prefix = "ignored_" if ignored else ""
+        meta[f"{prefix}files"] += 1
+        meta[f"{prefix}bytes"] += size
+
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    return meta
+
+
+def get_peak_rss() -> int:
+    """Return the peak RSS of this process in bytes."""
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def run_one(shape, operation) -> dict:
+    """Run one measurement in this process, HOME must be the scenario home."""
+
+    sys.path.insert(0, SRC_DIR)
+    from dotbackup import Config
+
+    config = Config(get_config_dict(shape))
+    if operation == "backup-incremental":
+        config._dict["incremental"] = True
+    run = config.setup if operation == "setup" else config.backup
+
+    start = time.perf_counter()
+    if run() != 0:
+        raise RuntimeError(f"{operation} failed")
+    seconds = time.perf_counter() - start
+
+    return {"seconds": seconds, "peak_rss": get_peak_rss()}
+
+
+def measure(home, shape, operation) -> dict:
+    """Run one measurement in a new process."""
+
+    env = dict(os.environ, HOME=home)
+    args = [sys.executable, __file__, "--run-one", shape, operation]
+    output = subprocess.run(args, env=env, check=True, stdout=subprocess.PIPE).stdout
+    return json.loads(output)
+
+
+def bench(home, shape, operation, repeat) -> list:
+    """Return measurements of the operation in the scenario."""
+
+    backup_dir = os.path.join(home, "backup")
+    samples = []
+    if operation == "backup-incremental":
+        # the first incremental backup writes the manifest
+        shutil.rmtree(backup_dir, ignore_errors=True)
+        measure(home, shape, operation)
+    elif operation == "setup" and not os.path.isdir(backup_dir):
+        measure(home, shape, "backup")
+
+    for _ in range(repeat):
+        if operation == "backup":
+            shutil.rmtree(backup_dir, ignore_errors=True)
+        samples.append(measure(home, shape, operation))
+
+    return samples
+
+
+def summarize(scenario, shape, scale, operation, meta, samples) -> dict:
+    """Return the result of the measurements."""
+
+    seconds = [sample["seconds"] for sample in samples]
+    wall_time = statistics.median(seconds)
+    return {
+        "scenario": scenario,
+        "shape": shape,
+        "scale": scale,
+        "operation": operation,
+        "files": meta["files"],
+        "bytes": meta["bytes"],
+        "ignored_files": meta["ignored_files"],
+        "ignored_bytes": meta["ignored_bytes"],
+        "samples": seconds,
+        "wall_time": wall_time,
+        "files_per_sec": meta["files"] / wall_time if wall_time else None,
+        "bytes_per_sec": meta["bytes"] / wall_time if wall_time else None,
+        "peak_rss": max(sample["peak_rss"] for sample in samples),
+    }
+
+
+def get_version() -> str:
+    sys.path.insert(0, SRC_DIR)
+    from dotbackup import __VERSION__
+
+    return __VERSION__
+
+
+def main(args=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark dotbackup with synthetic home directories."
+    )
+    parser.add_argument(
+        "--scale",
+        action="append",
+        choices=SCALES,
+        help="file count of scenarios, may be given multiple times (default: 1k)",
+    )
+    parser.add_argument(
+        "--shape",
+        action="append",
+        choices=SHAPES,
+        help="shape of scenarios, may be given multiple times (default: all)",
+    )
+    parser.add_argument(
+        "--operation",
+        action="append",
+        choices=OPERATIONS,
+        help="operations to measure, may be given multiple times (default: all)",
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=3, help="measurements of each operation"
+    )
+    parser.add_argument(
+        "-w",
+        "--workdir",
+        help="directory to keep generated scenarios in, so that they can be reused",
+    )
+    parser.add_argument("-o", "--output", help="write results to the JSON file")
+    parser.add_argument("--run-one", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args(args)
+
+    if args.run_one:
+        json.dump(run_one(*args.run_one), sys.stdout)
+        return 0
+    if args.repeat < 1:
+        parser.error(f"invalid repeat: {args.repeat}: must be a positive integer")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="dotbackup-bench-")
+    results = []
+    try:
+        for scale in args.scale or ["1k"]:
+            for shape in args.shape or SHAPES:
+                scenario = f"{shape}-{scale}"
+                home = os.path.abspath(os.path.join(workdir, scenario))
+                print(f"generating {scenario}...", file=sys.stderr)
+                meta = generate(home, shape, SCALES[scale])
+
+                for operation in args.operation or OPERATIONS:
+                    print(f"measuring {scenario} {operation}...", file=sys.stderr)
+                    samples = bench(home, shape, operation, args.repeat)
+                    results.append(
+                        summarize(scenario, shape, scale, operation, meta, samples)
+                    )
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = {
+        "format": RESULT_FORMAT,
+        "dotbackup": get_version(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+            f.write("\n")
+    else:
+        json.dump(output, sys.stdout, indent=2, sort_keys=True)
+        print()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,42 @@
 #!/usr/bin/env python3
 
+import abc
+import bz2
+import copy
+import errno
+import fcntl
+import functools
+import glob
+import gzip
+import hashlib
+import itertools
+import json
 import logging
+import lzma
+import marshal
 import os
+import queue
+import re
+import select
 import shutil
+import signal
+import stat
+import struct
 import subprocess
 import sys
+import tarfile
+import threading
+import time
+import zlib
 from argparse import ArgumentParser
+from bisect import bisect_left
+from collections import Counter, defaultdict, deque
+from concurrent import futures
+from contextlib import contextmanager, nullcontext, suppress
+from datetime import datetime
 from logging import Formatter, Logger, LogRecord
 from pathlib import Path
 
-from ruamel.yaml import YAML
-
 __VERSION__ = "1.2.3"
 
 
@@ -46,356 +72,4888 @@ def init_logger() -> Logger:
     return logger
 
 
-class Config:
-    """Configuration of dotbackup with helper functions."""
-
-    _CONFIG_DIR = "~/.config/dotbackup"
-    _DEFAULT_CONFIG_FILE = f"{_CONFIG_DIR}/dotbackup.yml"
-    _YAML = YAML(typ="safe")
-    _LOGGER = logging.getLogger(__name__)
+class CompressWriter:
+    """Write-only binary file object which compresses and writes data to file in a
+    background thread, so that producing, compressing and writing data overlap.
 
-    def __init__(self, config_dict) -> None:
-        self._dict = dict(config_dict)
+    The output can be split into frames, i.e., independently compressed streams,
+    which can be decompressed from their offsets without reading previous data.
+    """
 
-    def __repr__(self) -> str:  # pragma: no cover
-        return repr(self._dict)
+    _QUEUE_SIZE = 16
 
-    def __eq__(self, other) -> bool:
-        if type(self) is not type(other):
-            return False
+    def __init__(self, file, new_compressor=None) -> None:
+        self._file = file
+        self._new_compressor = new_compressor
+        self._compressor = None if new_compressor is None else new_compressor()
+        self._offset = 0
+        self._written = 0
+        self.frame = 0
+        self.frame_offset = 0
+        # [compressed offset, uncompressed offset] of each frame
+        self.frames = [[0, 0]]
+        self._queue = queue.Queue(self._QUEUE_SIZE)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
 
-        return self._dict == other._dict
+    def _write_file(self, data) -> None:
+        self._file.write(data)
+        self._written += len(data)
 
-    @classmethod
-    def fromfile(cls, file):
-        """Return a new Config object based on the YAML configuration file."""
+    def _run(self) -> None:
+        try:
+            while True:
+                data = self._queue.get()
+                if data is None:
+                    break
 
-        with open(cls._normpath(file), encoding="utf-8") as f:
-            config_dict = cls._YAML.load(f)
+                if isinstance(data, int):
+                    # start a new frame at the uncompressed offset data
+                    if self._compressor is not None:
+                        self._write_file(self._compressor.flush())
+                        self._compressor = self._new_compressor()
+                    self.frames.append([self._written, data])
+                    continue
 
-            if config_dict is None:
-                raise RuntimeError(f"empty configuration: {file}")
+                if self._compressor is not None:
+                    data = self._compressor.compress(data)
+                self._write_file(data)
 
-        return cls(config_dict)
+            if self._compressor is not None:
+                self._write_file(self._compressor.flush())
+        except Exception as e:
+            self._error = e
+            # keep consuming so that write() and close() never block
+            while self._queue.get() is not None:
+                pass
 
-    @classmethod
-    def parse_args(cls, args):
-        """Return a new Config object based on the parsed CLI arguments."""
+    def tell(self) -> int:
+        """Return the uncompressed offset."""
 
-        cls._LOGGER.setLevel(args.log_level)
+        return self._offset
 
-        if (
-            args.config.endswith(".yml")
-            or "/" in args.config
-            or os.path.isfile(args.config)
-        ):
-            config_file = args.config
-        else:
-            config_file = f"{cls._CONFIG_DIR}/{args.config}.yml"
+    def new_frame(self) -> None:
+        """Start a new frame at the current offset if the current one isn't empty."""
 
-        config_file_path = Path(cls._normpath(config_file))
-        if not config_file_path.is_file():
-            cls._LOGGER.error(f"configuration file doesn't exist: {config_file}")
-            sys.exit(1)
+        if self._offset > self.frame_offset:
+            self.frame += 1
+            self.frame_offset = self._offset
+            self._queue.put(self._offset)
 
-        config = cls.fromfile(config_file)
+    def write(self, data) -> int:
+        if self._error is not None:
+            raise self._error
 
-        if args.list:
-            config._list_apps()
-            sys.exit()
+        self._queue.put(bytes(data))
+        self._offset += len(data)
+        return len(data)
 
-        if args.clean:
-            config._dict["clean"] = True
-        config._dict["selected_apps"] = list(args.app)
+    def close(self) -> None:
+        """Flush the compressor and wait for the background thread."""
 
-        return config
+        self._queue.put(None)
+        self._thread.join()
 
-    @classmethod
-    def _add_arguments(cls, parser, typ="backup") -> None:
-        """Add backup or setup arguments to the parser."""
+        if self._error is not None:
+            raise self._error
 
-        assert typ in ("backup", "setup")
 
-        parser.add_argument(
-            "-c",
-            "--config",
-            default=cls._DEFAULT_CONFIG_FILE,
-            help=f"Configuration file (default: {cls._DEFAULT_CONFIG_FILE}).",
-        )
-        parser.add_argument(
-            "-l",
-            "--list",
-            action="store_true",
-            help="List configured applications and exit.",
-        )
-        parser.add_argument(
-            "-v",
-            "--version",
-            action="version",
-            version=f"dotbackup {__VERSION__}",
-            help="Show the version and exit.",
-        )
-        parser.add_argument(
-            "--clean",
-            action="store_true",
-            help=(
-                f"Do clean {typ}, i.e., delete old "
-                f"{'backup' if typ == 'backup' else 'configuration'} "
-                f"files before {typ}."
-            ),
-        )
-        parser.add_argument(
-            "--log-level",
-            default="INFO",
-            choices=("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"),
-            help="Set the log level (default: INFO).",
-        )
-        parser.add_argument(
-            "app",
-            help="Application to be backed up (default: all applications).",
-            nargs="*",
-        )
+class HashReader:
+    """Binary file object wrapper which computes the SHA-256 digest of read data."""
 
-    @classmethod
-    def main_parser(cls):
-        """Return argument parser for dotbackup.py."""
+    def __init__(self, file) -> None:
+        self._file = file
+        self.hash = hashlib.sha256()
 
-        parser = ArgumentParser(
-            prog="dotbackup.py",
-            description="YAML config based backup utility.",
-            epilog="""NOTE: This project has been deprecated, please use its successor
-                at https://github.com/jaxvanyang/dotbackup.rs""",
-        )
-        subparsers = parser.add_subparsers(
-            title="subcommands",
-            dest="command",
-            help="Sub-command to be executed.",
-        )
-        backup_parser = subparsers.add_parser(
-            "backup", help="Do backup based on the YAML configuration."
-        )
-        setup_parser = subparsers.add_parser(
-            "setup", help="Do setup based on the YAML configuration."
-        )
+    def read(self, size=-1) -> bytes:
+        data = self._file.read(size)
+        self.hash.update(data)
+        return data
 
-        cls._add_arguments(backup_parser)
-        cls._add_arguments(setup_parser, typ="setup")
 
-        return parser
+class HookShell:
+    """Shell session which runs hook commands one after another and reports the exit
+    status of each command, so that many commands share one process.
 
-    @classmethod
-    def dotbackup_parser(cls):
-        """Return argument parser for dotbackup."""
+    Each command is quoted and evaluated in a subshell with stdin redirected from
+    /dev/null, so that neither its state nor its syntax errors leak into the session.
+    The shell exits after the first failed command like "set -e".
+    """
 
-        parser = ArgumentParser(
-            prog="dotbackup",
-            description="Do backup based on the YAML configuration.",
-            epilog="""NOTE: This project has been deprecated, please use its successor
-                at https://github.com/jaxvanyang/dotbackup.rs""",
-        )
-        cls._add_arguments(parser)
+    _TEMPLATE = (
+        "(eval '{command}') </dev/null\n"
+        "dotbackup_status=$?\n"
+        "echo $dotbackup_status >/dev/fd/{fd}\n"
+        '[ "$dotbackup_status" -eq 0 ] || exit "$dotbackup_status"\n'
+    )
 
-        return parser
+    def __init__(self) -> None:
+        self._status_fd, self._fd = os.pipe()
+        try:
+            # a new session lets kill() stop commands run by the shell as well
+            self._process = subprocess.Popen(
+                ["sh", "-s"],
+                stdin=subprocess.PIPE,
+                text=True,
+                pass_fds=(self._fd,),
+                start_new_session=True,
+            )
+        except BaseException:
+            os.close(self._status_fd)
+            raise
+        finally:
+            os.close(self._fd)
+        self._buffer = b""
 
-    @classmethod
-    def dotsetup_parser(cls):
-        """Return argument parser for dotsetup."""
+    def send(self, command) -> None:
+        """Send command to the shell without waiting for it."""
 
-        parser = ArgumentParser(
-            prog="dotsetup",
-            description="Do setup based on the YAML configuration.",
-            epilog="""NOTE: This project has been deprecated, please use its successor
-                at https://github.com/jaxvanyang/dotbackup.rs""",
-        )
-        cls._add_arguments(parser, typ="setup")
+        with suppress(BrokenPipeError):
+            self._process.stdin.write(
+                self._TEMPLATE.format(
+                    command=command.replace("'", "'\\''"), fd=self._fd
+                )
+            )
+            self._process.stdin.flush()
 
-        return parser
+    def wait(self, timeout=None):
+        """Return the exit status of the next sent command, or None if the shell exits
+        before reporting it.
 
-    @staticmethod
-    def _normpath(path):
-        """Normalize path, expand user home directory, etc."""
+        TimeoutError is raised if the command doesn't finish in timeout seconds.
+        """
 
-        return os.path.normpath(os.path.expanduser(path))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while b"\n" not in self._buffer:
+            if deadline is not None:
+                ready, _, _ = select.select(
+                    [self._status_fd], [], [], max(deadline - time.monotonic(), 0)
+                )
+                if not ready:
+                    raise TimeoutError
+            data = os.read(self._status_fd, 4096)
+            if not data:
+                return None
+            self._buffer += data
 
-    @property
-    def _backup_dir(self):
-        return self._dict["backup_dir"]
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return int(line)
 
-    @property
-    def _clean(self):
-        return self._dict.get("clean", False)
+    def close(self) -> None:
+        if self._process.stdin.closed:
+            return
 
-    @property
-    def _apps_dict(self):
-        return self._dict.get("apps", dict())
+        with suppress(BrokenPipeError):
+            self._process.stdin.close()
+        self._process.wait()
+        os.close(self._status_fd)
 
-    @property
-    def _selected_apps(self) -> list:
-        """Return a list of selected applications.
-        An empty list indicates all applications.
-        """
-        return self._dict["selected_apps"]
+    def kill(self) -> None:
+        """Kill the shell and its running command, and close it."""
 
-    def _safe_run_hooks(self, typ, hook_dict, app=None) -> None:
-        if typ not in hook_dict:
+        if self._process.stdin.closed:
             return
 
-        hook_title = typ if app is None else f"{app} {typ}"
+        with suppress(ProcessLookupError):
+            os.killpg(self._process.pid, signal.SIGKILL)
+        self.close()
 
-        for command in hook_dict[typ]:
-            self._LOGGER.info(f"running {hook_title} hook in shell:\n{command}")
+
+class PollWatcher:
+    """Watch paths for changes by comparing their stat results periodically.
+
+    Directories are only reported when they are created or deleted, since their
+    modification times change with their entries, which are reported themselves.
+    """
+
+    def __init__(self, paths, interval) -> None:
+        self._paths = list(paths)
+        self._interval = interval
+        self._state = self._scan()
+        self._next_scan = time.monotonic() + interval
+
+    def _scan(self) -> dict:
+        state = dict()
+
+        def add(path):
             try:
-                subprocess.run(
-                    "sh -s", shell=True, input=command, text=True, check=True
-                )
-            except subprocess.CalledProcessError:
-                raise RuntimeError(f"command failed: {command}")
+                st = os.lstat(path)
+            except OSError:
+                return False
+            if stat.S_ISDIR(st.st_mode):
+                state[path] = (st.st_mode, st.st_ino)
+                return True
+            state[path] = (st.st_mode, st.st_ino, st.st_size, st.st_mtime_ns)
+            return False
 
-    def _delete_old(self, path: Path):
-        """Delete old file safely."""
+        for path in self._paths:
+            if not add(path):
+                continue
+            for root, dirs, files in os.walk(path):
+                for name in dirs + files:
+                    add(os.path.join(root, name))
 
-        if not path.exists():
-            return
+        return state
 
-        self._LOGGER.info(f"found old {path}, deleting...")
+    def read(self, timeout=None) -> set:
+        """Wait at most timeout seconds and return the changed paths."""
 
-        if path.is_dir():
-            shutil.rmtree(path)
-        else:
-            path.unlink()
+        wait = self._next_scan - time.monotonic()
+        if timeout is not None and timeout < wait:
+            time.sleep(timeout)
+            return set()
 
-    def _check_apps(self) -> bool:
-        """Check whether every selected app in the configured app list."""
+        time.sleep(max(wait, 0))
+        self._next_scan = time.monotonic() + self._interval
+        old, self._state = self._state, self._scan()
+        return {
+            path
+            for path in old.keys() | self._state.keys()
+            if old.get(path) != self._state.get(path)
+        }
 
-        for app in self._selected_apps:
-            if app not in self._apps_dict:
-                self._LOGGER.error(f"application not configured: {app}")
-                return False
+    def close(self) -> None:
+        pass
 
-        return True
 
-    def _get_ignore(self, app_dict):
-        """Return a combination of global and application ignore patterns."""
+class InotifyWatcher:
+    """Watch paths for changes by inotify(7).
 
-        global_ignore = self._dict.get("ignore", [])
-        app_ignore = app_dict.get("ignore", [])
+    The parent directory of each path is watched too, so that the path is reported
+    when it is created, deleted or replaced by a rename.
+    """
 
-        return shutil.ignore_patterns(*global_ignore, *app_ignore)
+    _IN_MODIFY = 0x2
+    _IN_ATTRIB = 0x4
+    _IN_CLOSE_WRITE = 0x8
+    _IN_MOVED_FROM = 0x40
+    _IN_MOVED_TO = 0x80
+    _IN_CREATE = 0x100
+    _IN_DELETE = 0x200
+    _IN_Q_OVERFLOW = 0x4000
+    _IN_IGNORED = 0x8000
+    _IN_ONLYDIR = 0x1000000
+    _IN_ISDIR = 0x40000000
+    _IN_NONBLOCK = os.O_NONBLOCK
+    _IN_CLOEXEC = os.O_CLOEXEC
+    _MASK = (
+        _IN_MODIFY
+        | _IN_ATTRIB
+        | _IN_CLOSE_WRITE
+        | _IN_MOVED_FROM
+        | _IN_MOVED_TO
+        | _IN_CREATE
+        | _IN_DELETE
+        | _IN_ONLYDIR
+    )
+    # events which add or remove a directory entry
+    _ENTRY_EVENTS = _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+    _EVENT = struct.Struct("iIII")
+    _READ_SIZE = 2**16
 
-    def _get_backup_file_path(self, file) -> Path:
-        """Return the backup file path to the source file."""
+    def __init__(self, paths) -> None:
+        import ctypes
 
-        src_path = file if isinstance(file, Path) else Path(self._normpath(file))
-        rel_path = src_path.relative_to(Path.home())
-        return self._normpath(self._backup_dir) / rel_path
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._get_errno = ctypes.get_errno
+        # raise AttributeError if inotify is not available, e.g., on macOS
+        init = self._libc.inotify_init1
+        self._fd = init(self._IN_NONBLOCK | self._IN_CLOEXEC)
+        if self._fd < 0:
+            err = self._get_errno()
+            raise OSError(err, os.strerror(err))
 
-    def _backup_files(self, app, files, ignore) -> None:
-        """Back up files of app except ignore files."""
+        self._paths = list(paths)
+        self._dirs = dict()
+        try:
+            for path in self._paths:
+                self._add(os.path.dirname(path))
+                self._add_tree(path)
+        except BaseException:
+            self.close()
+            raise
 
-        for file in files:
-            src_path = Path(self._normpath(file))
-            dest_path = self._get_backup_file_path(src_path)
+    def _add(self, path) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), self._MASK)
+        if wd >= 0:
+            self._dirs[wd] = path
+            return
 
-            if self._clean:
-                self._delete_old(dest_path)
+        err = self._get_errno()
+        # the directory may be gone or not a directory
+        if err not in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+            raise OSError(err, f"failed to watch {path}: {os.strerror(err)}")
 
-            if not src_path.exists():
-                self._LOGGER.warning(
-                    f"file not found: {file}: skip backing up this file"
-                )
+    def _add_tree(self, path) -> None:
+        if not os.path.isdir(path) or os.path.islink(path):
+            return
+        self._add(path)
+        for root, dirs, _ in os.walk(path):
+            for name in dirs:
+                self._add(os.path.join(root, name))
+
+    def _is_watched(self, path) -> bool:
+        return any(
+            path == root or path.startswith(root + os.sep) for root in self._paths
+        )
+
+    def read(self, timeout=None) -> set:
+        """Wait at most timeout seconds and return the changed paths."""
+
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        data = b""
+        while True:
+            try:
+                chunk = os.read(self._fd, self._READ_SIZE)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            data += chunk
+
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & self._IN_Q_OVERFLOW:
+                changed.update(self._paths)
                 continue
+            if mask & self._IN_IGNORED:
+                self._dirs.pop(wd, None)
+                continue
+
+            root = self._dirs.get(wd)
+            # events of the watched directory itself are reported by its parent
+            if root is None or not name:
+                continue
+            path = os.path.join(root, name)
+            if mask & self._IN_ISDIR and not mask & self._ENTRY_EVENTS:
+                continue
+            if mask & self._IN_ISDIR and mask & (self._IN_CREATE | self._IN_MOVED_TO):
+                if self._is_watched(path):
+                    self._add_tree(path)
+            changed.add(path)
+
+        return changed
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class IgnoreMatcher:
+    """Callable matcher of ignore patterns like the one shutil.ignore_patterns()
+    returns, i.e., it takes a directory and names in it and returns ignored names.
 
-            self._LOGGER.info(f"copying {file} to {dest_path}...")
+    Patterns are compiled once into a few combined regular expressions. Patterns
+    without a slash match names at any depth like fnmatch. Patterns with a slash
+    follow gitignore, i.e., they are anchored at the root given to bind(), and "**"
+    matches any number of directories. A trailing slash matches directories only.
+    """
 
-            if src_path.is_dir():
-                shutil.copytree(src_path, dest_path, dirs_exist_ok=True, ignore=ignore)
+    def __init__(self, patterns, timer=None) -> None:
+        self._patterns = tuple(patterns)
+        self._regexes = self._compile(self._patterns)
+        self._root = None
+        self._lock = threading.Lock()
+        # a PhaseTimer object timing matches as the ignore phase
+        self._timer = timer
+        # number of ignored entries of each pattern
+        self.hits = Counter()
+
+    @staticmethod
+    def _translate(glob) -> str:
+        """Translate glob to a regular expression where wildcards don't match "/"."""
+
+        i, n, res = 0, len(glob), []
+        while i < n:
+            c = glob[i]
+            i += 1
+            if c == "*":
+                while i < n and glob[i] == "*":
+                    i += 1
+                res.append("[^/]*")
+            elif c == "?":
+                res.append("[^/]")
+            elif c == "[" and "]" in glob[i + 1 :]:
+                j = glob.index("]", i + 1)
+                chars = glob[i:j]
+                negate = chars.startswith("!") and len(chars) > 1
+                if negate:
+                    chars = chars[1:]
+                chars = re.sub(r"([\\\[\]^])", r"\\\1", chars)
+                res.append(f"[{'^' if negate else ''}{chars}]")
+                i = j + 1
             else:
-                dest_path.parent.mkdir(parents=True, exist_ok=True)
-                shutil.copy2(src_path, dest_path)
+                res.append(re.escape(c))
 
-    def _setup_files(self, app, files, ignore) -> None:
-        """Set up files of app except ignore files."""
+        return "".join(res)
 
-        for file in files:
-            dest_path = Path(self._normpath(file))
-            src_path = self._get_backup_file_path(dest_path)
+    @classmethod
+    def _translate_path(cls, pattern) -> str:
+        """Translate gitignore style pattern to a regular expression matching paths
+        relative to the root.
+        """
 
-            if self._clean:
-                self._delete_old(dest_path)
+        segments = pattern.strip("/").split("/")
+        res = []
+        for i, segment in enumerate(segments):
+            last = i == len(segments) - 1
+            if segment == "**":
+                res.append(".*" if last else "(?:[^/]+/)*")
+            else:
+                res.append(cls._translate(segment) + ("" if last else "/"))
 
-            if not src_path.exists():
-                self._LOGGER.warning(
-                    f"file not found: {src_path}: skip setting up this file"
-                )
-                continue
+        return "".join(res)
 
-            self._LOGGER.info(f"copying {src_path} to {dest_path}...")
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def _compile(patterns) -> list:
+        """Return a list of (regex, anchored, dir_only) tuples which patterns are
+        compiled into, where each group name of regex is "p" followed by the index of
+        the pattern. Results are cached so that apps share compiled patterns.
+        """
 
-            if src_path.is_dir():
-                shutil.copytree(src_path, dest_path, dirs_exist_ok=True, ignore=ignore)
+        groups = {}
+        for i, pattern in enumerate(patterns):
+            anchored = "/" in pattern.rstrip("/")
+            dir_only = pattern.endswith("/")
+            if anchored:
+                regex = IgnoreMatcher._translate_path(pattern)
             else:
-                dest_path.parent.mkdir(parents=True, exist_ok=True)
-                shutil.copy2(src_path, dest_path)
+                regex = IgnoreMatcher._translate(pattern.rstrip("/"))
+            groups.setdefault((anchored, dir_only), []).append(f"(?P<p{i}>{regex})")
 
-    def _set_env(self) -> None:
-        """Set environment variable."""
-        os.environ["BACKUP_DIR"] = self._backup_dir
+        return [
+            (re.compile(f"(?:{'|'.join(regexes)})\\Z", re.DOTALL), anchored, dir_only)
+            for (anchored, dir_only), regexes in sorted(groups.items())
+        ]
 
-    def _list_apps(self) -> None:
-        """List configured applications."""
-        print("\n".join(self._apps_dict.keys()))
+    @property
+    def patterns(self) -> tuple:
+        return self._patterns
 
-    def backup(self) -> int:
-        """Do backup."""
+    @property
+    def root(self):
+        return self._root
 
-        if not self._check_apps():
-            return 1
+    def bind(self, root) -> "IgnoreMatcher":
+        """Return a matcher sharing hit counts whose anchored patterns are relative to
+        root.
+        """
 
-        self._set_env()
+        matcher = copy.copy(self)
+        matcher._root = os.fspath(root)
+        return matcher
 
-        self._safe_run_hooks("pre_backup", self._dict)
+    def _get_rel_dir(self, path):
+        """Return the path relative to the root with a trailing slash, or None if the
+        path is not under the root.
+        """
 
-        apps = self._selected_apps if self._selected_apps else self._apps_dict.keys()
+        if self._root is None:
+            return None
+        if path == self._root:
+            return ""
+        prefix = self._root.rstrip(os.sep) + os.sep
+        if path.startswith(prefix):
+            return path[len(prefix) :].replace(os.sep, "/") + "/"
+        return None
 
-        for app in apps:
-            app_dict = self._apps_dict[app]
+    def __call__(self, path, names, is_dir=None) -> set:
+        """Return ignored names in the directory path.
 
-            self._LOGGER.info(f"doing {app} backup...")
-            self._safe_run_hooks("pre_backup", app_dict, app=app)
+        is_dir(name) tells whether a name is a directory for patterns with a trailing
+        slash, which defaults to checking the file system.
+        """
 
-            if "files" in app_dict:
-                self._backup_files(app, app_dict["files"], self._get_ignore(app_dict))
+        if self._timer is not None:
+            with self._timer.phase("ignore"):
+                return self._match(os.fspath(path), names, is_dir)
 
-            self._safe_run_hooks("post_backup", app_dict, app=app)
+        return self._match(os.fspath(path), names, is_dir)
 
-        self._safe_run_hooks("post_backup", self._dict)
+    def _match(self, path, names, is_dir) -> set:
+        rel_dir = self._get_rel_dir(path)
+        ignored = set()
+        hits = []
 
-        return 0
+        for name in names:
+            for regex, anchored, dir_only in self._regexes:
+                if anchored:
+                    if rel_dir is None:
+                        continue
+                    match = regex.match(rel_dir + name)
+                else:
+                    match = regex.match(name)
+                if match is None:
+                    continue
+                if dir_only and not (
+                    os.path.isdir(os.path.join(path, name))
+                    if is_dir is None
+                    else is_dir(name)
+                ):
+                    continue
+                ignored.add(name)
+                hits.append(self._patterns[int(match.lastgroup[1:])])
+                break
 
-    def setup(self) -> int:
-        """Do setup."""
+        if hits:
+            with self._lock:
+                self.hits.update(hits)
 
-        if not self._check_apps():
-            return 1
+        return ignored
 
-        self._set_env()
 
-        self._safe_run_hooks("pre_setup", self._dict)
+class DirCache:
+    """Directory entries recorded by incremental backups, by which directories
+    unchanged since the last backup are not listed again.
 
-        apps = self._selected_apps if self._selected_apps else self._apps_dict.keys()
+    Entries map directory paths to [mtime, inode number, file count, subdirectory
+    names] lists. Adding, removing or renaming a file updates the mtime of its
+    directory, so the files of a directory with the same mtime and inode number are
+    the ones in the manifest, and their manifest entries are carried over without
+    stat calls. Editing a file in place doesn't, which is why full walks are done
+    from time to time.
+    """
 
-        for app in apps:
-            app_dict = self._apps_dict[app]
+    # directories modified this recently may still change within the same mtime
+    _RACY_NS = 2 * 10**9
+
+    def __init__(self, entries, files, new_files) -> None:
+        self._entries = entries
+        self._files = files
+        self._new_files = new_files
+        self._children = defaultdict(list)
+        for path in files:
+            self._children[os.path.dirname(path)].append(path)
+        self._verify = False
+        self._lock = threading.Lock()
+        self.new_entries = dict()
+        # numbers of directories which are listed or not
+        self.stats = Counter()
+
+    def bind(self, verify) -> "DirCache":
+        """Return a cache sharing entries which only records them if verify is True."""
+
+        cache = copy.copy(self)
+        cache._verify = verify
+        return cache
+
+    def get(self, root, st):
+        """Return paths of subdirectories of root if it's unchanged, None otherwise.
+
+        st is the stat result of root. Manifest entries of the files in unchanged
+        root are carried over.
+        """
+
+        entry = self._entries.get(root)
+        if (
+            self._verify
+            or entry is None
+            or entry[:2] != [st.st_mtime_ns, st.st_ino]
+            or len(self._children.get(root, ())) != entry[2]
+        ):
+            with self._lock:
+                self.stats["listed"] += 1
+            return None
+
+        for path in self._children.get(root, ()):
+            self._new_files[path] = self._files[path]
+        self.new_entries[root] = entry
+        with self._lock:
+            self.stats["cached"] += 1
+        return [os.path.join(root, name) for name in entry[3]]
+
+    def put(self, root, st, subdirs, count) -> None:
+        """Record root listed with count files and subdirs, i.e., their paths."""
+
+        if time.time_ns() - st.st_mtime_ns < self._RACY_NS:
+            return
+        names = [os.path.basename(path) for path in subdirs]
+        self.new_entries[root] = [st.st_mtime_ns, st.st_ino, count, names]
+
+
+class PhaseTimer:
+    """Timer of the phases of a run by application for profiling.
+
+    A phase entered in another one pauses it, so that every second of an application
+    is counted in exactly one of its phases, where the time not in any phase is
+    "other". Phases are only timed between start() and stop(), and in one thread.
+    """
+
+    _NULL = nullcontext()
+
+    def __init__(self) -> None:
+        # seconds of each phase by application, None if not timing
+        self.times = None
+        # [app, phase, start] lists of the entered phases
+        self._stack = []
+
+    def start(self) -> None:
+        self.times = defaultdict(Counter)
+        self._stack = []
+
+    def stop(self) -> dict:
+        """Stop timing and return the seconds of each phase by application."""
+
+        times, self.times = self.times, None
+        return times
+
+    def app(self, app):
+        """Return a context in which the time of app not in other phases is
+        "other".
+        """
+
+        return self._time(app, "other")
+
+    def phase(self, phase):
+        """Return a context which is timed as phase of the current application."""
+
+        return self._time(self._stack[-1][0] if self._stack else None, phase)
+
+    def _time(self, app, phase):
+        if self.times is None:
+            return self._NULL
+        return self._timing(app, phase)
+
+    @contextmanager
+    def _timing(self, app, phase):
+        stack = self._stack
+        now = time.perf_counter()
+        if stack:
+            outer_app, outer_phase, start = stack[-1]
+            self.times[outer_app][outer_phase] += now - start
+        stack.append([app, phase, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            _, _, start = stack.pop()
+            if self.times is not None:
+                self.times[app][phase] += now - start
+            if stack:
+                stack[-1][2] = now
+
+
+class FileSpec:
+    """Configured file of an application with its resolved paths."""
+
+    __slots__ = ("file", "path", "rel_path", "root")
+
+    def __init__(self, file, path: Path, rel_path: Path, root: Path = None) -> None:
+        # the file as configured
+        self.file = file
+        # the normalized path
+        self.path = path
+        # the path relative to the home directory and the backup root
+        self.rel_path = rel_path
+        # the normalized path of the configured file which path is in, which
+        # anchored ignore patterns are relative to
+        self.root = path if root is None else root
+
+
+class AppSpec:
+    """Configured application which is validated and resolved once per run."""
+
+    __slots__ = ("name", "files", "ignore", "depends_on", "hooks")
+
+    def __init__(self, name, files, ignore, depends_on, hooks) -> None:
+        self.name = name
+        # a list of FileSpec objects
+        self.files = files
+        # an IgnoreMatcher object, or None if nothing is ignored
+        self.ignore = ignore
+        # a list of application names
+        self.depends_on = depends_on
+        # a dict mapping hook types to hook lists
+        self.hooks = hooks
+
+
+class Storage(abc.ABC):
+    """Storage of backup files under backup_dir, selected by the storage option.
+
+    Backup and setup call begin() before running any hook, then store() or restore()
+    each configured file within open(). The class attributes tell which other
+    options the storage supports.
+    """
+
+    name = None
+    # whether mirror, incremental, snapshot, plan and watch are supported
+    mirror = False
+    incremental = False
+    snapshot = False
+    plan = False
+    watch = False
+
+    def __init__(self, config) -> None:
+        self._config = config
+
+    def check(self) -> None:
+        """Check whether other options are compatible with the storage."""
+
+        for option in ("mirror", "incremental", "snapshot"):
+            if getattr(self._config, f"_{option}") and not getattr(self, option):
+                raise RuntimeError(f"{option} is not supported by {self.name} storage")
+
+    def get_hook_cache_path(self) -> Path:
+        """Return the path of the fingerprints of memoized hooks."""
+
+        return self._config._get_meta_dir() / self._config._HOOK_CACHE_FILE
+
+    def begin(self, typ) -> None:
+        """Prepare for typ, i.e., backup or setup."""
+
+    @contextmanager
+    def open(self, typ):
+        """Open the storage for typ, i.e., backup or setup, and finish it if no error
+        occurred.
+        """
+
+        yield
+
+    @abc.abstractmethod
+    def delete(self, dest_path: Path) -> None:
+        """Delete old backup files of the backup file path dest_path."""
+
+    @abc.abstractmethod
+    def store(self, spec: FileSpec, dest_path: Path, ignore) -> None:
+        """Store the configured file of spec as dest_path except ignore files."""
+
+    @abc.abstractmethod
+    def iter_keys(self, key):
+        """Yield stored keys of the file key or files under the directory key."""
+
+    @abc.abstractmethod
+    def restore(self, spec: FileSpec, src_path: Path, ignore) -> None:
+        """Restore the backup file path src_path to the path of spec except ignore
+        files.
+        """
+
+    def _skip_missing(self, message) -> None:
+        self._config._LOGGER.warning(f"{message}: skip setting up this file")
+        self._config._add_stats(files_missing=1)
+
+    def _get_index_key(self, backup_file) -> str:
+        """Return the index key of the backup file path."""
+
+        config = self._config
+        return os.path.relpath(backup_file, config._normpath(config._backup_dir))
+
+    @staticmethod
+    def _iter_keys(index, keys, key):
+        """Yield keys of index which are the file key or files under the directory
+        key, where keys are the sorted keys of index.
+        """
+
+        if key in index:
+            yield key
+            return
+
+        prefix = key + "/"
+        i = bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix):
+            yield keys[i]
+            i += 1
+
+    def _iter_index_pairs(self, keys, key, dest_path: Path, ignore):
+        """Yield (key, dest) pairs to restore the file key to dest_path, where keys
+        are indexed keys of the file key or files under the directory key.
+        """
+
+        for k in keys:
+            if k == key:
+                yield k, str(dest_path)
+                continue
+
+            rel_path = k[len(key) + 1 :]
+            if ignore is None or not self._config._is_ignored(
+                str(dest_path), rel_path, ignore
+            ):
+                yield k, os.path.join(dest_path, rel_path)
+
+
+class FileStorage(Storage):
+    """Backup files copied as they are, which are mirrored, copied incrementally or
+    linked to the previous snapshot if enabled.
+    """
+
+    name = "files"
+    mirror = True
+    incremental = True
+    snapshot = True
+    plan = True
+    watch = True
+
+    def _is_mirror(self) -> bool:
+        # snapshots are always new, so there is nothing to mirror
+        return bool(self._config._mirror) and not self._config._snapshot
+
+    def _is_incremental(self) -> bool:
+        # unchanged files are linked to the previous snapshot instead
+        return bool(self._config._incremental) and not self._config._snapshot
+
+    def begin(self, typ) -> None:
+        config = self._config
+        if typ != "backup" or not self._is_incremental():
+            return
+
+        if config._dir_cache:
+            config._check_hook_timeout(
+                "verify_interval", config._dict.get("verify_interval")
+            )
+        with config._phase_timer.phase("metadata"):
+            config._start_manifest(dir_cache=config._dir_cache)
+
+    @contextmanager
+    def open(self, typ):
+        yield
+        if typ == "backup" and self._is_incremental():
+            with self._config._phase_timer.phase("metadata"):
+                self._config._save_manifest()
+
+    def delete(self, dest_path: Path) -> None:
+        if not self._is_mirror():
+            self._config._delete_old(dest_path)
+
+    def store(self, spec: FileSpec, dest_path: Path, ignore) -> None:
+        config = self._config
+        src_path = spec.path
+        ignore = config._bind_ignore(ignore, spec, src_path)
+        config._LOGGER.info(f"copying {spec.file} to {dest_path}...")
+
+        if self._is_mirror():
+            config._copy_tree(
+                src_path, dest_path, ignore, config._copy_if_differ, mirror=True
+            )
+        elif config._snapshot:
+            config._copy_tree(src_path, dest_path, ignore, config._link_or_copy)
+        elif config._incremental:
+            config._manifest_roots.add(str(src_path))
+            cache = config._get_dir_cache(spec, dest_path, ignore)
+            config._copy_tree(
+                src_path, dest_path, ignore, config._copy_if_changed, cache=cache
+            )
+        else:
+            config._copy_tree(src_path, dest_path, ignore)
+
+    def iter_keys(self, key):
+        config = self._config
+        root = Path(config._normpath(config._backup_dir))
+        path = root / key
+        if path.is_file():
+            yield key
+        elif path.is_dir():
+            for dir_path, entries in config._walk(str(path)):
+                for entry in entries:
+                    yield self._get_index_key(os.path.join(dir_path, entry.name))
+
+    def restore(self, spec: FileSpec, src_path: Path, ignore) -> None:
+        config = self._config
+        dest_path = spec.path
+        if not src_path.exists():
+            self._skip_missing(f"file not found: {src_path}")
+            return
+
+        ignore = config._bind_ignore(ignore, spec, src_path)
+        config._LOGGER.info(f"copying {src_path} to {dest_path}...")
+        if config._mirror:
+            config._copy_tree(
+                src_path, dest_path, ignore, config._copy_if_differ, mirror=True
+            )
+        else:
+            config._copy_tree(src_path, dest_path, ignore)
+
+
+class ObjectStorage(Storage):
+    """Backup files stored as content-addressed objects with an index."""
+
+    name = "objects"
+    _INDEX_FILE = "index.json"
+    _INDEX_VERSION = 1
+    _OBJECTS_DIR = "objects"
+    _HASH_BUFSIZE = 2**20
+
+    def __init__(self, config) -> None:
+        super().__init__(config)
+        # index entries, their sorted keys and the digests of the loaded index
+        self._index = dict()
+        self._index_keys = []
+        self._indexed_digests = set()
+
+    def begin(self, typ) -> None:
+        with self._config._phase_timer.phase("metadata"):
+            self._index = self._load_index()
+            self._indexed_digests = {entry[0] for entry in self._index.values()}
+            self._index_keys = sorted(self._index)
+
+    @contextmanager
+    def open(self, typ):
+        yield
+        if typ == "backup":
+            with self._config._phase_timer.phase("metadata"):
+                self._save_index()
+
+    def delete(self, dest_path: Path) -> None:
+        key = self._get_index_key(dest_path)
+        keys = list(self.iter_keys(key))
+        if keys:
+            self._config._LOGGER.info(f"found old {key} in index, deleting...")
+        for k in keys:
+            del self._index[k]
+        self._index_keys = sorted(self._index)
+
+    def store(self, spec: FileSpec, dest_path: Path, ignore) -> None:
+        config = self._config
+        config._LOGGER.info(f"storing {spec.file} as objects...")
+        ignore = config._bind_ignore(ignore, spec, spec.path)
+        pairs = config._iter_pairs(spec.path, dest_path, ignore, make_dirs=False)
+        config._copy_files(pairs, self._store_object)
+
+    def iter_keys(self, key):
+        return self._iter_keys(self._index, self._index_keys, key)
+
+    def restore(self, spec: FileSpec, src_path: Path, ignore) -> None:
+        config = self._config
+        dest_path = spec.path
+        ignore = config._bind_ignore(ignore, spec, dest_path)
+        key = self._get_index_key(src_path)
+        if next(self.iter_keys(key), None) is None:
+            self._skip_missing(f"file not found in index: {key}")
+            return
+
+        config._LOGGER.info(f"restoring {key} from objects to {dest_path}...")
+        pairs = self._iter_index_pairs(self.iter_keys(key), key, dest_path, ignore)
+        config._copy_files(pairs, self._restore_object)
+
+    def _load_index(self) -> dict:
+        """Return the entries of the object storage index.
+
+        An index entry maps a backup file path relative to backup_dir to its
+        [digest, mode, mtime_ns, size].
+        """
+
+        path = self._config._get_meta_dir() / self._INDEX_FILE
+
+        try:
+            with open(path, encoding="utf-8") as f:
+                index = json.load(f)
+
+            if index["version"] != self._INDEX_VERSION:
+                raise ValueError(f"unsupported version: {index['version']}")
+            if not isinstance(index["files"], dict):
+                raise ValueError("files is not a mapping")
+        except FileNotFoundError:
+            return dict()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            raise RuntimeError(f"corrupt index: {path}: {e}")
+
+        return index["files"]
+
+    def _save_index(self) -> None:
+        """Save the object storage index atomically and delete unused objects."""
+
+        config = self._config
+        path = config._get_meta_dir() / self._INDEX_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with open(tmp_path, mode="w", encoding="utf-8") as f:
+            json.dump(
+                {"version": self._INDEX_VERSION, "files": self._index},
+                f,
+                separators=(",", ":"),
+            )
+        os.replace(tmp_path, path)
+
+        used = {entry[0] for entry in self._index.values()}
+        for digest in self._indexed_digests - used:
+            config._LOGGER.debug(f"deleting unused object {digest}...")
+            self._get_object_path(digest).unlink(missing_ok=True)
+
+    def _get_object_path(self, digest) -> Path:
+        """Return the object path of the content digest."""
+
+        meta_dir = self._config._get_meta_dir()
+        return meta_dir / self._OBJECTS_DIR / digest[:2] / digest[2:]
+
+    @classmethod
+    def _hash_file(cls, path) -> str:
+        """Return the SHA-256 hex digest of the file content."""
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while True:
+                data = f.read(cls._HASH_BUFSIZE)
+                if not data:
+                    break
+                digest.update(data)
+
+        return digest.hexdigest()
+
+    def _store_object(self, src, dest) -> None:
+        """Store the content of src as an object and index it by dest.
+
+        Files whose metadata match the index entry are not read again, and the
+        content is only written if no object has the same digest.
+        """
+
+        config = self._config
+        key = self._get_index_key(dest)
+        path = os.fspath(src)
+        st = config._stat(src)
+        meta = [st.st_mode, st.st_mtime_ns, st.st_size]
+        entry = self._index.get(key)
+
+        if entry is not None and entry[1:] == meta:
+            if self._get_object_path(entry[0]).exists():
+                config._LOGGER.debug(f"skipping unchanged {path}")
+                config._add_stats(files_skipped=1)
+                return
+
+        digest = self._hash_file(src)
+        obj_path = self._get_object_path(digest)
+
+        if obj_path.exists():
+            config._LOGGER.debug(f"found object {digest} of {path}")
+            config._add_stats(files_skipped=1)
+        else:
+            config._LOGGER.debug(f"storing {path} as object {digest}...")
+            obj_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = obj_path.with_name(f"{obj_path.name}.{threading.get_ident()}")
+            with open(src, "rb") as fsrc, open(tmp_path, "wb") as fdst:
+                method = config._copy_data(fsrc, fdst, st)
+            os.replace(tmp_path, obj_path)
+
+            with config._lock:
+                config._copy_method_counter[method] += 1
+            config._add_stats(files_copied=1, bytes_copied=st.st_size)
+
+        self._index[key] = [digest, *meta]
+
+    def _restore_object(self, key, dest) -> None:
+        """Restore the indexed file key to dest with its mode and mtime."""
+
+        config = self._config
+        digest, mode, mtime_ns, size = self._index[key]
+
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(self._get_object_path(digest), "rb") as fsrc, open(
+            dest, "wb"
+        ) as fdst:
+            method = config._copy_data(fsrc, fdst)
+        os.chmod(dest, stat.S_IMODE(mode))
+        os.utime(dest, ns=(mtime_ns, mtime_ns))
+
+        with config._lock:
+            config._copy_method_counter[method] += 1
+        config._add_stats(files_copied=1, bytes_copied=size)
+
+
+class ArchiveStorage(Storage):
+    """Backup files written to a new tar archive, i.e., backup_dir, by every backup."""
+
+    name = "archive"
+    _ARCHIVE_SUFFIXES = {
+        ".tar": None,
+        ".tar.gz": "gz",
+        ".tgz": "gz",
+        ".tar.xz": "xz",
+        ".tar.bz2": "bz2",
+        ".tar.zst": "zst",
+    }
+    _ARCHIVE_INDEX_SUFFIX = ".idx.json"
+    _ARCHIVE_INDEX_VERSION = 1
+    _ARCHIVE_FRAME_SIZE = 2**20
+    _ARCHIVE_READ_SIZE = 2**16
+
+    def __init__(self, config) -> None:
+        super().__init__(config)
+        # members of the archive index, which is None if the archive is scanned
+        self._archive_index = None
+        self._archive_keys = []
+        self._archive_frames = []
+        self._tar = None
+
+    def check(self) -> None:
+        super().check()
+        self._get_archive_compression()
+
+    def get_hook_cache_path(self) -> Path:
+        path = self._get_archive_path()
+        return path.with_name(path.name + self._config._HOOK_CACHE_SUFFIX)
+
+    def begin(self, typ) -> None:
+        if typ != "setup":
+            return
+
+        if not self._get_archive_path().is_file():
+            raise RuntimeError(f"archive not found: {self._config._backup_dir}")
+        self._load_archive_index()
+
+    @contextmanager
+    def open(self, typ):
+        if typ != "backup":
+            yield
+            return
+
+        with self._archive_writer():
+            yield
+
+    def delete(self, dest_path: Path) -> None:
+        # the archive is always written from scratch
+        pass
+
+    def store(self, spec: FileSpec, dest_path: Path, ignore) -> None:
+        config = self._config
+        config._LOGGER.info(f"archiving {spec.file} to {config._backup_dir}...")
+        ignore = config._bind_ignore(ignore, spec, spec.path)
+        pairs = config._iter_pairs(spec.path, dest_path, ignore, make_dirs=False)
+        for src, dest in pairs:
+            config._run_copy(self._add_to_archive, src, dest)
+
+    def iter_keys(self, key):
+        if self._archive_index is not None:
+            yield from self._iter_keys(self._archive_index, self._archive_keys, key)
+            return
+
+        with self._open_archive() as tar:
+            for member in tar:
+                if member.isfile() and self._match_keys(member.name, [key]):
+                    yield member.name
+
+    def restore(self, spec: FileSpec, src_path: Path, ignore) -> None:
+        config = self._config
+        dest_path = spec.path
+        ignore = config._bind_ignore(ignore, spec, dest_path)
+        key = self._get_index_key(src_path)
+        config._LOGGER.info(f"extracting {key} from {config._backup_dir}...")
+
+        if self._archive_index is None:
+            found = self._extract_from_archive(key, dest_path, ignore)
+        else:
+            keys = list(self.iter_keys(key))
+            pairs = self._iter_index_pairs(keys, key, dest_path, ignore)
+            config._copy_files(pairs, self._restore_member)
+            found = bool(keys)
+
+        if not found:
+            self._skip_missing(f"file not found in archive: {key}")
+
+    def _get_archive_path(self) -> Path:
+        """Return the archive path, i.e., the normalized backup_dir."""
+
+        config = self._config
+        return Path(config._normpath(config._backup_dir))
+
+    def _get_archive_compression(self):
+        """Return the archive compression according to the backup_dir suffix."""
+
+        name = self._get_archive_path().name
+        for suffix, compression in self._ARCHIVE_SUFFIXES.items():
+            if name.endswith(suffix):
+                return compression
+
+        raise RuntimeError(
+            f"unknown archive type: {self._config._backup_dir}: must end with one of "
+            f"{', '.join(self._ARCHIVE_SUFFIXES)}"
+        )
+
+    @staticmethod
+    def _import_zstandard():
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstandard is required for .tar.zst archives")
+
+        return zstandard
+
+    def _get_compressor_factory(self):
+        """Return a function which returns a new compressor object of the archive
+        compression, or None if the archive is not compressed.
+        """
+
+        compression = self._get_archive_compression()
+
+        if compression == "gz":
+            return lambda: zlib.compressobj(wbits=31)
+        if compression == "xz":
+            return lzma.LZMACompressor
+        if compression == "bz2":
+            return bz2.BZ2Compressor
+        if compression == "zst":
+            return self._import_zstandard().ZstdCompressor().compressobj
+
+        return None
+
+    def _get_decompressor(self):
+        """Return a new decompressor object for a frame of the archive, or None if
+        the archive is not compressed.
+        """
+
+        compression = self._get_archive_compression()
+
+        if compression == "gz":
+            return zlib.decompressobj(wbits=31)
+        if compression == "xz":
+            return lzma.LZMADecompressor()
+        if compression == "bz2":
+            return bz2.BZ2Decompressor()
+        if compression == "zst":
+            return self._import_zstandard().ZstdDecompressor().decompressobj()
+
+        return None
+
+    def _get_archive_index_path(self) -> Path:
+        path = self._get_archive_path()
+        return path.with_name(path.name + self._ARCHIVE_INDEX_SUFFIX)
+
+    def _load_archive_index(self) -> bool:
+        """Load the archive index written along with the archive.
+
+        Return False if the index is missing, corrupt or out of date, in which case
+        the archive has to be scanned.
+        """
+
+        config = self._config
+        path = self._get_archive_index_path()
+
+        try:
+            with open(path, encoding="utf-8") as f:
+                index = json.load(f)
+
+            if index["version"] != self._ARCHIVE_INDEX_VERSION:
+                raise ValueError(f"unsupported version: {index['version']}")
+            if index["archive_size"] != self._get_archive_path().stat().st_size:
+                raise ValueError("archive size mismatch")
+            if not isinstance(index["members"], dict):
+                raise ValueError("members is not a mapping")
+            frames = index["frames"]
+        except FileNotFoundError:
+            config._LOGGER.info("archive index not found, scanning archive...")
+            return False
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            config._LOGGER.warning(
+                f"invalid archive index: {path}: {e}: scanning archive instead"
+            )
+            return False
+
+        self._archive_index = index["members"]
+        self._archive_keys = sorted(self._archive_index)
+        self._archive_frames = frames
+
+        return True
+
+    @contextmanager
+    def _open_archive(self):
+        """Open the archive for reading as a stream of members."""
+
+        path = self._get_archive_path()
+        compression = self._get_archive_compression()
+
+        if compression == "gz":
+            fileobj = gzip.open(path)
+        elif compression == "xz":
+            fileobj = lzma.open(path)
+        elif compression == "bz2":
+            fileobj = bz2.open(path)
+        elif compression == "zst":
+            zstandard = self._import_zstandard()
+            fileobj = zstandard.ZstdDecompressor().stream_reader(
+                open(path, "rb"), read_across_frames=True, closefd=True
+            )
+        else:
+            fileobj = open(path, "rb")
+
+        try:
+            with tarfile.open(fileobj=fileobj, mode="r|") as tar:
+                yield tar
+        finally:
+            fileobj.close()
+
+    @contextmanager
+    def _archive_writer(self):
+        """Write backup files to a new archive which replaces the old one if no
+        error occurred.
+
+        The archive is compressed in frames of about _ARCHIVE_FRAME_SIZE bytes,
+        and an index of [frame, offset, size, digest, mode, mtime] of each file is
+        written along with it, so that files can be restored without scanning the
+        whole archive.
+        """
+
+        path = self._get_archive_path()
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        index_path = self._get_archive_index_path()
+        tmp_index_path = index_path.with_name(f"{index_path.name}.tmp")
+        new_compressor = self._get_compressor_factory()
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._archive_lock = threading.Lock()
+        self._archived = dict()
+
+        with open(tmp_path, "wb") as f:
+            self._archive_out = CompressWriter(f, new_compressor)
+            try:
+                self._tar = tarfile.open(
+                    fileobj=self._archive_out, mode="w", dereference=True
+                )
+                yield
+                self._carry_over_archive()
+                self._tar.close()
+                self._archive_out.close()
+            except BaseException:
+                with suppress(Exception):
+                    self._archive_out.close()
+                tmp_path.unlink(missing_ok=True)
+                raise
+            finally:
+                self._tar = None
+
+        with open(tmp_index_path, mode="w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": self._ARCHIVE_INDEX_VERSION,
+                    "archive_size": tmp_path.stat().st_size,
+                    "frames": self._archive_out.frames,
+                    "members": self._archived,
+                },
+                f,
+                separators=(",", ":"),
+            )
+
+        # never leave an index of another archive
+        index_path.unlink(missing_ok=True)
+        os.replace(tmp_path, path)
+        os.replace(tmp_index_path, index_path)
+        self._config._LOGGER.info(f"archived {len(self._archived)} files to {path}")
+
+    def _add_member(self, tarinfo, fileobj) -> None:
+        """Add a member to the archive and index it if it is a regular file."""
+
+        with self._archive_lock:
+            out = self._archive_out
+            if out.tell() - out.frame_offset >= self._ARCHIVE_FRAME_SIZE:
+                out.new_frame()
+
+            if not tarinfo.isfile():
+                self._tar.addfile(tarinfo, fileobj)
+                return
+
+            reader = HashReader(fileobj)
+            self._tar.addfile(tarinfo, reader)
+
+            blocks = -(-tarinfo.size // tarfile.BLOCKSIZE)
+            offset = out.tell() - blocks * tarfile.BLOCKSIZE - out.frame_offset
+            self._archived[tarinfo.name] = [
+                out.frame,
+                offset,
+                tarinfo.size,
+                reader.hash.hexdigest(),
+                tarinfo.mode & 0o7777,
+                int(tarinfo.mtime),
+            ]
+
+    def _add_to_archive(self, src, dest) -> None:
+        """Add file src to the archive as the backup file dest."""
+
+        arcname = self._get_index_key(dest)
+
+        with open(src, "rb") as f:
+            tarinfo = self._tar.gettarinfo(arcname=arcname, fileobj=f)
+            self._add_member(tarinfo, f)
+        self._config._add_stats(files_copied=1, bytes_copied=tarinfo.size)
+
+    @staticmethod
+    def _match_keys(name, keys) -> bool:
+        """Return True if name is one of keys or under one of them."""
+
+        return any(name == key or name.startswith(key + "/") for key in keys)
+
+    def _carry_over_archive(self) -> None:
+        """Copy members of unselected applications from the old archive, so that the
+        new archive is complete.
+        """
+
+        config = self._config
+        if not config._selected_apps or not self._get_archive_path().is_file():
+            return
+
+        root = config._get_backup_root()
+        keys = [
+            self._get_index_key(root / spec.rel_path)
+            for app, app_spec in config._get_plan().items()
+            if app not in config._selected_apps
+            for spec in app_spec.files
+        ]
+
+        with self._open_archive() as tar:
+            for member in tar:
+                if member.name in self._archived or not self._match_keys(
+                    member.name, keys
+                ):
+                    continue
+
+                config._LOGGER.debug(f"carrying over {member.name}...")
+                fileobj = tar.extractfile(member) if member.isfile() else None
+                self._add_member(member, fileobj)
+
+    def _iter_member_data(self, key):
+        """Yield data of the indexed archive member key."""
+
+        frame, offset, size, *_ = self._archive_index[key]
+        frame_offset = self._archive_frames[frame][0]
+        decompressor = self._get_decompressor()
+
+        with open(self._get_archive_path(), "rb") as f:
+            if decompressor is None:
+                f.seek(frame_offset + offset)
+                while size > 0:
+                    data = f.read(min(size, self._ARCHIVE_READ_SIZE))
+                    if not data:
+                        break
+                    size -= len(data)
+                    yield data
+            else:
+                f.seek(frame_offset)
+                while size > 0 and not getattr(decompressor, "eof", False):
+                    chunk = f.read(self._ARCHIVE_READ_SIZE)
+                    if not chunk:
+                        break
+
+                    data = decompressor.decompress(chunk)
+                    if offset:
+                        skipped = min(offset, len(data))
+                        data = data[skipped:]
+                        offset -= skipped
+                    data = data[:size]
+                    size -= len(data)
+                    if data:
+                        yield data
+
+        if size > 0:
+            raise RuntimeError(f"unexpected end of archive: {key}")
+
+    def _restore_member(self, key, dest) -> None:
+        """Restore the indexed archive member key to dest with its mode and mtime."""
+
+        *_, digest, mode, mtime = self._archive_index[key]
+        hash = hashlib.sha256()
+        size = 0
+
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(dest, "wb") as f:
+            for data in self._iter_member_data(key):
+                hash.update(data)
+                f.write(data)
+                size += len(data)
+
+        if hash.hexdigest() != digest:
+            raise RuntimeError(f"checksum mismatch: {key}")
+
+        os.chmod(dest, mode)
+        os.utime(dest, (mtime, mtime))
+        self._config._add_stats(files_copied=1, bytes_copied=size)
+
+    def _extract_from_archive(self, key, dest_path: Path, ignore) -> int:
+        """Extract files of the backup file key in the archive to dest_path.
+
+        Return the number of extracted files.
+        """
+
+        config = self._config
+        count = 0
+
+        with self._open_archive() as tar:
+            for member in tar:
+                if not member.isfile() or not self._match_keys(member.name, [key]):
+                    continue
+
+                if member.name == key:
+                    dest = str(dest_path)
+                else:
+                    rel_path = member.name[len(key) + 1 :]
+                    if ignore is not None and config._is_ignored(
+                        str(dest_path), rel_path, ignore
+                    ):
+                        continue
+                    dest = os.path.join(dest_path, rel_path)
+
+                config._LOGGER.debug(f"extracting {member.name} to {dest}...")
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                with config._phase_timer.phase("copy"):
+                    with tar.extractfile(member) as fsrc, open(dest, "wb") as fdst:
+                        shutil.copyfileobj(fsrc, fdst)
+                    os.chmod(dest, member.mode)
+                    os.utime(dest, (member.mtime, member.mtime))
+                config._add_stats(files_copied=1, bytes_copied=member.size)
+                count += 1
+
+        return count
+
+
+class SqliteStorage(Storage):
+    """Backup files stored in a SQLite database in the meta directory."""
+
+    name = "sqlite"
+    _DATABASE_FILE = "files.sqlite3"
+    _DATABASE_VERSION = 1
+    _DATABASE_CHUNK_SIZE = 2**20
+    # files and bytes written in a transaction
+    _DATABASE_BATCH = 2**10
+    _DATABASE_BATCH_SIZE = 2**26
+
+    def __init__(self, config) -> None:
+        super().__init__(config)
+        # the open database and the metadata rows of its files
+        self._db = None
+        self._db_meta = dict()
+        self._db_keys = []
+
+    def begin(self, typ) -> None:
+        path = self._get_database_path()
+        if typ == "setup" and not path.is_file():
+            raise RuntimeError(f"database not found: {path}")
+
+    @contextmanager
+    def open(self, typ):
+        with self._database(write=typ == "backup"):
+            yield
+
+    def delete(self, dest_path: Path) -> None:
+        self._delete_rows(self._get_index_key(dest_path))
+
+    def store(self, spec: FileSpec, dest_path: Path, ignore) -> None:
+        config = self._config
+        config._LOGGER.info(f"storing {spec.file} in database...")
+        ignore = config._bind_ignore(ignore, spec, spec.path)
+        pairs = config._iter_pairs(spec.path, dest_path, ignore, make_dirs=False)
+        config._copy_files(pairs, self._store_row)
+
+    def iter_keys(self, key):
+        return self._iter_keys(self._db_meta, self._db_keys, key)
+
+    def restore(self, spec: FileSpec, src_path: Path, ignore) -> None:
+        config = self._config
+        dest_path = spec.path
+        ignore = config._bind_ignore(ignore, spec, dest_path)
+        key = self._get_index_key(src_path)
+        keys = list(self.iter_keys(key))
+        if not keys:
+            self._skip_missing(f"file not found in database: {key}")
+            return
+
+        config._LOGGER.info(f"restoring {key} from database to {dest_path}...")
+        pairs = self._iter_index_pairs(keys, key, dest_path, ignore)
+        config._copy_files(pairs, self._restore_row)
+
+    def _get_database_path(self) -> Path:
+        """Return the path of the database of sqlite storage."""
+
+        return self._config._get_meta_dir() / self._DATABASE_FILE
+
+    @staticmethod
+    def _import_sqlite3():
+        try:
+            import sqlite3
+        except ImportError:
+            raise RuntimeError("sqlite3 is required for sqlite storage")
+
+        return sqlite3
+
+    @contextmanager
+    def _database(self, write=False):
+        """Open the database of sqlite storage, for backup if write is True.
+
+        The database has a files table of the paths relative to backup_dir, modes,
+        mtimes, sizes and owners of backup files, and a chunks table of their
+        contents in chunks of _DATABASE_CHUNK_SIZE bytes. Stored files are
+        committed in batches of _DATABASE_BATCH files or _DATABASE_BATCH_SIZE bytes,
+        and the last batch is rolled back if an error occurred.
+        """
+
+        sqlite3 = self._import_sqlite3()
+        path = self._get_database_path()
+        if write:
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+        # transactions are handled explicitly
+        db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        try:
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            if version == 0 and write:
+                db.execute("PRAGMA journal_mode = WAL")
+                db.execute(
+                    "CREATE TABLE files (path TEXT PRIMARY KEY, mode INTEGER, "
+                    "mtime_ns INTEGER, size INTEGER, uid INTEGER, gid INTEGER)"
+                )
+                db.execute(
+                    "CREATE TABLE chunks (path TEXT, seq INTEGER, data BLOB, "
+                    "PRIMARY KEY (path, seq))"
+                )
+                db.execute(f"PRAGMA user_version = {self._DATABASE_VERSION}")
+            elif version != self._DATABASE_VERSION:
+                raise ValueError(f"unsupported version: {version}")
+            db.execute("PRAGMA synchronous = NORMAL")
+
+            rows = db.execute("SELECT path, mode, mtime_ns, size, uid, gid FROM files")
+            self._db_meta = {row[0]: list(row[1:]) for row in rows}
+        except (sqlite3.Error, ValueError) as e:
+            db.close()
+            raise RuntimeError(f"corrupt database: {path}: {e}")
+
+        self._db = db
+        self._db_keys = sorted(self._db_meta)
+        self._db_lock = threading.Lock()
+        self._db_batch = [0, 0]
+        self._db_stored = 0
+
+        try:
+            if write:
+                db.execute("BEGIN")
+            yield
+            if write:
+                db.execute("COMMIT")
+        except BaseException:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+        finally:
+            db.close()
+            self._db = None
+
+        if self._db_stored:
+            self._config._LOGGER.info(f"stored {self._db_stored} files in {path}")
+
+    def _delete_rows(self, key) -> None:
+        """Delete rows of the file key or files under the directory key."""
+
+        with self._db_lock:
+            keys = list(self._iter_keys(self._db_meta, self._db_keys, key))
+            if keys:
+                self._config._LOGGER.info(f"found old {key} in database, deleting...")
+            params = [(k,) for k in keys]
+            self._db.executemany("DELETE FROM files WHERE path = ?", params)
+            self._db.executemany("DELETE FROM chunks WHERE path = ?", params)
+            for k in keys:
+                del self._db_meta[k]
+            self._db_keys = sorted(self._db_meta)
+
+    def _store_row(self, src, dest) -> None:
+        """Store the content and metadata of src in the database as dest.
+
+        Files whose metadata match the database are not read again. Each file is
+        written in a savepoint, so that a failed file is never committed.
+        """
+
+        config = self._config
+        key = self._get_index_key(dest)
+        st = config._stat(src)
+        meta = [st.st_mode, st.st_mtime_ns, st.st_size, st.st_uid, st.st_gid]
+
+        if self._db_meta.get(key) == meta:
+            config._LOGGER.debug(f"skipping unchanged {os.fspath(src)}")
+            config._add_stats(files_skipped=1)
+            return
+
+        config._LOGGER.debug(f"storing {os.fspath(src)} as {key}...")
+        db = self._db
+        with open(src, "rb") as f, self._db_lock:
+            db.execute("SAVEPOINT file")
+            try:
+                db.execute("DELETE FROM chunks WHERE path = ?", (key,))
+                db.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, *meta),
+                )
+                for seq in itertools.count():
+                    data = f.read(self._DATABASE_CHUNK_SIZE)
+                    if not data:
+                        break
+                    db.execute("INSERT INTO chunks VALUES (?, ?, ?)", (key, seq, data))
+            except BaseException:
+                db.execute("ROLLBACK TO file")
+                raise
+            finally:
+                db.execute("RELEASE file")
+
+            self._db_meta[key] = meta
+            self._db_stored += 1
+            batch = self._db_batch
+            batch[0] += 1
+            batch[1] += st.st_size
+            if (
+                batch[0] >= self._DATABASE_BATCH
+                or batch[1] >= self._DATABASE_BATCH_SIZE
+            ):
+                db.execute("COMMIT")
+                db.execute("BEGIN")
+                batch[:] = [0, 0]
+
+        config._add_stats(files_copied=1, bytes_copied=st.st_size)
+
+    def _restore_row(self, key, dest) -> None:
+        """Restore the file key in the database to dest with its metadata.
+
+        The owner is only restored if permitted.
+        """
+
+        mode, mtime_ns, size, uid, gid = self._db_meta[key]
+
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        with open(dest, "wb") as f:
+            for seq in itertools.count():
+                with self._db_lock:
+                    row = self._db.execute(
+                        "SELECT data FROM chunks WHERE path = ? AND seq = ?", (key, seq)
+                    ).fetchone()
+                if row is None:
+                    break
+                f.write(row[0])
+
+        if (uid, gid) != (os.geteuid(), os.getegid()):
+            with suppress(PermissionError):
+                os.chown(dest, uid, gid)
+        os.chmod(dest, stat.S_IMODE(mode))
+        os.utime(dest, ns=(mtime_ns, mtime_ns))
+        self._config._add_stats(files_copied=1, bytes_copied=size)
+
+
+class Config:
+    """Configuration of dotbackup with helper functions."""
+
+    _CONFIG_DIR = "~/.config/dotbackup"
+    _DEFAULT_CONFIG_FILE = f"{_CONFIG_DIR}/dotbackup.yml"
+    _META_DIR = ".dotbackup"
+    _MANIFEST_FILE = "manifest.json"
+    _MANIFEST_VERSION = 1
+    _STORAGES = {
+        storage.name: storage
+        for storage in (FileStorage, ObjectStorage, ArchiveStorage, SqliteStorage)
+    }
+    _JOB_QUEUE_FACTOR = 4
+    _COPY_METHODS = ("auto", "reflink", "kernel", "buffered")
+    _PLAN_VERSION = 1
+    _PLAN_OPERATIONS = ("run-hook", "mkdir", "delete", "copy", "skip-unchanged")
+    # required keys of plan operations and their types
+    _PLAN_OPERATION_KEYS = {
+        "run-hook": {"type": str, "hooks": list},
+        "mkdir": {"path": str},
+        "delete": {"path": str},
+        "copy": {"src": str, "dest": str},
+        "skip-unchanged": {"src": str, "dest": str},
+    }
+    _PLAN_KEYS = {
+        "command": str,
+        "backup_dir": str,
+        "mirror": bool,
+        "incremental": bool,
+        "roots": list,
+        "operations": list,
+    }
+    _HOOK_TYPES = ("pre_backup", "post_backup", "pre_setup", "post_setup")
+    _HOOK_MODES = ("command", "batch", "shell", "async")
+    _HOOK_READ_LIMIT = 2**20
+    _HOOK_CACHE_FILE = "hooks.json"
+    _HOOK_CACHE_SUFFIX = ".hooks.json"
+    _HOOK_CACHE_VERSION = 1
+    _KERNEL_COPY_SIZE = 2**30
+    _DELTA_BLOCK_SIZE = 2**16
+    _DELTA_READ_SIZE = 2**20
+    _SPARSE_MIN_HOLE = 2**16
+    _WALK_BATCH = 2**10
+    # _IOW(0x94, 9, int) in linux/fs.h
+    _FICLONE = 0x40049409
+    _SNAPSHOT_FORMAT = "%Y%m%dT%H%M%S"
+    _SNAPSHOT_PATTERN = re.compile(r"(\d{8}T\d{6})(?:\.(\d+))?")
+    _LATEST_SNAPSHOT = "latest"
+    _CONFIG_CACHE_DIR = "dotbackup"
+    _CONFIG_CACHE_VERSION = 1
+    _NORMPATH_CACHE_SIZE = 2**12
+    _STATS_VERSION = 1
+    # seconds to wait for changes before checking whether to stop watching
+    _WATCH_STOP_CHECK = 1.0
+    _PROFILE_PHASES = ("walk", "ignore", "copy", "metadata", "hook")
+    _STATS_TIMERS = ("seconds", "hook_seconds", "copy_seconds")
+    _STATS_COUNTERS = (
+        "files_copied",
+        "bytes_copied",
+        "files_linked",
+        "files_skipped",
+        "files_missing",
+    )
+    _LOGGER = logging.getLogger(__name__)
+
+    def __init__(self, config_dict) -> None:
+        self._dict = dict(config_dict)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._snapshot_name = None
+        self._hook_shell = None
+        self._hook_lock = threading.Lock()
+        self._plan = None
+        self._backend = None
+        # timers and counters of each application, where None is the whole run
+        self._stats = defaultdict(Counter)
+        # the application processed by the current thread
+        self._local = threading.local()
+        self._phase_timer = PhaseTimer()
+        self._watch_stop = threading.Event()
+
+    def __repr__(self) -> str:  # pragma: no cover
+        return repr(self._dict)
+
+    def __eq__(self, other) -> bool:
+        if type(self) is not type(other):
+            return False
+
+        return self._dict == other._dict
+
+    @classmethod
+    def fromfile(cls, file):
+        """Return a new Config object based on the YAML configuration file.
+
+        The parsed configuration is cached, so that the YAML parser is only imported
+        and run when the file changes.
+        """
+
+        path = os.path.abspath(cls._normpath(file))
+        st = os.stat(path)
+
+        config_dict = cls._load_config_cache(path, st)
+        if config_dict is None:
+            # ruamel.yaml is slow to import, so it's imported only on cache misses
+            from ruamel.yaml import YAML
+
+            with open(path, encoding="utf-8") as f:
+                config_dict = YAML(typ="safe").load(f)
+
+                if config_dict is None:
+                    raise RuntimeError(f"empty configuration: {file}")
+
+            cls._save_config_cache(path, st, config_dict)
+
+        return cls(config_dict)
+
+    @classmethod
+    def _get_config_cache_path(cls, path) -> Path:
+        """Return the cache path of the configuration file path."""
+
+        cache_dir = os.environ.get("XDG_CACHE_HOME") or "~/.cache"
+        name = hashlib.sha256(path.encode()).hexdigest()[:32]
+        return Path(cls._normpath(cache_dir)) / cls._CONFIG_CACHE_DIR / name
+
+    @classmethod
+    def _get_config_cache_key(cls, path, st) -> list:
+        return [
+            cls._CONFIG_CACHE_VERSION,
+            __VERSION__,
+            path,
+            st.st_ino,
+            st.st_size,
+            st.st_mtime_ns,
+            st.st_ctime_ns,
+        ]
+
+    @classmethod
+    def _load_config_cache(cls, path, st):
+        """Return the cached configuration dict of path, or None if the cache is
+        missing or stale.
+        """
+
+        try:
+            with open(cls._get_config_cache_path(path), mode="rb") as f:
+                key, config_dict = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+
+        if key != cls._get_config_cache_key(path, st):
+            return None
+
+        return config_dict
+
+    @classmethod
+    def _save_config_cache(cls, path, st, config_dict) -> None:
+        cache_path = cls._get_config_cache_path(path)
+        tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+
+        try:
+            data = marshal.dumps([cls._get_config_cache_key(path, st), config_dict])
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, mode="wb") as f:
+                f.write(data)
+            os.replace(tmp_path, cache_path)
+        except (OSError, ValueError) as e:
+            # e.g., read-only cache directory or values marshal doesn't support
+            cls._LOGGER.debug(f"failed to cache configuration: {path}: {e}")
+            with suppress(OSError):
+                os.unlink(tmp_path)
+
+    @classmethod
+    def parse_args(cls, args):
+        """Return a new Config object based on the parsed CLI arguments."""
+
+        cls._LOGGER.setLevel(args.log_level)
+
+        if (
+            args.config.endswith(".yml")
+            or "/" in args.config
+            or os.path.isfile(args.config)
+        ):
+            config_file = args.config
+        else:
+            config_file = f"{cls._CONFIG_DIR}/{args.config}.yml"
+
+        config_file_path = Path(cls._normpath(config_file))
+        if not config_file_path.is_file():
+            cls._LOGGER.error(f"configuration file doesn't exist: {config_file}")
+            sys.exit(1)
+
+        config = cls.fromfile(config_file)
+
+        if args.list:
+            config._list_apps()
+            sys.exit()
+
+        if args.clean:
+            config._dict["clean"] = True
+        if args.mirror:
+            config._dict["mirror"] = True
+        if getattr(args, "incremental", False):
+            config._dict["incremental"] = True
+        if getattr(args, "dir_cache", False):
+            config._dict["dir_cache"] = True
+        if args.jobs is not None:
+            config._dict["jobs"] = args.jobs
+        if args.app_jobs is not None:
+            config._dict["app_jobs"] = args.app_jobs
+        if args.copy_method is not None:
+            config._dict["copy_method"] = args.copy_method
+        if args.delta_threshold is not None:
+            config._dict["delta_threshold"] = args.delta_threshold
+        if args.hook_mode is not None:
+            config._dict["hook_mode"] = args.hook_mode
+        if args.hook_timeout is not None:
+            config._dict["hook_timeout"] = args.hook_timeout
+        if args.snapshot:
+            config._dict["snapshot"] = True
+            if isinstance(args.snapshot, str):
+                config._dict["selected_snapshot"] = args.snapshot
+        if getattr(args, "watch", False):
+            config._dict["watch"] = True
+        if args.plan:
+            config._dict["print_plan"] = True
+        if args.apply_plan is not None:
+            config._dict["apply_plan"] = args.apply_plan
+        if args.stats:
+            config._dict["print_stats"] = True
+        if args.metrics_file is not None:
+            config._dict["metrics_file"] = args.metrics_file
+        if args.prometheus_file is not None:
+            config._dict["prometheus_file"] = args.prometheus_file
+        if args.profile is not None:
+            config._dict["profile"] = args.profile
+        config._dict["selected_apps"] = list(args.app)
+        if getattr(args, "file", None):
+            config._dict["selected_files"] = list(args.file)
+
+        return config
+
+    @classmethod
+    def _add_arguments(cls, parser, typ="backup") -> None:
+        """Add backup or setup arguments to the parser."""
+
+        assert typ in ("backup", "setup")
+
+        parser.add_argument(
+            "-c",
+            "--config",
+            default=cls._DEFAULT_CONFIG_FILE,
+            help=f"Configuration file (default: {cls._DEFAULT_CONFIG_FILE}).",
+        )
+        parser.add_argument(
+            "-l",
+            "--list",
+            action="store_true",
+            help="List configured applications and exit.",
+        )
+        parser.add_argument(
+            "-v",
+            "--version",
+            action="version",
+            version=f"dotbackup {__VERSION__}",
+            help="Show the version and exit.",
+        )
+        parser.add_argument(
+            "--clean",
+            action="store_true",
+            help=(
+                f"Do clean {typ}, i.e., delete old "
+                f"{'backup' if typ == 'backup' else 'configuration'} "
+                f"files before {typ}."
+            ),
+        )
+        parser.add_argument(
+            "--mirror",
+            action="store_true",
+            help=(
+                f"Do mirror {typ}, i.e., only copy changed files and delete "
+                f"{'backup' if typ == 'backup' else 'configuration'} files "
+                "absent from the source."
+            ),
+        )
+        if typ == "backup":
+            parser.add_argument(
+                "--incremental",
+                action="store_true",
+                help="Only copy files changed since the last backup.",
+            )
+            parser.add_argument(
+                "--dir-cache",
+                action="store_true",
+                help=(
+                    "Don't list directories unchanged since the last incremental "
+                    "backup."
+                ),
+            )
+            parser.add_argument(
+                "--snapshot",
+                action="store_true",
+                help=(
+                    "Back up to a new snapshot, hard linking files unchanged since "
+                    "the latest snapshot."
+                ),
+            )
+        else:
+            parser.add_argument(
+                "--snapshot",
+                metavar="NAME",
+                help=f"Set up from the snapshot NAME, e.g., {cls._LATEST_SNAPSHOT}.",
+            )
+            parser.add_argument(
+                "--file",
+                action="append",
+                metavar="PATH",
+                help=(
+                    "Only set up PATH, which is or is under a configured file. "
+                    "This option can be repeated."
+                ),
+            )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            metavar="N",
+            help="Copy files with N worker threads (default: 1).",
+        )
+        parser.add_argument(
+            "--app-jobs",
+            type=int,
+            metavar="N",
+            help="Process up to N independent applications concurrently (default: 1).",
+        )
+        parser.add_argument(
+            "--copy-method",
+            choices=cls._COPY_METHODS,
+            help="Set the file copy method (default: auto).",
+        )
+        parser.add_argument(
+            "--delta-threshold",
+            type=int,
+            metavar="BYTES",
+            help=(
+                "Only rewrite changed blocks of existing files of at least BYTES "
+                "(default: none)."
+            ),
+        )
+        parser.add_argument(
+            "--hook-mode",
+            choices=cls._HOOK_MODES,
+            help="Set how hook commands are run in shells (default: command).",
+        )
+        parser.add_argument(
+            "--hook-timeout",
+            type=float,
+            metavar="SECONDS",
+            help="Fail hook commands running longer than SECONDS (default: none).",
+        )
+        plan_group = parser.add_mutually_exclusive_group()
+        plan_group.add_argument(
+            "--plan",
+            action="store_true",
+            help="Print the planned operations as JSON without doing them.",
+        )
+        plan_group.add_argument(
+            "--apply-plan",
+            metavar="FILE",
+            help="Do the operations planned by --plan in FILE.",
+        )
+        if typ == "backup":
+            plan_group.add_argument(
+                "--watch",
+                action="store_true",
+                help="Keep backing up changed files until interrupted.",
+            )
+        parser.add_argument(
+            "--stats",
+            action="store_true",
+            help="Print timings and counters of each application after the run.",
+        )
+        parser.add_argument(
+            "--metrics-file",
+            metavar="FILE",
+            help="Write timings and counters of the run to FILE as JSON.",
+        )
+        parser.add_argument(
+            "--prometheus-file",
+            metavar="FILE",
+            help="Write metrics of the run to FILE in Prometheus text format.",
+        )
+        parser.add_argument(
+            "--profile",
+            metavar="FILE",
+            help="Profile the run in one thread and write the report to FILE.",
+        )
+        parser.add_argument(
+            "--log-level",
+            default="INFO",
+            choices=("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"),
+            help="Set the log level (default: INFO).",
+        )
+        parser.add_argument(
+            "app",
+            help="Application to be backed up (default: all applications).",
+            nargs="*",
+        )
+
+    @classmethod
+    def main_parser(cls):
+        """Return argument parser for dotbackup.py."""
+
+        parser = ArgumentParser(
+            prog="dotbackup.py",
+            description="YAML config based backup utility.",
+            epilog="""NOTE: This project has been deprecated, please use its successor
+                at https://github.com/jaxvanyang/dotbackup.rs""",
+        )
+        subparsers = parser.add_subparsers(
+            title="subcommands",
+            dest="command",
+            help="Sub-command to be executed.",
+        )
+        backup_parser = subparsers.add_parser(
+            "backup", help="Do backup based on the YAML configuration."
+        )
+        setup_parser = subparsers.add_parser(
+            "setup", help="Do setup based on the YAML configuration."
+        )
+
+        cls._add_arguments(backup_parser)
+        cls._add_arguments(setup_parser, typ="setup")
+
+        return parser
+
+    @classmethod
+    def dotbackup_parser(cls):
+        """Return argument parser for dotbackup."""
+
+        parser = ArgumentParser(
+            prog="dotbackup",
+            description="Do backup based on the YAML configuration.",
+            epilog="""NOTE: This project has been deprecated, please use its successor
+                at https://github.com/jaxvanyang/dotbackup.rs""",
+        )
+        cls._add_arguments(parser)
+
+        return parser
+
+    @classmethod
+    def dotsetup_parser(cls):
+        """Return argument parser for dotsetup."""
+
+        parser = ArgumentParser(
+            prog="dotsetup",
+            description="Do setup based on the YAML configuration.",
+            epilog="""NOTE: This project has been deprecated, please use its successor
+                at https://github.com/jaxvanyang/dotbackup.rs""",
+        )
+        cls._add_arguments(parser, typ="setup")
+
+        return parser
+
+    @staticmethod
+    def _normpath(path):
+        """Normalize path, expand user home directory, etc."""
+
+        return Config._expand_path(path, os.environ.get("HOME"))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=_NORMPATH_CACHE_SIZE)
+    def _expand_path(path, home):
+        """Return the normalized path, which is cached by path and home, i.e., the
+        home directory expanduser() uses.
+        """
+
+        return os.path.normpath(os.path.expanduser(path))
+
+    @property
+    def _backup_dir(self):
+        return self._dict["backup_dir"]
+
+    @property
+    def _clean(self):
+        return self._dict.get("clean", False)
+
+    @property
+    def _mirror(self):
+        return self._dict.get("mirror", False)
+
+    @property
+    def _incremental(self):
+        return self._dict.get("incremental", False)
+
+    @property
+    def _dir_cache(self):
+        return self._dict.get("dir_cache", False)
+
+    @property
+    def _verify_interval(self):
+        return self._dict.get("verify_interval", 86400)
+
+    @property
+    def _jobs(self):
+        return self._dict.get("jobs", 1)
+
+    @property
+    def _app_jobs(self):
+        return self._dict.get("app_jobs", 1)
+
+    @property
+    def _copy_method(self):
+        return self._dict.get("copy_method", "auto")
+
+    @property
+    def _delta_threshold(self):
+        return self._dict.get("delta_threshold")
+
+    @property
+    def _hook_mode(self):
+        return self._dict.get("hook_mode", "command")
+
+    @property
+    def _hook_timeout(self):
+        return self._dict.get("hook_timeout")
+
+    @property
+    def _metrics_file(self):
+        return self._dict.get("metrics_file")
+
+    @property
+    def _prometheus_file(self):
+        return self._dict.get("prometheus_file")
+
+    @property
+    def _watch_delay(self):
+        return self._dict.get("watch_delay", 1)
+
+    @property
+    def _watch_interval(self):
+        return self._dict.get("watch_interval", 5)
+
+    @property
+    def _snapshot(self):
+        return self._dict.get("snapshot", False)
+
+    @property
+    def _keep_snapshots(self):
+        return self._dict.get("keep_snapshots", 0)
+
+    @property
+    def _storage(self):
+        return self._dict.get("storage", "files")
+
+    @property
+    def _apps_dict(self):
+        return self._dict.get("apps", dict())
+
+    @property
+    def _selected_files(self) -> list:
+        """Return a list of files selected to set up.
+        An empty list indicates all files.
+        """
+        return self._dict.get("selected_files", [])
+
+    @property
+    def _selected_apps(self) -> list:
+        """Return a list of selected applications.
+        An empty list indicates all applications.
+        """
+        return self._dict["selected_apps"]
+
+    @contextmanager
+    def _hook_session(self):
+        """Check the hook mode and timeout, load fingerprints of memoized hooks and
+        save them and close the shell of the shell mode afterwards.
+        """
+
+        if self._hook_mode not in self._HOOK_MODES:
+            raise RuntimeError(
+                f"invalid hook_mode: {self._hook_mode}: must be one of "
+                f"{', '.join(self._HOOK_MODES)}"
+            )
+
+        self._check_hook_timeout("hook_timeout", self._hook_timeout)
+
+        self._hook_cache = self._load_hook_cache()
+        self._hook_cache_changed = False
+        # (hook title, command, duration in seconds) of every run hook command
+        self._hook_durations = []
+
+        try:
+            yield
+        except BaseException:
+            if self._hook_shell is not None:
+                self._hook_shell.kill()
+                self._hook_shell = None
+            raise
+        finally:
+            if self._hook_shell is not None:
+                self._hook_shell.close()
+                self._hook_shell = None
+            if self._hook_cache_changed:
+                self._save_hook_cache()
+
+    def _get_hook_cache_path(self) -> Path:
+        """Return the path of the fingerprints of memoized hooks."""
+
+        return self._backend.get_hook_cache_path()
+
+    def _load_hook_cache(self) -> dict:
+        """Return the mapping from cache keys of memoized hooks to their input
+        fingerprints of the last successful runs.
+        """
+
+        path = self._get_hook_cache_path()
+
+        try:
+            with open(path, encoding="utf-8") as f:
+                cache = json.load(f)
+
+            if cache["version"] != self._HOOK_CACHE_VERSION:
+                raise ValueError(f"unsupported version: {cache['version']}")
+            if not isinstance(cache["hooks"], dict):
+                raise ValueError("hooks is not a mapping")
+        except FileNotFoundError:
+            return dict()
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self._LOGGER.warning(f"corrupt hook cache: {path}: {e}: running all hooks")
+            return dict()
+
+        return cache["hooks"]
+
+    def _save_hook_cache(self) -> None:
+        path = self._get_hook_cache_path()
+        tmp_path = path.with_name(f"{path.name}.tmp")
+
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, mode="w", encoding="utf-8") as f:
+                json.dump(
+                    {"version": self._HOOK_CACHE_VERSION, "hooks": self._hook_cache}, f
+                )
+            os.replace(tmp_path, path)
+        except OSError as e:
+            self._LOGGER.warning(f"failed to save hook cache: {path}: {e}")
+
+    @staticmethod
+    def _expand_hook_path(pattern) -> str:
+        """Expand environment variables and the user home directory in pattern."""
+
+        return os.path.expanduser(os.path.expandvars(pattern))
+
+    def _iter_hook_inputs(self, pattern):
+        """Yield input files matching pattern in sorted order, files under matched
+        directories included.
+        """
+
+        for path in sorted(glob.glob(self._expand_hook_path(pattern), recursive=True)):
+            yield path
+            if os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    dirs.sort()
+                    for name in sorted(files):
+                        yield os.path.join(root, name)
+
+    def _get_hook_fingerprint(self, hook_title, hook):
+        """Return the fingerprint of the run command and the inputs of the memoized
+        hook, or None if the input command fails.
+
+        Input files are fingerprinted by their paths and metadata, files under input
+        directories included, and the input command by its output.
+        """
+
+        digest = hashlib.sha256(hook["run"].encode())
+
+        for pattern in hook.get("inputs") or []:
+            digest.update(f"\0{pattern}\n".encode())
+            for file in self._iter_hook_inputs(pattern):
+                # inputs which can't be stat'ed are left out
+                with suppress(OSError):
+                    st = os.stat(file)
+                    entry = f"{file}\0{st.st_size}\0{st.st_mtime_ns}\0{st.st_mode}\n"
+                    digest.update(entry.encode())
+
+        if "input_command" in hook:
+            process = subprocess.run(
+                ["sh", "-s"],
+                input=hook["input_command"].encode(),
+                stdout=subprocess.PIPE,
+            )
+            if process.returncode != 0:
+                self._LOGGER.warning(
+                    f"input command of {hook_title} hook failed, running the hook: "
+                    f"{hook['input_command']}"
+                )
+                return None
+            digest.update(b"\0" + process.stdout)
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def _check_hook_timeout(name, timeout) -> None:
+        if timeout is None:
+            return
+        if not isinstance(timeout, (int, float)) or isinstance(timeout, bool):
+            raise RuntimeError(f"invalid {name}: {timeout}: must be a positive number")
+        if timeout <= 0:
+            raise RuntimeError(f"invalid {name}: {timeout}: must be a positive number")
+
+    def _get_hook_commands(self, hook_title, hooks) -> list:
+        """Return a list of (command, memo, timeout) tuples of hooks to run, where memo
+        is a (cache key, fingerprint) pair to remember after the command succeeds, or
+        None, and timeout is in seconds or None.
+
+        A hook is either a command string or a mapping with the run command and
+        optional timeout, inputs, input_command and outputs. Memoized hooks, i.e.,
+        ones with inputs or input_command, are skipped if their fingerprints match the
+        last successful runs and their outputs exist.
+        """
+
+        commands = []
+
+        for hook in hooks:
+            if isinstance(hook, str):
+                commands.append((hook, None, self._hook_timeout))
+                continue
+            if not isinstance(hook, dict) or not isinstance(hook.get("run"), str):
+                raise RuntimeError(
+                    f"invalid hook of {hook_title}: {hook}: must be a string or a "
+                    "mapping with a run string"
+                )
+
+            command = hook["run"]
+            timeout = hook.get("timeout", self._hook_timeout)
+            self._check_hook_timeout(f"timeout of {hook_title} hook", timeout)
+            for name in ("inputs", "outputs"):
+                self._check_strings(f"{name} of {hook_title} hook", hook.get(name))
+            if not isinstance(hook.get("input_command", ""), str):
+                raise RuntimeError(
+                    f"invalid input_command of {hook_title} hook: "
+                    f"{hook['input_command']}: must be a string"
+                )
+            if "inputs" not in hook and "input_command" not in hook:
+                commands.append((command, None, timeout))
+                continue
+
+            key = hashlib.sha256(f"{hook_title}\0{command}".encode()).hexdigest()[:16]
+            fingerprint = self._get_hook_fingerprint(hook_title, hook)
+            outputs_exist = all(
+                glob.glob(self._expand_hook_path(pattern), recursive=True)
+                for pattern in hook.get("outputs") or []
+            )
+
+            if (
+                fingerprint is not None
+                and self._hook_cache.get(key) == fingerprint
+                and outputs_exist
+            ):
+                self._LOGGER.info(
+                    f"skipping {hook_title} hook {key}, inputs unchanged:\n{command}"
+                )
+                continue
+
+            memo = None if fingerprint is None else (key, fingerprint)
+            commands.append((command, memo, timeout))
+
+        return commands
+
+    def _check_hook_status(self, hook_title, hook, status, duration) -> None:
+        """Record the duration and log the exit status of a hook command and raise an
+        error if it failed, otherwise remember the fingerprint of the memoized hook.
+        """
+
+        command, memo, _ = hook
+
+        with self._lock:
+            self._hook_durations.append((hook_title, command, duration))
+
+        if status is None:
+            raise RuntimeError(f"command failed: {command}")
+
+        self._LOGGER.debug(
+            f"{hook_title} hook exited with status {status} in {duration:.3f}s"
+        )
+        if status != 0:
+            raise RuntimeError(f"command failed: {command}")
+
+        if memo is not None:
+            key, fingerprint = memo
+            with self._lock:
+                self._hook_cache[key] = fingerprint
+                self._hook_cache_changed = True
+
+    @staticmethod
+    def _kill_hook(pid) -> None:
+        """Kill the process group of a hook command which runs in a new session."""
+
+        with suppress(ProcessLookupError):
+            os.killpg(pid, signal.SIGKILL)
+
+    @staticmethod
+    async def _forward_hook_output(stream, file, prefix) -> None:
+        """Write lines read from stream to file with prefix."""
+
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            file.write(prefix + line.decode(errors="replace").rstrip("\n") + "\n")
+            file.flush()
+
+    async def _run_hook_async(self, hook_title, index, command, timeout):
+        """Run command in a new shell with its output prefixed by the hook title and
+        index, and return its exit status, or None if it times out, and duration.
+        """
+
+        import asyncio
+
+        prefix = f"[{hook_title} {index}] "
+        start = time.monotonic()
+        process = await asyncio.create_subprocess_exec(
+            "sh",
+            "-s",
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+            limit=self._HOOK_READ_LIMIT,
+        )
+        readers = asyncio.gather(
+            self._forward_hook_output(process.stdout, sys.stdout, prefix),
+            self._forward_hook_output(process.stderr, sys.stderr, prefix),
+        )
+
+        process.stdin.write(command.encode())
+        with suppress(BrokenPipeError, ConnectionResetError):
+            await process.stdin.drain()
+        process.stdin.close()
+
+        try:
+            status = await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
+            self._kill_hook(process.pid)
+            await process.wait()
+            status = None
+        except asyncio.CancelledError:
+            # the new session doesn't get the SIGINT of the terminal
+            self._kill_hook(process.pid)
+            await process.wait()
+            raise
+        await readers
+
+        return status, time.monotonic() - start
+
+    def _run_async_hooks(self, hook_title, commands) -> None:
+        """Run commands concurrently and report the first failure in order."""
+
+        # asyncio is slow to import, so it's imported only when needed
+        import asyncio
+
+        async def run_all():
+            return await asyncio.gather(
+                *(
+                    self._run_hook_async(hook_title, index, command, timeout)
+                    for index, (command, _, timeout) in enumerate(commands, 1)
+                )
+            )
+
+        self._LOGGER.info(
+            f"running {hook_title} hooks concurrently:\n"
+            + "\n".join(command for command, _, _ in commands)
+        )
+        results = asyncio.run(run_all())
+
+        for hook, (status, duration) in zip(commands, results):
+            command, _, timeout = hook
+            if status is None:
+                raise RuntimeError(f"command timed out after {timeout}s: {command}")
+            self._check_hook_status(hook_title, hook, status, duration)
+
+    def _wait_hook_shell(self, shell, hook_title, hook, start) -> None:
+        """Wait for the hook command sent to shell and check its exit status.
+
+        The shell is killed if the command times out.
+        """
+
+        command, _, timeout = hook
+        try:
+            status = shell.wait(timeout)
+        except TimeoutError:
+            shell.kill()
+            raise RuntimeError(f"command timed out after {timeout}s: {command}")
+
+        if status != 0:
+            shell.close()
+        self._check_hook_status(hook_title, hook, status, time.monotonic() - start)
+
+    def _safe_run_hooks(self, typ, hook_dict, app=None) -> None:
+        if typ not in hook_dict:
+            return
+
+        with self._time_stat("hook_seconds", app), self._phase_timer.phase("hook"):
+            self._run_hooks(typ, hook_dict, app)
+
+    def _run_hooks(self, typ, hook_dict, app) -> None:
+        hook_title = typ if app is None else f"{app} {typ}"
+        commands = self._get_hook_commands(hook_title, hook_dict[typ])
+        if not commands:
+            return
+
+        if self._hook_mode == "async":
+            self._run_async_hooks(hook_title, commands)
+            return
+
+        if self._hook_mode == "batch":
+            # run all commands in one shell which stops at the first failure
+            self._LOGGER.info(
+                f"running {hook_title} hooks in shell:\n"
+                + "\n".join(command for command, _, _ in commands)
+            )
+            shell = HookShell()
+            try:
+                start = time.monotonic()
+                for command, _, _ in commands:
+                    shell.send(command)
+                for hook in commands:
+                    self._wait_hook_shell(shell, hook_title, hook, start)
+                    start = time.monotonic()
+            except BaseException:
+                shell.kill()
+                raise
+            shell.close()
+            return
+
+        if self._hook_mode == "shell":
+            # all hooks share one long-lived shell, which runs one command at a time
+            with self._hook_lock:
+                for hook in commands:
+                    command = hook[0]
+                    self._LOGGER.info(f"running {hook_title} hook in shell:\n{command}")
+                    if self._hook_shell is None:
+                        self._hook_shell = HookShell()
+                    shell = self._hook_shell
+                    start = time.monotonic()
+                    shell.send(command)
+                    try:
+                        self._wait_hook_shell(shell, hook_title, hook, start)
+                    except RuntimeError:
+                        self._hook_shell = None
+                        raise
+                    except BaseException:
+                        shell.kill()
+                        self._hook_shell = None
+                        raise
+            return
+
+        for hook in commands:
+            command, _, timeout = hook
+            self._LOGGER.info(f"running {hook_title} hook in shell:\n{command}")
+            start = time.monotonic()
+            process = subprocess.Popen(
+                ["sh", "-s"],
+                stdin=subprocess.PIPE,
+                text=True,
+                start_new_session=timeout is not None,
+            )
+            try:
+                process.communicate(command, timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self._kill_hook(process.pid)
+                process.wait()
+                raise RuntimeError(f"command timed out after {timeout}s: {command}")
+            except BaseException:
+                # a new session doesn't get the SIGINT of the terminal
+                if timeout is None:
+                    process.kill()
+                else:
+                    self._kill_hook(process.pid)
+                process.wait()
+                raise
+            self._check_hook_status(
+                hook_title, hook, process.returncode, time.monotonic() - start
+            )
+
+    def _delete_old(self, path: Path):
+        """Delete old file safely."""
+
+        if not path.exists():
+            return
+
+        self._LOGGER.info(f"found old {path}, deleting...")
+
+        if path.is_dir() and not path.is_symlink():
+            self._remove_tree(path)
+        else:
+            path.unlink()
+
+    def _check_apps(self) -> bool:
+        """Check whether every selected app in the configured app list."""
+
+        for app in self._selected_apps:
+            if app not in self._apps_dict:
+                self._LOGGER.error(f"application not configured: {app}")
+                return False
+
+        return True
+
+    def _get_ignore(self, app_dict):
+        """Return a matcher of global and application ignore patterns, or None if
+        there are no patterns.
+        """
+
+        global_ignore = self._dict.get("ignore") or []
+        app_ignore = app_dict.get("ignore") or []
+        if not global_ignore and not app_ignore:
+            return None
+
+        return IgnoreMatcher([*global_ignore, *app_ignore], self._phase_timer)
+
+    @staticmethod
+    def _check_strings(name, value) -> list:
+        """Return value as a list after checking it's a list of strings."""
+
+        if value is None:
+            return []
+        if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+            raise RuntimeError(f"invalid {name}: {value}: must be a list of strings")
+
+        return value
+
+    def _build_plan(self) -> dict:
+        """Return a dict mapping application names to AppSpec objects.
+
+        The configuration is validated and resolved here, so that configuration
+        errors surface before anything is done.
+        """
+
+        if "backup_dir" not in self._dict:
+            raise RuntimeError("backup_dir not configured")
+        if not isinstance(self._backup_dir, str):
+            raise RuntimeError(
+                f"invalid backup_dir: {self._backup_dir}: must be a string"
+            )
+        if not isinstance(self._apps_dict, dict):
+            raise RuntimeError(f"invalid apps: {self._apps_dict}: must be a mapping")
+        self._check_strings("ignore", self._dict.get("ignore"))
+
+        home = Path(self._normpath("~"))
+        plan = dict()
+
+        for app, app_dict in self._apps_dict.items():
+            if app_dict is None:
+                app_dict = dict()
+            if not isinstance(app_dict, dict):
+                raise RuntimeError(f"invalid app: {app}: must be a mapping")
+
+            files = []
+            for file in self._check_strings(f"files of {app}", app_dict.get("files")):
+                path = Path(self._normpath(file))
+                try:
+                    rel_path = path.relative_to(home)
+                except ValueError:
+                    raise RuntimeError(
+                        f"invalid file of {app}: {file}: must be in the home directory"
+                    )
+                files.append(FileSpec(file, path, rel_path))
+
+            self._check_strings(f"ignore of {app}", app_dict.get("ignore"))
+            depends = app_dict.get("depends_on", [])
+            if isinstance(depends, str):
+                depends = [depends]
+            depends = self._check_strings(f"depends_on of {app}", depends)
+            hooks = {typ: app_dict[typ] for typ in self._HOOK_TYPES if typ in app_dict}
+
+            plan[app] = AppSpec(app, files, self._get_ignore(app_dict), depends, hooks)
+
+        return plan
+
+    def _get_plan(self) -> dict:
+        """Return the plan built by _build_plan(), which is built on first use."""
+
+        if self._plan is None:
+            self._plan = self._build_plan()
+
+        return self._plan
+
+    def _log_ignore_hits(self, app, ignore) -> None:
+        """Log how many entries each ignore pattern matched."""
+
+        if ignore is None:
+            return
+
+        for pattern, count in ignore.hits.most_common():
+            self._LOGGER.debug(f"{app}: ignored {count} entries matching {pattern}")
+
+    def _get_backup_root(self) -> Path:
+        """Return the directory where backup files are stored in this run.
+
+        It is the snapshot directory in snapshot mode, or backup_dir otherwise.
+        """
+
+        root = Path(self._normpath(self._backup_dir))
+        return root if self._snapshot_name is None else root / self._snapshot_name
+
+    def _get_backup_file_path(self, file) -> Path:
+        """Return the backup file path to the source file."""
+
+        src_path = file if isinstance(file, Path) else Path(self._normpath(file))
+        rel_path = src_path.relative_to(self._normpath("~"))
+        return self._get_backup_root() / rel_path
+
+    def _get_meta_dir(self) -> Path:
+        """Return the directory where dotbackup stores its own data."""
+
+        return Path(self._normpath(self._backup_dir)) / self._META_DIR
+
+    def _get_manifest_path(self) -> Path:
+        """Return the path of the incremental backup manifest."""
+
+        return self._get_meta_dir() / self._MANIFEST_FILE
+
+    def _load_manifest(self) -> dict:
+        """Return the incremental backup manifest, which maps "files" to file entries,
+        "dirs" to directory entries and "dir_roots" to [last full walk time, ignore
+        patterns] lists of walked files.
+
+        An empty manifest is returned if the manifest is missing or corrupt, so that
+        a full backup pass is done.
+        """
+
+        path = self._get_manifest_path()
+        empty = {"files": dict(), "dirs": dict(), "dir_roots": dict()}
+
+        try:
+            with open(path, encoding="utf-8") as f:
+                manifest = json.load(f)
+
+            if manifest["version"] != self._MANIFEST_VERSION:
+                raise ValueError(f"unsupported version: {manifest['version']}")
+            # directory entries are absent from manifests of older versions
+            manifest.setdefault("dirs", dict())
+            manifest.setdefault("dir_roots", dict())
+            for key in empty:
+                if not isinstance(manifest[key], dict):
+                    raise ValueError(f"{key} is not a mapping")
+            for entry in manifest["dirs"].values():
+                if not isinstance(entry, list) or len(entry) != 4:
+                    raise ValueError(f"invalid directory entry: {entry}")
+            for entry in manifest["dir_roots"].values():
+                if not isinstance(entry, list) or len(entry) != 2:
+                    raise ValueError(f"invalid directory root entry: {entry}")
+        except FileNotFoundError:
+            self._LOGGER.info("manifest not found, doing full backup...")
+            return empty
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self._LOGGER.warning(f"corrupt manifest: {path}: {e}: doing full backup")
+            return empty
+
+        return manifest
+
+    def _start_manifest(self, roots=(), dir_cache=False) -> None:
+        """Load the manifest to merge entries of this run into, and the directory
+        cache if dir_cache is True.
+
+        roots are paths of the files whose entries are replaced by this run.
+        """
+
+        manifest = self._load_manifest()
+        self._manifest = manifest["files"]
+        self._new_manifest = dict()
+        self._manifest_roots = set(roots)
+        self._manifest_dirs = manifest["dirs"]
+        self._manifest_dir_roots = manifest["dir_roots"]
+        self._new_dir_roots = dict()
+        self._manifest_dir_cache = None
+        if dir_cache:
+            self._manifest_dir_cache = DirCache(
+                self._manifest_dirs, self._manifest, self._new_manifest
+            )
+
+    def _get_dir_cache(self, spec: FileSpec, dest_path: Path, ignore):
+        """Return the directory cache to back up the path of spec to dest_path with,
+        or None if it's disabled.
+
+        All files are walked to verify them if the last full walk of the configured
+        file is verify_interval seconds ago or more, its ignore patterns changed, or
+        dest_path is missing. Walks are recorded by the configured file, so that
+        changed paths under it backed up in watch mode don't add their own records
+        nor count as its full walks.
+        """
+
+        if self._manifest_dir_cache is None:
+            return None
+
+        src_path = spec.path
+        root = str(spec.root)
+        patterns = list(ignore.patterns) if ignore is not None else []
+        now = time.time()
+        last = self._manifest_dir_roots.get(root)
+        verify = (
+            last is None
+            or last[1] != patterns
+            or now - last[0] >= self._verify_interval
+            or not dest_path.is_dir()
+        )
+        if verify:
+            self._LOGGER.debug(f"walking all files of {src_path} to verify them...")
+            last = [now, patterns]
+
+        if src_path == spec.root:
+            self._new_dir_roots[root] = last
+        return self._manifest_dir_cache.bind(verify)
+
+    def _save_manifest(self) -> None:
+        """Merge entries of this run into the manifest and save it atomically."""
+
+        roots = tuple(self._manifest_roots)
+        prefixes = tuple(root + os.sep for root in roots)
+
+        def merge(old, new):
+            entries = {
+                path: entry
+                for path, entry in old.items()
+                if path not in roots and not path.startswith(prefixes)
+            }
+            entries.update(new)
+            return entries
+
+        cache = self._manifest_dir_cache
+        manifest = {
+            "version": self._MANIFEST_VERSION,
+            "files": merge(self._manifest, self._new_manifest),
+            "dirs": merge(self._manifest_dirs, cache.new_entries if cache else {}),
+            "dir_roots": merge(self._manifest_dir_roots, self._new_dir_roots),
+        }
+
+        path = self._get_manifest_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        with open(tmp_path, mode="w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+        if cache is not None:
+            self._LOGGER.info(
+                f"listed {cache.stats['listed']} directories, skipped "
+                f"{cache.stats['cached']} unchanged directories"
+            )
+
+    @classmethod
+    def _delete_stale(cls, path, is_dir, ops=None) -> None:
+        """Delete the stale path, or record the delete operation in ops if it's a
+        list of planned operations.
+        """
+
+        if ops is not None:
+            ops.append({"op": "delete", "path": path})
+            return
+
+        cls._LOGGER.info(f"deleting stale {path}...")
+        if is_dir:
+            cls._remove_tree(path)
+        else:
+            os.unlink(path)
+
+    @staticmethod
+    def _remove_tree(path) -> None:
+        """Remove the directory tree at path like shutil.rmtree().
+
+        Directories are opened relative to their parents without following symbolic
+        links, and their entries are removed as they are read, so that memory use
+        doesn't grow with directory sizes.
+        """
+
+        if (
+            os.scandir not in os.supports_fd
+            or not {os.open, os.unlink, os.rmdir} <= os.supports_dir_fd
+        ):  # pragma: no cover
+            shutil.rmtree(path)
+            return
+
+        flags = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW | os.O_CLOEXEC
+        # [directory fd, its entry iterator, its name in the parent directory]
+        stack = []
+
+        def push(name, dir_fd=None):
+            fd = os.open(name, flags, dir_fd=dir_fd)
+            try:
+                stack.append([fd, os.scandir(fd), name])
+            except BaseException:
+                os.close(fd)
+                raise
+
+        push(path)
+        try:
+            while stack:
+                fd, it, name = stack[-1]
+                entry = next(it, None)
+                if entry is None:
+                    it.close()
+                    # entries removed while reading may hide others on some file
+                    # systems, so read again until the directory is empty
+                    stack[-1][1] = it = os.scandir(fd)
+                    entry = next(it, None)
+                if entry is None:
+                    it.close()
+                    os.close(fd)
+                    stack.pop()
+                    if stack:
+                        os.rmdir(name, dir_fd=stack[-1][0])
+                elif entry.is_dir(follow_symlinks=False):
+                    push(entry.name, fd)
+                else:
+                    os.unlink(entry.name, dir_fd=fd)
+        finally:
+            for fd, it, _ in stack:
+                it.close()
+                os.close(fd)
+        os.rmdir(path)
+
+    @classmethod
+    def _iter_batches(cls, path, ignore):
+        """Yield lists of DirEntry objects in path except ignored ones, in batches of
+        at most _WALK_BATCH entries read.
+
+        At least one batch is yielded if path is a directory, nothing otherwise.
+        """
+
+        try:
+            it = os.scandir(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+
+        with it:
+            while True:
+                batch = list(itertools.islice(it, cls._WALK_BATCH))
+                done = len(batch) < cls._WALK_BATCH
+                if batch and ignore is not None:
+                    entries = {entry.name: entry for entry in batch}
+                    if isinstance(ignore, IgnoreMatcher):
+                        ignored = ignore(
+                            path,
+                            list(entries),
+                            lambda name: cls._is_dir_entry(entries[name]),
+                        )
+                    else:
+                        # like the ignore callable of shutil.copytree()
+                        ignored = ignore(path, list(entries))
+                    if ignored:
+                        batch = [entry for entry in batch if entry.name not in ignored]
+
+                yield batch
+                if done:
+                    break
+
+    @staticmethod
+    def _is_dir_entry(entry) -> bool:
+        """Return True if the DirEntry object is a directory or a symbolic link to
+        one.
+        """
+
+        try:
+            return entry.is_dir()
+        except OSError:
+            return False
+
+    @classmethod
+    def _walk(cls, top, ignore=None, cache=None, leave=False):
+        """Yield (root, entries) pairs of directories under top, which is walked
+        top-down following symbolic links like os.walk(top, followlinks=True).
+
+        entries are DirEntry objects of non-directory files in root except ignored
+        ones, which are streamed in batches, so that memory use doesn't grow with
+        directory sizes. Each directory is yielded at least once, before its
+        subdirectories, and ignored directories are not descended into. If leave is
+        True, (root, None) is also yielded after the subdirectories of each listed
+        directory.
+
+        If cache is a DirCache object, directories unchanged since they are recorded
+        in it are not listed nor yielded, but their subdirectories are walked.
+
+        RuntimeError is raised if a directory can't be listed, so that it's not
+        missed silently. Directories removed during the walk are skipped.
+        """
+
+        # directories to walk, and (root, None) pairs of directories to leave
+        stack = [os.fspath(top)]
+        while stack:
+            root = stack.pop()
+            if isinstance(root, tuple):
+                yield root
+                continue
+
+            if cache is not None:
+                try:
+                    # before listing, so that changes while listing are noticed
+                    st = os.stat(root)
+                except FileNotFoundError:
+                    continue
+                except OSError as e:
+                    raise RuntimeError(f"failed to list {root}: {e}")
+                subdirs = cache.get(root, st)
+                if subdirs is not None:
+                    stack.extend(reversed(subdirs))
+                    continue
+
+            subdirs = []
+            count = 0
+            listed = False
+            try:
+                for batch in cls._iter_batches(root, ignore):
+                    listed = True
+                    files = []
+                    for entry in batch:
+                        if cls._is_dir_entry(entry):
+                            subdirs.append(entry.path)
+                        else:
+                            files.append(entry)
+                    count += len(files)
+                    yield root, files
+            except OSError as e:
+                raise RuntimeError(f"failed to list {root}: {e}")
+
+            if cache is not None:
+                cache.put(root, st, subdirs, count)
+            if leave and listed:
+                stack.append((root, None))
+            stack.extend(reversed(subdirs))
+
+    @classmethod
+    def _iter_stale(cls, dest_root, src_root, ignore):
+        """Yield (path, is_dir) pairs of entries in dest_root which are absent from
+        src_root, or whose type differs from the source.
+
+        Ignored entries are left alone.
+        """
+
+        for batch in cls._iter_batches(dest_root, ignore):
+            for entry in batch:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                src = os.path.join(src_root, entry.name)
+                if os.path.lexists(src) and is_dir == os.path.isdir(src):
+                    continue
+
+                yield entry.path, is_dir
+
+    @classmethod
+    def _iter_tree(
+        cls,
+        src_dir,
+        dest_dir,
+        ignore,
+        make_dirs=True,
+        mirror=False,
+        ops=None,
+        cache=None,
+        dir_stats=False,
+    ):
+        """Yield (src, dest) pairs of files in src_dir except ignore files, where src
+        is the os.DirEntry object of the file, whose stat result is cached, and dest
+        is the destination path.
+
+        ignore should be bound to the root of the configured file which src_dir is
+        in, see _bind_ignore(), and src_dir is the root otherwise. Destination
+        directories are created along the way like shutil.copytree() unless make_dirs
+        is False, and if dir_stats is True, a function copying the metadata of each
+        created directory is yielded after the pairs of its contents. If
+        mirror is True, entries in destination directories which are absent from the
+        source are deleted. If ops is a list, these operations are appended to it
+        instead of being done. If cache is a DirCache object, files in unchanged
+        directories are skipped.
+        """
+
+        src_ignore = dest_ignore = None
+        if ignore is not None:
+            src_ignore = ignore if ignore.root is not None else ignore.bind(src_dir)
+            # the root in the destination is as deep above dest_dir
+            dest_root = os.fspath(dest_dir)
+            rel_dir = os.path.relpath(src_dir, src_ignore.root)
+            if rel_dir != os.curdir:
+                for _ in rel_dir.split(os.sep):
+                    dest_root = os.path.dirname(dest_root)
+            dest_ignore = ignore.bind(dest_root)
+
+        dir_stats = dir_stats and make_dirs and ops is None
+        prev_root = dest_root = None
+        for root, entries in cls._walk(src_dir, src_ignore, cache, leave=dir_stats):
+            if entries is None:
+                dest = os.path.join(dest_dir, os.path.relpath(root, src_dir))
+                yield functools.partial(shutil.copystat, root, os.path.normpath(dest))
+                continue
+
+            if root != prev_root:
+                prev_root = root
+                dest_root = os.path.normpath(
+                    os.path.join(dest_dir, os.path.relpath(root, src_dir))
+                )
+
+                if mirror:
+                    if os.path.lexists(dest_root) and not os.path.isdir(dest_root):
+                        cls._delete_stale(dest_root, False, ops)
+                    for path, is_dir in cls._iter_stale(dest_root, root, dest_ignore):
+                        cls._delete_stale(path, is_dir, ops)
+
+                if make_dirs:
+                    if ops is None:
+                        os.makedirs(dest_root, exist_ok=True)
+                    else:
+                        ops.append({"op": "mkdir", "path": dest_root, "src": root})
+
+            for entry in entries:
+                yield entry, os.path.join(dest_root, entry.name)
+
+    @staticmethod
+    def _stat(src):
+        """Return the stat result of src, which is a path or an os.DirEntry object,
+        so that a walked file is only stat'ed once.
+        """
+
+        return src.stat() if isinstance(src, os.DirEntry) else os.stat(src)
+
+    @staticmethod
+    def _get_manifest_entry(st) -> list:
+        """Return the manifest entry of a file by its stat result."""
+
+        return [st.st_size, st.st_mtime_ns, st.st_ino, st.st_mode]
+
+    def _copy_if_changed(self, src, dest) -> bool:
+        """Copy src to dest if its metadata differs from the manifest entry.
+
+        Return True if the file is copied, False otherwise. It is thread-safe to call
+        this method from workers.
+        """
+
+        path = os.fspath(src)
+        with self._phase_timer.phase("metadata"):
+            entry = self._get_manifest_entry(self._stat(src))
+            self._new_manifest[path] = entry
+            unchanged = self._manifest.get(path) == entry and os.path.lexists(dest)
+
+        if unchanged:
+            self._LOGGER.debug(f"skipping unchanged {path}")
+            self._add_stats(files_skipped=1)
+            return False
+
+        self._LOGGER.debug(f"copying {path} to {dest}...")
+        self._copy_file(src, dest)
+        return True
+
+    def _iter_pairs(
+        self,
+        src_path: Path,
+        dest_path: Path,
+        ignore,
+        make_dirs=True,
+        mirror=False,
+        ops=None,
+        cache=None,
+        dir_stats=False,
+    ):
+        """Yield (src, dest) file pairs to copy src_path to dest_path, where src is a
+        path if src_path is a file, or an os.DirEntry object otherwise.
+
+        See _iter_tree() for the arguments.
+        """
+
+        if src_path.is_dir():
+            yield from self._iter_tree(
+                src_path, dest_path, ignore, make_dirs, mirror, ops, cache, dir_stats
+            )
+        else:
+            if mirror and dest_path.is_dir() and not dest_path.is_symlink():
+                self._delete_stale(str(dest_path), True, ops)
+            if make_dirs:
+                if ops is None:
+                    dest_path.parent.mkdir(parents=True, exist_ok=True)
+                else:
+                    ops.append({"op": "mkdir", "path": str(dest_path.parent)})
+            yield str(src_path), str(dest_path)
+
+    def _copy_tree(self, src_path: Path, dest_path: Path, ignore, copy=None, **kwargs):
+        """Copy src_path to dest_path by copy like _copy_files(), then copy the
+        metadata of created directories like shutil.copytree().
+
+        Directories are done as the walk leaves them, after all their contents, so
+        that copying files into them doesn't change their mtimes. See _iter_tree()
+        for the other arguments.
+        """
+
+        pairs = self._iter_pairs(src_path, dest_path, ignore, dir_stats=True, **kwargs)
+        self._copy_files(pairs, copy)
+
+    def _leave_dirs(self, dirs, path=None) -> None:
+        """Copy metadata of (src, dest) directory pairs popped from the stack dirs,
+        until the destination on the top is path or an ancestor of it, or all of
+        them if path is None.
+        """
+
+        with self._phase_timer.phase("metadata"):
+            while dirs:
+                src, dest = dirs[-1]
+                if path is not None and (
+                    path == dest or path.startswith(dest + os.sep)
+                ):
+                    break
+                shutil.copystat(src, dest)
+                dirs.pop()
+
+    @staticmethod
+    def _is_mirrored(st, dest_st) -> bool:
+        """Return True if dest_st is of a regular file which has the same size and
+        mtime as st.
+        """
+
+        return (
+            dest_st is not None
+            and stat.S_ISREG(dest_st.st_mode)
+            and (dest_st.st_size, dest_st.st_mtime_ns) == (st.st_size, st.st_mtime_ns)
+        )
+
+    def _copy_if_differ(self, src, dest) -> bool:
+        """Copy src to dest unless dest has the same size and mtime.
+
+        Return True if the file is copied, False otherwise.
+        """
+
+        with self._phase_timer.phase("metadata"):
+            st = self._stat(src)
+            try:
+                dest_st = os.lstat(dest)
+            except FileNotFoundError:
+                dest_st = None
+
+        if self._is_mirrored(st, dest_st):
+            self._LOGGER.debug(f"skipping unchanged {os.fspath(src)}")
+            self._add_stats(files_skipped=1)
+            return False
+
+        self._LOGGER.debug(f"copying {os.fspath(src)} to {dest}...")
+        if dest_st is not None and not stat.S_ISREG(dest_st.st_mode):
+            os.unlink(dest)
+        self._copy_file(src, dest)
+        return True
+
+    def _run_copy(self, copy, src, dest) -> None:
+        try:
+            with self._phase_timer.phase("copy"):
+                copy(src, dest)
+        except OSError as e:
+            raise RuntimeError(f"failed to copy {os.fspath(src)} to {dest}: {e}")
+
+    @staticmethod
+    def _copy_kernel(infd, outfd) -> None:
+        """Copy data between file descriptors without going through userspace."""
+
+        try:
+            while os.copy_file_range(infd, outfd, Config._KERNEL_COPY_SIZE) > 0:
+                pass
+            return
+        except (AttributeError, OSError):
+            # copy_file_range() is Linux only and may not work across filesystems
+            if os.lseek(outfd, 0, os.SEEK_CUR) != 0:
+                raise
+
+        offset = 0
+        while True:
+            sent = os.sendfile(outfd, infd, offset, Config._KERNEL_COPY_SIZE)
+            if sent == 0:
+                break
+            offset += sent
+
+    @classmethod
+    def _is_sparse(cls, st) -> bool:
+        """Return True if the file of the stat result has holes.
+
+        Small differences between the size and the allocated size are ignored, they
+        are likely of inline or delayed allocated data.
+        """
+
+        return st.st_blocks * 512 + cls._SPARSE_MIN_HOLE <= st.st_size
+
+    @classmethod
+    def _copy_range(cls, infd, outfd, offset, count, kernel=True) -> None:
+        """Copy count bytes at offset of infd to the same offset of outfd, inside the
+        kernel if kernel is True and possible, or by buffered reads and writes.
+        """
+
+        end = offset + count
+        with suppress(AttributeError, OSError):
+            while kernel and offset < end:
+                copied = os.copy_file_range(
+                    infd,
+                    outfd,
+                    min(end - offset, cls._KERNEL_COPY_SIZE),
+                    offset,
+                    offset,
+                )
+                if copied == 0:
+                    break
+                offset += copied
+
+        # copy_file_range() is Linux only and may not work across filesystems
+        while offset < end:
+            data = os.pread(infd, min(end - offset, cls._DELTA_READ_SIZE), offset)
+            if not data:
+                break
+            offset += os.pwrite(outfd, data, offset)
+
+    @classmethod
+    def _copy_sparse(cls, infd, outfd, size, kernel=True) -> int:
+        """Copy data extents of infd to outfd by SEEK_DATA and SEEK_HOLE, so that
+        holes are kept as holes. See _copy_range() for kernel.
+
+        Return the number of copied data bytes.
+        """
+
+        copied = 0
+        offset = 0
+        while offset < size:
+            try:
+                data = os.lseek(infd, offset, os.SEEK_DATA)
+            except OSError as e:
+                # no more data after offset
+                if e.errno == errno.ENXIO:
+                    break
+                raise
+            hole = os.lseek(infd, data, os.SEEK_HOLE)
+            cls._copy_range(infd, outfd, data, hole - data, kernel)
+            copied += hole - data
+            offset = hole
+
+        os.ftruncate(outfd, size)
+        return copied
+
+    def _copy_data(self, fsrc, fdst, st=None) -> str:
+        """Copy data of fsrc to fdst by the configured copy method, where st is the
+        stat result of fsrc if known.
+
+        Return the actually used copy method. In auto mode, reflink, kernel and
+        buffered copy are tried in order. Files with holes are copied by their data
+        extents if possible, which are copied in the same way as kernel or buffered
+        copy.
+        """
+
+        method = self._copy_method
+
+        if method in ("auto", "reflink"):
+            try:
+                fcntl.ioctl(fdst.fileno(), self._FICLONE, fsrc.fileno())
+                return "reflink"
+            except OSError:
+                if method == "reflink":
+                    raise
+
+        if st is None:
+            st = os.fstat(fsrc.fileno())
+        if hasattr(os, "SEEK_DATA") and self._is_sparse(st):
+            try:
+                copied = self._copy_sparse(
+                    fsrc.fileno(), fdst.fileno(), st.st_size, method != "buffered"
+                )
+            except OSError:
+                # the filesystem doesn't support seeking holes
+                fsrc.seek(0)
+                fdst.truncate(0)
+            else:
+                with self._lock:
+                    self._copy_method_counter["sparse_size"] += st.st_size
+                    self._copy_method_counter["sparse_data"] += copied
+                return "sparse"
+
+        if method in ("auto", "kernel"):
+            try:
+                self._copy_kernel(fsrc.fileno(), fdst.fileno())
+                return "kernel"
+            except OSError:
+                if method == "kernel":
+                    raise
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+
+        shutil.copyfileobj(fsrc, fdst)
+        return "buffered"
+
+    @classmethod
+    def _copy_delta(cls, infd, outfd) -> int:
+        """Rewrite blocks of outfd which differ from infd in place and truncate it to
+        the size of infd.
+
+        Return the number of rewritten bytes.
+        """
+
+        written = 0
+        offset = 0
+        while True:
+            data = os.pread(infd, cls._DELTA_READ_SIZE, offset)
+            if not data:
+                break
+
+            old = os.pread(outfd, len(data), offset)
+            if data != old:
+                for i in range(0, len(data), cls._DELTA_BLOCK_SIZE):
+                    block = data[i : i + cls._DELTA_BLOCK_SIZE]
+                    if block != old[i : i + cls._DELTA_BLOCK_SIZE]:
+                        os.pwrite(outfd, block, offset + i)
+                        written += len(block)
+            offset += len(data)
+
+        os.ftruncate(outfd, offset)
+        return written
+
+    def _is_delta_copy(self, src, dest) -> bool:
+        """Return True if dest is an existing file to update in place by delta copy,
+        i.e., src is not smaller than delta_threshold.
+        """
+
+        threshold = self._delta_threshold
+        if threshold is None or self._stat(src).st_size < threshold:
+            return False
+
+        try:
+            return stat.S_ISREG(os.lstat(dest).st_mode)
+        except FileNotFoundError:
+            return False
+
+    def _copy_file(self, src, dest) -> None:
+        """Copy file src to dest with metadata like shutil.copy2()."""
+
+        st = self._stat(src)
+        size = st.st_size
+        if self._is_delta_copy(src, dest):
+            with open(src, "rb") as fsrc, open(dest, "r+b") as fdst:
+                written = self._copy_delta(fsrc.fileno(), fdst.fileno())
+            with self._phase_timer.phase("metadata"):
+                shutil.copystat(src, dest)
+
+            with self._lock:
+                self._copy_method_counter["delta"] += 1
+                self._copy_method_counter["delta_written"] += written
+                self._copy_method_counter["delta_size"] += size
+            self._add_stats(files_copied=1, bytes_copied=written)
+            return
+
+        with open(src, "rb") as fsrc, open(dest, "wb") as fdst:
+            method = self._copy_data(fsrc, fdst, st)
+        with self._phase_timer.phase("metadata"):
+            shutil.copystat(src, dest)
+
+        with self._lock:
+            self._copy_method_counter[method] += 1
+        self._add_stats(files_copied=1, bytes_copied=size)
+
+    def _copy_files(self, pairs, copy=None) -> None:
+        """Copy (src, dest) file pairs by copy, using the worker pool if any.
+
+        Functions in pairs, e.g., copying metadata of directories, are called in this
+        thread once all copies before them are done. Errors are raised in the order
+        of pairs, so the reported error doesn't depend on thread scheduling.
+        """
+
+        copy = copy or self._copy_file
+
+        def finish(item):
+            if callable(item):
+                with self._phase_timer.phase("metadata"):
+                    item()
+            else:
+                item.result()
+
+        if self._executor is None:
+            for item in pairs:
+                if callable(item):
+                    finish(item)
+                else:
+                    self._run_copy(copy, *item)
+            return
+
+        app = getattr(self._local, "app", None)
+
+        def run(src, dest):
+            # count the copy for the application of the submitting thread
+            self._local.app = app
+            self._run_copy(copy, src, dest)
+
+        pending = deque()
+        try:
+            for item in pairs:
+                if callable(item):
+                    pending.append(item)
+                else:
+                    pending.append(self._executor.submit(run, *item))
+                # bound the number of in-flight copies to keep memory usage low
+                if len(pending) >= self._jobs * self._JOB_QUEUE_FACTOR:
+                    finish(pending.popleft())
+
+            while pending:
+                finish(pending.popleft())
+        finally:
+            pending = [item for item in pending if not callable(item)]
+            for future in pending:
+                future.cancel()
+            futures.wait(pending)
+
+    @contextmanager
+    def _copy_workers(self):
+        """Prepare for file copies and report the used copy methods afterwards.
+
+        The worker pool is started if more than one job is set.
+        """
+
+        jobs = self._jobs
+        if not isinstance(jobs, int) or isinstance(jobs, bool) or jobs < 1:
+            raise RuntimeError(f"invalid jobs: {jobs}: must be a positive integer")
+        if self._copy_method not in self._COPY_METHODS:
+            raise RuntimeError(
+                f"invalid copy_method: {self._copy_method}: must be one of "
+                f"{', '.join(self._COPY_METHODS)}"
+            )
+        threshold = self._delta_threshold
+        if threshold is not None and (
+            not isinstance(threshold, int)
+            or isinstance(threshold, bool)
+            or threshold < 1
+        ):
+            raise RuntimeError(
+                f"invalid delta_threshold: {threshold}: must be a positive integer"
+            )
+
+        self._copy_method_counter = Counter()
+
+        if jobs > 1:
+            self._executor = futures.ThreadPoolExecutor(
+                max_workers=jobs, thread_name_prefix="dotbackup"
+            )
+        try:
+            yield
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+        counter = self._copy_method_counter
+        methods = self._COPY_METHODS + ("sparse",)
+        copied = sum(counter[method] for method in methods)
+        if copied:
+            self._LOGGER.info(
+                f"copied {copied} files: "
+                + ", ".join(
+                    f"{method} {counter[method]}"
+                    for method in methods
+                    if method in counter
+                )
+            )
+        if counter["sparse"]:
+            self._LOGGER.info(
+                f"copied data of {counter['sparse']} sparse files, "
+                f"{counter['sparse_data']} of {counter['sparse_size']} bytes"
+            )
+        if counter["delta"]:
+            self._LOGGER.info(
+                f"updated {counter['delta']} files in place, rewrote "
+                f"{counter['delta_written']} of {counter['delta_size']} bytes"
+            )
+        if counter["link"]:
+            self._LOGGER.info(f"linked {counter['link']} unchanged files")
+
+    @staticmethod
+    def _is_ignored(path, rel_path, ignore, is_dir=False) -> bool:
+        """Return True if any component of rel_path under path is ignored, where the
+        last component is a directory if is_dir is True and the others are.
+
+        ignore should be bound to path or the root of the configured file which path
+        is in, and path is the root otherwise. The file system is not checked, so
+        that paths which don't exist yet can be matched.
+        """
+
+        if ignore.root is None:
+            ignore = ignore.bind(path)
+
+        names = rel_path.split("/")
+        for i, name in enumerate(names):
+            dir_hint = is_dir if i == len(names) - 1 else True
+            if name in ignore(path, [name], lambda _: dir_hint):
+                return True
+            path = os.path.join(path, name)
+
+        return False
+
+    def _list_snapshots(self) -> list:
+        """Return snapshot names in backup_dir from the oldest to the newest."""
+
+        snapshots = []
+        try:
+            with os.scandir(self._normpath(self._backup_dir)) as it:
+                for entry in it:
+                    match = self._SNAPSHOT_PATTERN.fullmatch(entry.name)
+                    if match and entry.is_dir(follow_symlinks=False):
+                        snapshots.append((match[1], int(match[2] or 0), entry.name))
+        except FileNotFoundError:
+            return []
+
+        return [name for *_, name in sorted(snapshots)]
+
+    def _get_latest_snapshot(self):
+        """Return the name of the latest complete snapshot, or None if not found."""
+
+        root = Path(self._normpath(self._backup_dir))
+        try:
+            name = os.readlink(root / self._LATEST_SNAPSHOT)
+        except OSError:
+            return None
+
+        return name if (root / name).is_dir() else None
+
+    def _new_snapshot(self) -> str:
+        """Create a new snapshot directory and return its name."""
+
+        root = Path(self._normpath(self._backup_dir))
+        root.mkdir(parents=True, exist_ok=True)
+
+        timestamp = datetime.now().strftime(self._SNAPSHOT_FORMAT)
+        name = timestamp
+        suffix = 0
+        while True:
+            try:
+                (root / name).mkdir()
+                return name
+            except FileExistsError:
+                suffix += 1
+                name = f"{timestamp}.{suffix}"
+
+    def _start_snapshot(self) -> None:
+        """Create a new snapshot for backup."""
+
+        keep = self._keep_snapshots
+        if not isinstance(keep, int) or isinstance(keep, bool) or keep < 0:
+            raise RuntimeError(
+                f"invalid keep_snapshots: {keep}: must be a non-negative integer"
+            )
+
+        latest = self._get_latest_snapshot()
+        self._snapshot_name = self._new_snapshot()
+        self._prev_snapshot_root = (
+            None
+            if latest is None
+            else os.path.join(self._normpath(self._backup_dir), latest)
+        )
+        self._LOGGER.info(f"creating snapshot {self._snapshot_name}...")
+
+    def _finish_snapshot(self) -> None:
+        """Mark the new snapshot as the latest one and delete old snapshots."""
+
+        root = Path(self._normpath(self._backup_dir))
+        tmp_link = root / f".{self._LATEST_SNAPSHOT}.tmp"
+        if os.path.lexists(tmp_link):
+            tmp_link.unlink()
+        os.symlink(self._snapshot_name, tmp_link)
+        os.replace(tmp_link, root / self._LATEST_SNAPSHOT)
+
+        if self._keep_snapshots:
+            for name in self._list_snapshots()[: -self._keep_snapshots]:
+                self._LOGGER.info(f"deleting old snapshot {name}...")
+                self._remove_tree(root / name)
+
+    def _select_snapshot(self) -> None:
+        """Select the snapshot to set up from."""
+
+        name = self._dict.get("selected_snapshot", self._LATEST_SNAPSHOT)
+        if name == self._LATEST_SNAPSHOT:
+            name = self._get_latest_snapshot()
+        elif name not in self._list_snapshots():
+            name = None
+
+        if name is None:
+            raise RuntimeError(
+                "snapshot not found: "
+                f"{self._dict.get('selected_snapshot', self._LATEST_SNAPSHOT)}"
+            )
+
+        self._snapshot_name = name
+        self._LOGGER.info(f"setting up from snapshot {name}...")
+
+    @staticmethod
+    def _link_file(src, dest) -> None:
+        """Hard link dest to src, replacing the existing dest."""
+
+        if os.path.lexists(dest):
+            os.unlink(dest)
+        os.link(src, dest)
+
+    def _link_or_copy(self, src, dest) -> None:
+        """Hard link dest to the file in the previous snapshot if src is unchanged,
+        copy src to dest otherwise.
+        """
+
+        # never write through a link into the previous snapshot
+        if os.path.lexists(dest):
+            os.unlink(dest)
+
+        prefix = str(self._get_backup_root())
+        if self._prev_snapshot_root is not None and dest.startswith(prefix):
+            prev = self._prev_snapshot_root + dest[len(prefix) :]
+            st = self._stat(src)
+            try:
+                prev_st = os.stat(prev)
+            except FileNotFoundError:
+                prev_st = None
+
+            if prev_st is not None and (
+                prev_st.st_size,
+                prev_st.st_mtime_ns,
+                prev_st.st_mode,
+            ) == (st.st_size, st.st_mtime_ns, st.st_mode):
+                self._LOGGER.debug(f"linking unchanged {os.fspath(src)} to {prev}")
+                os.link(prev, dest)
+                with self._lock:
+                    self._copy_method_counter["link"] += 1
+                self._add_stats(files_linked=1)
+                return
+
+        self._copy_file(src, dest)
+
+    def _link_unselected_apps(self) -> None:
+        """Link backup files of unselected applications from the previous snapshot,
+        so that every snapshot is complete.
+        """
+
+        if not self._selected_apps or self._prev_snapshot_root is None:
+            return
+
+        root = self._get_backup_root()
+        for app, app_spec in self._get_plan().items():
+            if app in self._selected_apps:
+                continue
+
+            for spec in app_spec.files:
+                dest_path = root / spec.rel_path
+                prev_path = Path(self._prev_snapshot_root) / spec.rel_path
+                if prev_path.exists():
+                    self._LOGGER.debug(f"linking {prev_path} to {dest_path}...")
+                    self._copy_tree(prev_path, dest_path, None, self._link_file)
+
+    def _backup_files(self, app, files, ignore) -> None:
+        """Back up files, i.e., FileSpec objects, of app except ignore files."""
+
+        root = self._get_backup_root()
+        for spec in files:
+            dest_path = root / spec.rel_path
+
+            if self._clean:
+                self._backend.delete(dest_path)
+
+            if not spec.path.exists():
+                self._LOGGER.warning(
+                    f"file not found: {spec.file}: skip backing up this file"
+                )
+                self._add_stats(files_missing=1)
+                continue
+
+            self._backend.store(spec, dest_path, ignore)
+
+    def _get_setup_specs(self, files, selected_files=None) -> list:
+        """Return FileSpec objects to set up of the configured files, i.e., FileSpec
+        objects, which are narrowed down to the selected files if any.
+
+        Selected files in a configured directory keep it as their root.
+        """
+
+        if selected_files is None:
+            selected_files = self._selected_files
+
+        if not selected_files:
+            return list(files)
+
+        home = Path(self._normpath("~"))
+        selected = [Path(self._normpath(file)) for file in selected_files]
+        setup_specs = []
+        for spec in files:
+            for selected_path in selected:
+                if selected_path == spec.path or selected_path in spec.path.parents:
+                    setup_spec = spec
+                elif spec.path in selected_path.parents:
+                    setup_spec = FileSpec(
+                        str(selected_path),
+                        selected_path,
+                        selected_path.relative_to(home),
+                        spec.root,
+                    )
+                else:
+                    continue
+
+                if all(setup_spec.path != s.path for s in setup_specs):
+                    setup_specs.append(setup_spec)
+
+        return setup_specs
+
+    def _bind_ignore(self, ignore, spec: FileSpec, path):
+        """Return ignore bound to the root of spec in the tree where path is spec.path,
+        e.g., its backup file path, or None if ignore is None.
+        """
+
+        if ignore is None:
+            return None
+
+        root = Path(path)
+        for _ in spec.path.relative_to(spec.root).parts:
+            root = root.parent
+        return ignore.bind(root)
+
+    def _select_apps_by_files(self) -> None:
+        """Select applications which configure the selected files."""
+
+        if not self._selected_files:
+            return
+
+        plan = self._get_plan()
+        apps = self._selected_apps or list(plan)
+        selected_apps = []
+        for file in self._selected_files:
+            found = False
+            for app in apps:
+                if self._get_setup_specs(plan[app].files, [file]):
+                    found = True
+                    if app not in selected_apps:
+                        selected_apps.append(app)
+
+            if not found:
+                raise RuntimeError(f"file not configured: {file}")
+
+        self._dict["selected_apps"] = selected_apps
+
+    def _setup_files(self, app, files, ignore) -> None:
+        """Set up files, i.e., FileSpec objects, of app except ignore files."""
+
+        mirror = self._mirror
+
+        for spec in self._get_setup_specs(files):
+            if self._clean and not mirror:
+                self._delete_old(spec.path)
+
+            self._backend.restore(spec, self._get_backup_file_path(spec.path), ignore)
+
+    def _check_plan_support(self) -> None:
+        if not self._backend.plan:
+            raise RuntimeError(f"plan is not supported by {self._backend.name} storage")
+        if self._snapshot:
+            raise RuntimeError("plan is not supported with snapshot")
+
+    def _is_incremental_plan(self, typ) -> bool:
+        return typ == "backup" and bool(self._incremental) and not self._mirror
+
+    def _iter_planned_paths(self, typ, files):
+        """Yield (spec, src_path, dest_path) tuples of FileSpec objects to back up or
+        set up.
+        """
+
+        if typ == "backup":
+            root = self._get_backup_root()
+            for spec in files:
+                yield spec, spec.path, root / spec.rel_path
+        else:
+            for spec in self._get_setup_specs(files):
+                yield spec, self._get_backup_file_path(spec.path), spec.path
+
+    def _plan_files(self, typ, files, ignore, ops, roots) -> None:
+        """Append operations to back up or set up files, i.e., FileSpec objects,
+        except ignore files to ops without doing them. Sources of incremental backup
+        are appended to roots.
+        """
+
+        mirror = bool(self._mirror)
+        incremental = self._is_incremental_plan(typ)
+        clean = self._clean and not mirror
+
+        for spec, src_path, dest_path in self._iter_planned_paths(typ, files):
+            if clean and os.path.lexists(dest_path):
+                ops.append({"op": "delete", "path": str(dest_path)})
+
+            if not src_path.exists():
+                self._LOGGER.warning(f"file not found: {src_path}: skip this file")
+                continue
+            if incremental:
+                roots.append(str(src_path))
+
+            src_ignore = self._bind_ignore(ignore, spec, src_path)
+            pairs = self._iter_pairs(
+                src_path, dest_path, src_ignore, mirror=mirror, ops=ops
+            )
+            for entry, dest in pairs:
+                src = os.fspath(entry)
+                try:
+                    st = self._stat(entry)
+                    dest_st = os.lstat(dest) if os.path.lexists(dest) else None
+                except OSError as e:
+                    raise RuntimeError(f"failed to plan copying {src} to {dest}: {e}")
+
+                op = {"op": "copy", "src": src, "dest": dest, "size": st.st_size}
+                if mirror and self._is_mirrored(st, dest_st):
+                    op["op"] = "skip-unchanged"
+                if incremental and not clean and dest_st is not None:
+                    entry = self._get_manifest_entry(st)
+                    if self._manifest.get(src) == entry:
+                        # kept in the manifest when the plan is applied
+                        op["op"] = "skip-unchanged"
+                        op["entry"] = entry
+                ops.append(op)
+
+    def _plan_operations(self, typ, apps) -> dict:
+        """Return the plan of operations to back up or set up apps without doing
+        them, and the totals of operations.
+        """
+
+        ops = []
+        roots = []
+
+        def plan_hooks(hook_type, hook_dict, app=None):
+            if hook_type in hook_dict:
+                ops.append(
+                    {
+                        "op": "run-hook",
+                        "type": hook_type,
+                        "app": app,
+                        "hooks": hook_dict[hook_type],
+                    }
+                )
+
+        plan_hooks(f"pre_{typ}", self._dict)
+        for app in apps:
+            spec = self._get_plan()[app]
+            plan_hooks(f"pre_{typ}", spec.hooks, app)
+            self._plan_files(typ, spec.files, spec.ignore, ops, roots)
+            plan_hooks(f"post_{typ}", spec.hooks, app)
+        plan_hooks(f"post_{typ}", self._dict)
+
+        totals = {op: {"count": 0, "bytes": 0} for op in self._PLAN_OPERATIONS}
+        for op in ops:
+            totals[op["op"]]["count"] += 1
+            totals[op["op"]]["bytes"] += op.get("size", 0)
+
+        return {
+            "version": self._PLAN_VERSION,
+            "command": typ,
+            "backup_dir": self._normpath(self._backup_dir),
+            "mirror": bool(self._mirror),
+            "incremental": self._is_incremental_plan(typ),
+            "roots": roots,
+            "operations": ops,
+            "totals": totals,
+        }
+
+    def _load_plan(self, typ, file) -> dict:
+        """Return the plan of operations in file after checking it's a plan of typ
+        for this configuration.
+        """
+
+        try:
+            with open(self._normpath(file), encoding="utf-8") as f:
+                plan = json.load(f)
+
+            if plan["version"] != self._PLAN_VERSION:
+                raise ValueError(f"unsupported version: {plan['version']}")
+            self._check_plan_keys(plan, self._PLAN_KEYS, "plan")
+            for op in plan["operations"]:
+                self._check_plan_operation(op, plan["incremental"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            raise RuntimeError(f"invalid plan: {file}: {e}")
+
+        if plan["command"] != typ:
+            raise RuntimeError(f"invalid plan: {file}: not a {typ} plan")
+        if plan["backup_dir"] != self._normpath(self._backup_dir):
+            raise RuntimeError(
+                f"invalid plan: {file}: planned for backup_dir {plan['backup_dir']}"
+            )
+
+        return plan
+
+    @staticmethod
+    def _check_plan_keys(value, keys, name) -> None:
+        """Raise ValueError unless value is a mapping of keys with their types."""
+
+        if not isinstance(value, dict):
+            raise ValueError(f"{name} is not a mapping: {value}")
+        for key, typ in keys.items():
+            if not isinstance(value.get(key), typ):
+                raise ValueError(f"{key} of {name} is not a {typ.__name__}: {value}")
+
+    def _check_plan_operation(self, op, incremental) -> None:
+        """Raise ValueError unless op is a valid operation of a plan."""
+
+        if not isinstance(op, dict) or op.get("op") not in self._PLAN_OPERATIONS:
+            name = op.get("op") if isinstance(op, dict) else op
+            raise ValueError(f"unknown operation: {name}")
+
+        name = f"{op['op']} operation"
+        self._check_plan_keys(op, self._PLAN_OPERATION_KEYS[op["op"]], name)
+        if op["op"] == "run-hook":
+            if op["type"] not in self._HOOK_TYPES:
+                raise ValueError(f"unknown hook type of {name}: {op['type']}")
+            if not isinstance(op.get("app"), (str, type(None))):
+                raise ValueError(f"app of {name} is not a string: {op}")
+        elif op["op"] == "mkdir" and not isinstance(op.get("src", ""), str):
+            raise ValueError(f"src of {name} is not a str: {op}")
+        elif op["op"] == "skip-unchanged" and incremental:
+            # kept in the manifest when the plan is applied
+            self._check_plan_keys(op, {"entry": list}, name)
+
+    @classmethod
+    def _delete_path(cls, path) -> None:
+        if os.path.isdir(path) and not os.path.islink(path):
+            cls._remove_tree(path)
+        elif os.path.lexists(path):
+            os.unlink(path)
+
+    def _apply_operations(self, plan) -> None:
+        """Do the planned operations in order.
+
+        Consecutive copies are done by the worker pool if any.
+        """
+
+        incremental = plan["incremental"]
+        copy = None
+        if plan["mirror"]:
+            copy = self._copy_if_differ
+        elif incremental:
+            copy = self._copy_if_changed
+            self._start_manifest(plan["roots"])
+
+        def is_copy(op):
+            return op["op"] == "copy"
+
+        # created directories which the operations are under, whose metadata are
+        # copied after their contents once the operations leave them
+        dirs = []
+
+        for copying, ops in itertools.groupby(plan["operations"], key=is_copy):
+            if copying:
+                self._copy_files(((op["src"], op["dest"]) for op in ops), copy)
+                continue
+
+            for op in ops:
+                if op["op"] == "run-hook":
+                    hook_dict = {op["type"]: op["hooks"]}
+                    self._safe_run_hooks(op["type"], hook_dict, app=op["app"])
+                elif op["op"] == "mkdir":
+                    os.makedirs(op["path"], exist_ok=True)
+                    if "src" in op:
+                        self._leave_dirs(dirs, op["path"])
+                        dirs.append((op["src"], op["path"]))
+                elif op["op"] == "delete":
+                    self._LOGGER.info(f"deleting {op['path']}...")
+                    self._delete_path(op["path"])
+                elif incremental:
+                    self._new_manifest[op["src"]] = op["entry"]
+
+        self._leave_dirs(dirs)
+        if incremental:
+            self._save_manifest()
+
+    def _run_plan(self, typ, apps) -> int:
+        """Print the plan of operations, or apply the plan file."""
+
+        self._check_plan_support()
+
+        if self._dict.get("apply_plan") is None:
+            if self._is_incremental_plan(typ):
+                self._manifest = self._load_manifest()["files"]
+            plan = self._plan_operations(typ, apps)
+            json.dump(plan, sys.stdout, indent=2)
+            print()
+            self._LOGGER.info(
+                "planned "
+                + ", ".join(
+                    f"{op} {total['count']} ({total['bytes']} bytes)"
+                    for op, total in plan["totals"].items()
+                    if total["count"]
+                )
+            )
+            return 0
+
+        plan = self._load_plan(typ, self._dict["apply_plan"])
+        self._set_env()
+        with self._hook_session(), self._copy_workers():
+            self._apply_operations(plan)
+
+        return 0
+
+    def _set_env(self) -> None:
+        """Set environment variable."""
+        if self._snapshot_name is None:
+            os.environ["BACKUP_DIR"] = self._backup_dir
+        else:
+            os.environ["BACKUP_DIR"] = str(self._get_backup_root())
+
+    def _list_apps(self) -> None:
+        """List configured applications."""
+        print("\n".join(self._apps_dict.keys()))
+
+    def _get_depends(self, app) -> list:
+        """Return the selected applications that app depends on."""
+
+        plan = self._get_plan()
+        depends = plan[app].depends_on
+
+        for dep in depends:
+            if dep not in plan:
+                raise RuntimeError(f"unknown dependency of {app}: {dep}")
+
+        selected = self._selected_apps
+        return [dep for dep in depends if not selected or dep in selected]
+
+    def _sort_apps(self) -> list:
+        """Return selected applications in dependency order.
+
+        The configured order is kept unless an application depends on a later one.
+        """
+
+        apps = self._selected_apps if self._selected_apps else self._get_plan().keys()
+        visited = dict()
+        order = []
+
+        def visit(app, path):
+            if visited.get(app) == "done":
+                return
+            if visited.get(app) == "visiting":
+                cycle = path[path.index(app) :] + [app]
+                raise RuntimeError(f"dependency cycle: {' -> '.join(cycle)}")
+
+            visited[app] = "visiting"
+            for dep in self._get_depends(app):
+                visit(dep, path + [app])
+            visited[app] = "done"
+            order.append(app)
+
+        for app in apps:
+            visit(app, [])
+
+        return order
+
+    def _run_apps(self, apps, run) -> None:
+        """Run run(app) for each application in apps sorted by _sort_apps().
+
+        Applications are run one by one in dependency order, or concurrently by at
+        most app_jobs threads, where an application is started only after all its
+        dependencies are done.
+        """
+
+        app_jobs = self._app_jobs
+        if not isinstance(app_jobs, int) or isinstance(app_jobs, bool) or app_jobs < 1:
+            raise RuntimeError(
+                f"invalid app_jobs: {app_jobs}: must be a positive integer"
+            )
+
+        if app_jobs == 1:
+            for app in apps:
+                run(app)
+            return
+
+        waiting = {app: set(self._get_depends(app)) for app in apps}
+        running = dict()
+        errors = dict()
+
+        with futures.ThreadPoolExecutor(
+            max_workers=app_jobs, thread_name_prefix="dotbackup-app"
+        ) as executor:
+            while waiting or running:
+                # stop scheduling new applications once one of them failed
+                for app in apps:
+                    if not errors and waiting.get(app) == set():
+                        del waiting[app]
+                        running[executor.submit(run, app)] = app
+
+                if not running:
+                    break
+
+                done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    app = running.pop(future)
+                    if future.exception() is not None:
+                        errors[app] = future.exception()
+                        continue
+                    for deps in waiting.values():
+                        deps.discard(app)
+
+        # report the error of the first failed application in dependency order
+        for app in apps:
+            if app in errors:
+                raise errors[app]
+
+    def _backup_app(self, app) -> None:
+        """Do backup of app with its hooks."""
+
+        spec = self._get_plan()[app]
+
+        self._LOGGER.info(f"doing {app} backup...")
+        with self._app_stats(app):
+            self._safe_run_hooks("pre_backup", spec.hooks, app=app)
+
+            if spec.files:
+                with self._time_stat("copy_seconds", app), self._phase_timer.phase(
+                    "walk"
+                ):
+                    self._backup_files(app, spec.files, spec.ignore)
+                self._log_ignore_hits(app, spec.ignore)
+
+            self._safe_run_hooks("post_backup", spec.hooks, app=app)
+
+    def _setup_app(self, app) -> None:
+        """Do setup of app with its hooks."""
+
+        spec = self._get_plan()[app]
+
+        self._LOGGER.info(f"doing {app} setup...")
+        with self._app_stats(app):
+            self._safe_run_hooks("pre_setup", spec.hooks, app=app)
+
+            if spec.files:
+                with self._time_stat("copy_seconds", app), self._phase_timer.phase(
+                    "walk"
+                ):
+                    self._setup_files(app, spec.files, spec.ignore)
+                self._log_ignore_hits(app, spec.ignore)
+
+            self._safe_run_hooks("post_setup", spec.hooks, app=app)
+
+    def _check_storage(self) -> None:
+        """Check whether the storage is valid and compatible with other options."""
+
+        storage = self._storage
+        if not isinstance(storage, str) or storage not in self._STORAGES:
+            raise RuntimeError(
+                f"invalid storage: {storage}: must be one of "
+                f"{', '.join(self._STORAGES)}"
+            )
+        self._backend = self._STORAGES[storage](self)
+        self._backend.check()
+
+    def _add_stats(self, app=None, **values) -> None:
+        """Add values to the counters of app, which defaults to the application
+        processed by the current thread.
+        """
+
+        if app is None:
+            app = getattr(self._local, "app", None)
+        with self._lock:
+            counter = self._stats[app]
+            for name, value in values.items():
+                counter[name] += value
+
+    @contextmanager
+    def _time_stat(self, name, app=None):
+        """Add the time spent in the context to the timer name of app."""
+
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._add_stats(app, **{name: time.monotonic() - start})
+
+    @contextmanager
+    def _app_stats(self, app):
+        """Count what is done by the current thread in the context for app."""
+
+        self._local.app = app
+        try:
+            with self._time_stat("seconds", app), self._phase_timer.app(app):
+                yield
+        finally:
+            self._local.app = None
+
+    def _get_metrics(self, typ, apps, success) -> dict:
+        """Return timings and counters of the run."""
+
+        names = self._STATS_TIMERS + self._STATS_COUNTERS
+        totals = Counter()
+        for counter in self._stats.values():
+            totals.update({name: counter[name] for name in self._STATS_COUNTERS})
+
+        return {
+            "version": self._STATS_VERSION,
+            "command": typ,
+            "success": success,
+            "timestamp": time.time(),
+            "seconds": self._stats[None]["seconds"],
+            "hook_seconds": self._stats[None]["hook_seconds"],
+            "totals": {name: totals[name] for name in self._STATS_COUNTERS},
+            "copy_methods": dict(getattr(self, "_copy_method_counter", {})),
+            "hooks": [
+                {"hook": hook_title, "command": command, "seconds": duration}
+                for hook_title, command, duration in getattr(
+                    self, "_hook_durations", []
+                )
+            ],
+            "apps": {
+                app: {name: self._stats[app][name] for name in names}
+                for app in apps
+                if app in self._stats
+            },
+        }
+
+    @staticmethod
+    def _print_stats(metrics) -> None:
+        """Print the metrics as a table of applications."""
+
+        header = ("APP", "TIME", "HOOKS", "COPY", "COPIED", "BYTES", "SKIPPED")
+        header += ("LINKED", "MISSING")
+        rows = [header]
+        for app, stats in metrics["apps"].items():
+            rows.append(
+                (
+                    app,
+                    f"{stats['seconds']:.3f}",
+                    f"{stats['hook_seconds']:.3f}",
+                    f"{stats['copy_seconds']:.3f}",
+                    str(stats["files_copied"]),
+                    str(stats["bytes_copied"]),
+                    str(stats["files_skipped"]),
+                    str(stats["files_linked"]),
+                    str(stats["files_missing"]),
+                )
+            )
+        totals = metrics["totals"]
+        rows.append(
+            (
+                "total",
+                f"{metrics['seconds']:.3f}",
+                f"{metrics['hook_seconds']:.3f}",
+                "",
+                str(totals["files_copied"]),
+                str(totals["bytes_copied"]),
+                str(totals["files_skipped"]),
+                str(totals["files_linked"]),
+                str(totals["files_missing"]),
+            )
+        )
+
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        for row in rows:
+            print(
+                "  ".join(
+                    cell.ljust(width) if i == 0 else cell.rjust(width)
+                    for i, (cell, width) in enumerate(zip(row, widths))
+                ).rstrip()
+            )
+
+    @staticmethod
+    def _get_prometheus_text(metrics) -> str:
+        """Return the metrics in Prometheus text exposition format."""
+
+        def escape(value):
+            return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        command = f'command="{metrics["command"]}"'
+        lines = []
+
+        def add(name, help, samples):
+            lines.append(f"# HELP dotbackup_{name} {help}")
+            lines.append(f"# TYPE dotbackup_{name} gauge")
+            for labels, value in samples:
+                lines.append(f"dotbackup_{name}{{{labels}}} {value}")
+
+        add(
+            "last_run_success",
+            "Whether the last run succeeded.",
+            [(command, int(metrics["success"]))],
+        )
+        add(
+            "last_run_timestamp_seconds",
+            "Time when the last run finished.",
+            [(command, metrics["timestamp"])],
+        )
+        add(
+            "last_run_seconds",
+            "Duration of the last run.",
+            [(command, metrics["seconds"])],
+        )
+        for name in Config._STATS_COUNTERS:
+            add(
+                f"last_run_{name}",
+                f"{name.replace('_', ' ').capitalize()} by the last run.",
+                [(command, metrics["totals"][name])],
+            )
+        for name in Config._STATS_TIMERS + Config._STATS_COUNTERS:
+            add(
+                f"app_{name}",
+                f"{name.replace('_', ' ').capitalize()} of each application in the "
+                "last run.",
+                [
+                    (f'{command},app="{escape(app)}"', stats[name])
+                    for app, stats in metrics["apps"].items()
+                ],
+            )
+
+        return "\n".join(lines) + "\n"
+
+    def _write_metrics_file(self, file, text) -> None:
+        """Write text to the metrics file atomically, so that a collector never
+        reads a partial file.
+        """
+
+        path = Path(self._normpath(file))
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, mode="w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            raise RuntimeError(f"failed to write metrics file: {file}: {e}")
+
+    def _save_stats(self, typ, apps, success) -> None:
+        metrics = self._get_metrics(typ, apps, success)
+
+        if success and self._dict.get("print_stats"):
+            self._print_stats(metrics)
+        if self._metrics_file:
+            self._write_metrics_file(
+                self._metrics_file, json.dumps(metrics, indent=2) + "\n"
+            )
+        if self._prometheus_file:
+            self._write_metrics_file(
+                self._prometheus_file, self._get_prometheus_text(metrics)
+            )
+
+    @contextmanager
+    def _report_stats(self, typ, apps):
+        """Time the run in the context and report its timings and counters, even if
+        it fails.
+        """
+
+        self._stats = defaultdict(Counter)
+        try:
+            with self._time_stat("seconds"):
+                yield
+        except BaseException:
+            try:
+                self._save_stats(typ, apps, False)
+            except RuntimeError as e:
+                self._LOGGER.error(" ".join(e.args))
+            raise
+        self._save_stats(typ, apps, True)
+
+    def _save_profile(self, typ, apps, file, times, profile) -> None:
+        """Write the report of times, i.e., seconds of each phase by application, to
+        file, and the data of profile to file.pstats.
+        """
+
+        columns = ("total",) + self._PROFILE_PHASES + ("other",)
+        rows = [["APP"] + [column.upper() for column in columns]]
+        for app in [app for app in apps if app in times] + [None]:
+            phases = times[app]
+            phases["total"] = sum(phases.values())
+            name = "(global)" if app is None else app
+            rows.append([name] + [f"{phases[column]:.3f}" for column in columns])
+
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        table = "\n".join(
+            "  ".join(
+                cell.ljust(width) if i == 0 else cell.rjust(width)
+                for i, (cell, width) in enumerate(zip(row, widths))
+            )
+            for row in rows
+        )
+
+        path = Path(self._normpath(file))
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, mode="w", encoding="utf-8") as f:
+                f.write(f"{typ} profile by application and phase in seconds\n\n")
+                f.write(f"{table}\n")
+            profile.dump_stats(f"{path}.pstats")
+        except OSError as e:
+            raise RuntimeError(f"failed to write profile: {file}: {e}")
+
+        self._LOGGER.info(f"wrote profile to {file}")
+
+    @contextmanager
+    def _profile_session(self, typ, apps):
+        """Time the phases of the run in the context by application and profile it
+        if profiling is enabled, and write the report even if it fails.
+        """
+
+        file = self._dict.get("profile")
+        if not file:
+            yield
+            return
+
+        import cProfile
+
+        # the profiler only sees the thread it's enabled in, and phases are timed in
+        # one thread
+        for key in ("jobs", "app_jobs"):
+            value = self._dict.get(key, 1)
+            if isinstance(value, int) and not isinstance(value, bool) and value > 1:
+                self._LOGGER.warning(f"profiling in one thread, ignoring {key}")
+                self._dict[key] = 1
+
+        timer = self._phase_timer
+        profile = cProfile.Profile()
+        timer.start()
+        profile.enable()
+        try:
+            with timer.app(None):
+                yield
+        except BaseException:
+            profile.disable()
+            try:
+                self._save_profile(typ, apps, file, timer.stop(), profile)
+            except RuntimeError as e:
+                self._LOGGER.error(" ".join(e.args))
+            raise
+        finally:
+            profile.disable()
+        self._save_profile(typ, apps, file, timer.stop(), profile)
+
+    def _new_watcher(self, paths):
+        """Return an inotify watcher of paths, or a polling one if inotify is not
+        available.
+        """
+
+        try:
+            return InotifyWatcher(paths)
+        except (AttributeError, OSError) as e:
+            self._LOGGER.info(
+                f"inotify not available ({e}), polling every {self._watch_interval}s"
+            )
+            return PollWatcher(paths, self._watch_interval)
+
+    def _wait_changes(self, watcher) -> set:
+        """Return paths changed in a burst of changes, which ends when there are no
+        more changes for watch_delay seconds, or an empty set if stopped.
+        """
+
+        changed = set()
+        while not self._watch_stop.is_set():
+            timeout = self._watch_delay if changed else self._WATCH_STOP_CHECK
+            paths = watcher.read(timeout)
+            if paths:
+                changed.update(paths)
+            elif changed:
+                return changed
+
+        return set()
+
+    def _get_changed_files(self, app, paths) -> list:
+        """Return FileSpec objects of the changed paths of app, except the ignored
+        ones and the ones under another changed path.
+        """
+
+        spec = self._get_plan()[app]
+        files = []
+        for file_spec in spec.files:
+            root = str(file_spec.path)
+            for path in sorted(paths):
+                if path == root:
+                    files.append(file_spec)
+                    continue
+                if not path.startswith(root + os.sep):
+                    continue
+
+                rel_path = path[len(root) + 1 :]
+                if spec.ignore is not None and self._is_ignored(
+                    root, rel_path, spec.ignore, os.path.isdir(path)
+                ):
+                    continue
+                files.append(
+                    FileSpec(
+                        path, Path(path), file_spec.rel_path / rel_path, file_spec.root
+                    )
+                )
+
+        # paths are sorted, so a parent comes before its children
+        kept = []
+        for file_spec in files:
+            if not any(
+                parent.path == file_spec.path or parent.path in file_spec.path.parents
+                for parent in kept
+            ):
+                kept.append(file_spec)
+        return kept
+
+    def _backup_changes(self, apps, paths) -> None:
+        """Back up the changed paths of apps, where only the applications with
+        changes are run with their hooks.
+        """
+
+        plan = self._get_plan()
+        root = self._get_backup_root()
+        changes = dict()
+        for app in apps:
+            files = []
+            for file_spec in self._get_changed_files(app, paths):
+                if file_spec.path.exists():
+                    files.append(file_spec)
+                elif self._mirror:
+                    dest_path = root / file_spec.rel_path
+                    if os.path.lexists(dest_path):
+                        is_dir = dest_path.is_dir() and not dest_path.is_symlink()
+                        self._delete_stale(str(dest_path), is_dir)
+            if files:
+                spec = plan[app]
+                changes[app] = AppSpec(
+                    app, files, spec.ignore, spec.depends_on, spec.hooks
+                )
+
+        if not changes:
+            return
+
+        self._LOGGER.info(f"backing up changes of {', '.join(changes)}...")
+        selected_apps = self._dict.get("selected_apps")
+        self._plan = dict(plan, **changes)
+        # dependencies without changes are done already
+        self._dict["selected_apps"] = list(changes)
+        try:
+            self._run_backup([app for app in apps if app in changes])
+        finally:
+            self._plan = plan
+            self._dict["selected_apps"] = selected_apps
+
+    def _watch(self, apps) -> int:
+        """Back up apps, then keep backing up their changed files until interrupted
+        or stopped.
+        """
+
+        if not self._backend.watch:
+            raise RuntimeError(
+                f"watch is not supported by {self._backend.name} storage"
+            )
+        if self._snapshot:
+            raise RuntimeError("watch is not supported with snapshot")
+        for name in ("watch_delay", "watch_interval"):
+            self._check_hook_timeout(name, self._dict.get(name))
+
+        self._run_backup(apps)
+
+        plan = self._get_plan()
+        paths = sorted({str(spec.path) for app in apps for spec in plan[app].files})
+        watcher = self._new_watcher(paths)
+        self._LOGGER.info(f"watching {len(paths)} files for changes...")
+        try:
+            while not self._watch_stop.is_set():
+                changed = self._wait_changes(watcher)
+                if not changed:
+                    continue
+                try:
+                    self._backup_changes(apps, changed)
+                except RuntimeError as e:
+                    # keep watching, the files are backed up on their next change
+                    self._LOGGER.error(" ".join(e.args))
+        except KeyboardInterrupt:
+            self._LOGGER.info("stopped watching")
+        finally:
+            watcher.close()
+
+        return 0
+
+    def _run_backup(self, apps) -> None:
+        """Back up apps with global hooks, reporting the statistics of the run."""
+
+        with self._report_stats("backup", apps), self._profile_session("backup", apps):
+            self._backend.begin("backup")
+            if self._snapshot:
+                self._start_snapshot()
+
+            self._set_env()
+
+            with self._hook_session():
+                self._safe_run_hooks("pre_backup", self._dict)
+
+                with self._copy_workers():
+                    with self._backend.open("backup"):
+                        self._run_apps(apps, self._backup_app)
+                    if self._snapshot:
+                        self._link_unselected_apps()
+
+                self._safe_run_hooks("post_backup", self._dict)
+
+            if self._snapshot:
+                self._finish_snapshot()
+
+    def backup(self) -> int:
+        """Do backup."""
+
+        if not self._check_apps():
+            return 1
+
+        self._plan = self._build_plan()
+        self._check_storage()
+        apps = self._sort_apps()
+
+        if self._dict.get("print_plan") or self._dict.get("apply_plan"):
+            return self._run_plan("backup", apps)
+
+        if self._dict.get("watch"):
+            return self._watch(apps)
+
+        self._run_backup(apps)
+        return 0
+
+    def setup(self) -> int:
+        """Do setup."""
+
+        if not self._check_apps():
+            return 1
+
+        self._plan = self._build_plan()
+        self._check_storage()
+        self._select_apps_by_files()
+        apps = self._sort_apps()
+
+        if self._dict.get("print_plan") or self._dict.get("apply_plan"):
+            return self._run_plan("setup", apps)
+
+        with self._report_stats("setup", apps), self._profile_session("setup", apps):
+            if self._snapshot:
+                self._select_snapshot()
+            self._backend.begin("setup")
 
-            self._LOGGER.info(f"doing {app} setup...")
-            self._safe_run_hooks("pre_setup", app_dict, app=app)
+            self._set_env()
 
-            if "files" in app_dict:
-                self._setup_files(app, app_dict["files"], self._get_ignore(app_dict))
+            with self._hook_session():
+                self._safe_run_hooks("pre_setup", self._dict)
 
-            self._safe_run_hooks("post_setup", app_dict, app=app)
+                with self._copy_workers(), self._backend.open("setup"):
+                    self._run_apps(apps, self._setup_app)
 
-        self._safe_run_hooks("post_setup", self._dict)
+                self._safe_run_hooks("post_setup", self._dict)
 
         return 0
 
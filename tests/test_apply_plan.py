@@ -0,0 +1,162 @@
+"""Test planned operations with basic.yml."""
+
+import json
+import os
+
+import helper
+import pytest
+
+import dotbackup
+
+
+@pytest.fixture(autouse=True)
+def _clean_test(monkeypatch):
+    helper.clean_test(monkeypatch)
+
+
+class TestApplyPlan:
+    _config = helper.get_config("basic")
+    _files = [
+        "~/.config/app_a/a.txt",
+        "~/.config/app_a/sub/a.txt",
+        "~/.config/app_b/b1.txt",
+        "~/.config/app_b/b2.txt",
+    ]
+    _backup_files = list(
+        map(lambda file, func=_config._get_backup_file_path: str(func(file)), _files)
+    )
+    _plan_file = f"{helper.TEST_HOME}/plan.json"
+
+    @pytest.fixture(autouse=True)
+    def _prepare(self):
+        helper.cp(helper.get_config_path("basic"), helper.CONFIG_FILE)
+        for file in self._files:
+            helper.create_file(file, helper.random_str())
+
+    def _plan(self, args, capfd) -> dict:
+        capfd.readouterr()
+        assert dotbackup.dotbackup(["--plan", *args]) == 0
+        out = capfd.readouterr().out
+        with open(self._plan_file, mode="w", encoding="utf-8") as f:
+            f.write(out)
+        return json.loads(out)
+
+    @staticmethod
+    def _get_ops(plan, op) -> list:
+        return [entry for entry in plan["operations"] if entry["op"] == op]
+
+    def test_plan(self, capfd):
+        plan = self._plan([], capfd)
+
+        # nothing is done
+        assert not os.path.exists(self._config._normpath(self._config._backup_dir))
+        assert plan["command"] == "backup"
+        assert sorted(op["dest"] for op in self._get_ops(plan, "copy")) == sorted(
+            self._backup_files
+        )
+        assert plan["totals"]["copy"] == {
+            "count": 4,
+            "bytes": sum(
+                os.path.getsize(self._config._normpath(f)) for f in self._files
+            ),
+        }
+        hooks = [(op["app"], op["type"]) for op in self._get_ops(plan, "run-hook")]
+        assert hooks == [
+            (None, "pre_backup"),
+            ("app_a", "pre_backup"),
+            ("app_a", "post_backup"),
+            ("app_b", "pre_backup"),
+            ("app_b", "post_backup"),
+            (None, "post_backup"),
+        ]
+
+    def test_apply_plan(self, capfd):
+        self._plan([], capfd)
+
+        assert dotbackup.dotbackup(["--apply-plan", self._plan_file, "-j", "4"]) == 0
+        assert helper.validate_backup(self._config)
+        out = capfd.readouterr().out.splitlines()
+        assert out[0].startswith("pre_backup")
+        assert out[-1].startswith("post_backup")
+
+    def test_dir_mtime(self, capfd):
+        mtime = 1577836800 * 10**9
+        for path in ("~/.config/app_a/sub", "~/.config/app_a"):
+            os.utime(self._config._normpath(path), ns=(mtime, mtime))
+        self._plan([], capfd)
+
+        assert dotbackup.dotbackup(["--apply-plan", self._plan_file]) == 0
+        for path in ("~/.config/app_a/sub", "~/.config/app_a"):
+            path = self._config._get_backup_file_path(path)
+            assert os.stat(path).st_mtime_ns == mtime
+
+    def test_incremental(self, capfd):
+        assert dotbackup.dotbackup(["--incremental"]) == 0
+        helper.create_file(self._files[0], helper.random_str(60))
+
+        plan = self._plan(["--incremental"], capfd)
+        assert [op["src"] for op in self._get_ops(plan, "copy")] == [
+            self._config._normpath(self._files[0])
+        ]
+        assert plan["totals"]["skip-unchanged"]["count"] == 3
+
+        assert dotbackup.dotbackup(["--apply-plan", self._plan_file]) == 0
+        assert helper.validate_backup(self._config)
+        plan = self._plan(["--incremental"], capfd)
+        assert plan["totals"]["skip-unchanged"]["count"] == 4
+
+    def test_mirror(self, capfd):
+        assert dotbackup.dotbackup() == 0
+        stale = str(self._config._get_backup_file_path("~/.config/app_a/stale.txt"))
+        helper.create_file(stale, "stale")
+
+        plan = self._plan(["--mirror"], capfd)
+        assert [op["path"] for op in self._get_ops(plan, "delete")] == [stale]
+        assert plan["totals"]["skip-unchanged"]["count"] == 4
+
+        assert dotbackup.dotbackup(["--apply-plan", self._plan_file]) == 0
+        assert not os.path.exists(stale)
+        assert helper.validate_backup(self._config)
+
+    def test_setup(self, capfd):
+        assert dotbackup.dotbackup() == 0
+        for file in self._files:
+            os.remove(self._config._normpath(file))
+
+        capfd.readouterr()
+        assert dotbackup.dotsetup(["--plan"]) == 0
+        with open(self._plan_file, mode="w", encoding="utf-8") as f:
+            f.write(capfd.readouterr().out)
+        assert dotbackup.dotsetup(["--apply-plan", self._plan_file]) == 0
+        assert helper.validate_setup(self._config)
+
+    def test_invalid_plan(self, capfd, caplog):
+        self._plan([], capfd)
+
+        assert dotbackup.dotsetup(["--apply-plan", self._plan_file]) == 1
+        assert "not a setup plan" in caplog.text
+
+        helper.create_file(self._plan_file, "{")
+        assert dotbackup.dotbackup(["--apply-plan", self._plan_file]) == 1
+        assert f"invalid plan: {self._plan_file}" in caplog.text
+
+    @pytest.mark.parametrize(
+        ("op", "key"),
+        [("copy", "src"), ("copy", "dest"), ("mkdir", "path"), ("run-hook", "hooks")],
+    )
+    def test_invalid_operation(self, op, key, capfd, caplog):
+        plan = self._plan([], capfd)
+        for entry in self._get_ops(plan, op):
+            del entry[key]
+        with open(self._plan_file, mode="w", encoding="utf-8") as f:
+            json.dump(plan, f)
+
+        assert dotbackup.dotbackup(["--apply-plan", self._plan_file]) == 1
+        assert f"invalid plan: {self._plan_file}: {key} of {op} operation" in (
+            caplog.text
+        )
+        assert not os.path.exists(self._backup_files[0])
+
+    def test_unsupported_storage(self, caplog):
+        assert dotbackup.dotbackup(["--plan", "--snapshot"]) == 1
+        assert "plan is not supported with snapshot" in caplog.text
@@ -0,0 +1,181 @@
+"""Test with archive.yml."""
+
+import os
+import tarfile
+
+import helper
+import pytest
+
+import dotbackup
+from dotbackup import ArchiveStorage, Config
+
+SUFFIXES = [".tar", ".tar.gz", ".tgz", ".tar.xz", ".tar.bz2", ".tar.zst"]
+
+
+class TestArchive:
+    _files = [
+        "~/.config/app_a/a.txt",
+        "~/.config/app_a/sub/a.txt",
+        "~/.config/app_b/b1.txt",
+        "~/.config/app_b/b2.txt",
+    ]
+
+    @pytest.fixture(autouse=True)
+    def _prepare(self, monkeypatch):
+        helper.clean_test(monkeypatch)
+        for file in self._files:
+            helper.create_file(file, helper.random_str())
+        helper.create_file("~/.config/app_a/ignored.log", "ignored")
+
+    def _write_config(self, suffix) -> str:
+        with open(helper.get_config_path("archive")) as f:
+            content = f.read().replace(".tar.gz", suffix)
+        helper.create_file(helper.CONFIG_FILE, content)
+        return Config._normpath(f"~/backup{suffix}")
+
+    def _read_files(self) -> list:
+        files = []
+        for file in self._files:
+            with open(Config._normpath(file)) as f:
+                files.append(f.read())
+        return files
+
+    def _remove_files(self) -> None:
+        helper.rmdir("~/.config/app_a")
+        helper.rmdir("~/.config/app_b")
+
+    @pytest.mark.parametrize("suffix", SUFFIXES)
+    def test_backup_and_setup(self, suffix):
+        if suffix == ".tar.zst":
+            pytest.importorskip("zstandard")
+        archive = self._write_config(suffix)
+
+        assert dotbackup.dotbackup() == 0
+        assert os.path.isfile(archive)
+        assert not os.path.exists(f"{archive}.tmp")
+
+        contents = self._read_files()
+        os.chmod(Config._normpath(self._files[2]), 0o600)
+        mode = os.stat(Config._normpath(self._files[2])).st_mode
+        assert dotbackup.dotbackup() == 0
+        self._remove_files()
+
+        assert dotbackup.dotsetup() == 0
+        assert self._read_files() == contents
+        assert os.stat(Config._normpath(self._files[2])).st_mode == mode
+        assert not os.path.exists(Config._normpath("~/.config/app_a/ignored.log"))
+
+    def test_members(self):
+        archive = self._write_config(".tar.xz")
+
+        assert dotbackup.dotbackup() == 0
+        with tarfile.open(archive) as tar:
+            assert sorted(tar.getnames()) == sorted(file[2:] for file in self._files)
+
+    def test_selected_apps(self):
+        self._write_config(".tar.gz")
+
+        assert dotbackup.dotbackup() == 0
+        contents = self._read_files()
+        helper.create_file(self._files[0], "new content")
+        contents[0] = "new content"
+
+        # files of unselected applications are carried over
+        assert dotbackup.dotbackup(["app_a"]) == 0
+        self._remove_files()
+        assert dotbackup.dotsetup() == 0
+        assert self._read_files() == contents
+
+        self._remove_files()
+        assert dotbackup.dotsetup(["app_b"]) == 0
+        assert not os.path.exists(Config._normpath(self._files[0]))
+        assert os.path.isfile(Config._normpath(self._files[2]))
+
+    def test_failed_backup(self, caplog):
+        archive = self._write_config(".tar.gz")
+
+        assert dotbackup.dotbackup() == 0
+        mtime = os.stat(archive).st_mtime_ns
+        os.symlink("not_found", Config._normpath("~/.config/app_a/dangling"))
+
+        assert dotbackup.dotbackup() == 1
+        assert os.stat(archive).st_mtime_ns == mtime
+        assert not os.path.exists(f"{archive}.tmp")
+
+    def test_unknown_archive_type(self, caplog):
+        self._write_config(".zip")
+
+        assert dotbackup.dotbackup() == 1
+        assert "unknown archive type: ~/backup.zip" in caplog.text
+
+    def test_archive_not_found(self, caplog):
+        self._write_config(".tar")
+
+        assert dotbackup.dotsetup() == 1
+        assert "archive not found: ~/backup.tar" in caplog.text
+
+    @pytest.mark.parametrize("suffix", SUFFIXES)
+    def test_indexed_setup(self, suffix, monkeypatch):
+        if suffix == ".tar.zst":
+            pytest.importorskip("zstandard")
+        archive = self._write_config(suffix)
+        # split the archive into many frames
+        monkeypatch.setattr(ArchiveStorage, "_ARCHIVE_FRAME_SIZE", 1024)
+        for i in range(20):
+            helper.create_file(f"~/.config/app_a/{i}.txt", helper.random_str(1000))
+        helper.create_file(self._files[0], helper.random_str(100000))
+
+        assert dotbackup.dotbackup() == 0
+        assert os.path.isfile(f"{archive}.idx.json")
+        contents = self._read_files()
+        self._remove_files()
+
+        def scan(*args):
+            raise AssertionError("archive is scanned")
+
+        monkeypatch.setattr(ArchiveStorage, "_extract_from_archive", scan)
+        assert dotbackup.dotsetup(["--jobs", "4"]) == 0
+        assert self._read_files() == contents
+
+    def test_stale_index(self, caplog):
+        archive = self._write_config(".tar.gz")
+
+        assert dotbackup.dotbackup() == 0
+        contents = self._read_files()
+        os.replace(f"{archive}.idx.json", f"{archive}.idx.json.old")
+        helper.create_file("~/.config/app_a/new.txt", "new content")
+        assert dotbackup.dotbackup() == 0
+        os.replace(f"{archive}.idx.json.old", f"{archive}.idx.json")
+
+        self._remove_files()
+        assert dotbackup.dotsetup() == 0
+        assert "invalid archive index" in caplog.text
+        assert self._read_files() == contents
+
+    def test_checksum_mismatch(self, caplog):
+        archive = self._write_config(".tar")
+        helper.create_file(self._files[2], "content")
+
+        assert dotbackup.dotbackup() == 0
+        with open(archive, "r+b") as f:
+            data = f.read()
+            f.seek(data.index(b"content"))
+            f.write(b"CONTENT")
+
+        assert dotbackup.dotsetup(["app_b"]) == 1
+        assert "checksum mismatch: .config/app_b/b1.txt" in caplog.text
+
+    def test_setup_file(self):
+        self._write_config(".tar.xz")
+
+        assert dotbackup.dotbackup() == 0
+        contents = self._read_files()
+        self._remove_files()
+
+        assert (
+            dotbackup.dotsetup(["--file", self._files[1], "--file", "~/.config/app_b"])
+            == 0
+        )
+        assert not os.path.exists(Config._normpath(self._files[0]))
+        helper.create_file(self._files[0], contents[0])
+        assert self._read_files() == contents
@@ -150,3 +150,18 @@ class TestBasic:
         with pytest.raises(SystemExit):
             dotbackup.main(["setup", option])
         assert capfd.readouterr().out == expected_output
+
+    def test_setup_file(self, caplog):
+        """Test --file option."""
+
+        for file in self._backup_files:
+            helper.create_file(file, helper.random_str())
+
+        assert dotbackup.dotsetup(["--file", self._files[0]]) == 0
+        assert helper.filediff(self._files[0], self._backup_files[0])
+        for file in self._files[1:]:
+            assert not os.path.exists(self._config._normpath(file))
+        assert "doing app_b setup" not in caplog.text
+
+        assert dotbackup.dotsetup(["--file", "~/.config/app_b/b3.txt"]) == 1
+        assert "file not configured: ~/.config/app_b/b3.txt" in caplog.text
@@ -0,0 +1,64 @@
+"""Test the configuration cache with basic.yml."""
+
+import os
+import sys
+
+import helper
+import pytest
+
+import dotbackup
+from dotbackup import Config
+
+
+@pytest.fixture(autouse=True)
+def _clean_test(monkeypatch):
+    helper.clean_test(monkeypatch)
+    monkeypatch.delenv("XDG_CACHE_HOME", raising=False)
+    helper.cp(helper.get_config_path("basic"), helper.CONFIG_FILE)
+
+
+def _get_cache_path(file=helper.CONFIG_FILE):
+    return Config._get_config_cache_path(os.path.abspath(file))
+
+
+def test_cache_hit(monkeypatch):
+    config = Config.fromfile(helper.CONFIG_FILE)
+    assert _get_cache_path().is_file()
+
+    # the YAML parser isn't imported on cache hits
+    monkeypatch.setitem(sys.modules, "ruamel.yaml", None)
+    assert Config.fromfile(helper.CONFIG_FILE) == config
+
+
+def test_list(monkeypatch, capfd):
+    with pytest.raises(SystemExit):
+        dotbackup.dotbackup(["--list"])
+    capfd.readouterr()
+    monkeypatch.setitem(sys.modules, "ruamel.yaml", None)
+
+    with pytest.raises(SystemExit):
+        dotbackup.dotbackup(["--list"])
+    assert capfd.readouterr().out == "app_a\napp_b\n"
+
+
+def test_changed_config():
+    Config.fromfile(helper.CONFIG_FILE)
+
+    with open(helper.CONFIG_FILE, mode="a", encoding="utf-8") as f:
+        f.write("jobs: 2\n")
+    assert Config.fromfile(helper.CONFIG_FILE)._jobs == 2
+
+
+def test_corrupt_cache():
+    config = Config.fromfile(helper.CONFIG_FILE)
+
+    helper.create_file(str(_get_cache_path()), "corrupt")
+    assert Config.fromfile(helper.CONFIG_FILE) == config
+
+
+def test_xdg_cache_home(monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", f"{helper.TEST_HOME}/cache")
+    Config.fromfile(helper.CONFIG_FILE)
+
+    assert _get_cache_path().is_file()
+    assert str(_get_cache_path()).startswith(f"{helper.TEST_HOME}/cache/")
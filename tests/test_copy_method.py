@@ -0,0 +1,82 @@
+"""Test copy methods with basic.yml."""
+
+import fcntl
+import os
+
+import helper
+import pytest
+
+import dotbackup
+from dotbackup import Config
+
+
+def reflink_supported() -> bool:
+    """Return True if the test directory supports reflinks, False otherwise."""
+
+    helper.create_file("~/reflink_src", "reflink")
+    with open(Config._normpath("~/reflink_src"), "rb") as fsrc, open(
+        Config._normpath("~/reflink_dest"), "wb"
+    ) as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), Config._FICLONE, fsrc.fileno())
+        except OSError:
+            return False
+
+    return True
+
+
+class TestCopyMethod:
+    _config = helper.get_config("basic")
+    _files = [
+        "~/.config/app_a/a.txt",
+        "~/.config/app_b/b1.txt",
+        "~/.config/app_b/b2.txt",
+    ]
+
+    @pytest.fixture(autouse=True)
+    def _prepare(self, monkeypatch):
+        helper.clean_test(monkeypatch)
+        helper.cp(helper.get_config_path("basic"), helper.CONFIG_FILE)
+        for file in self._files:
+            helper.create_file(file, helper.random_str())
+
+    @pytest.mark.parametrize("method", ["auto", "kernel", "buffered"])
+    def test_backup(self, method, caplog):
+        assert dotbackup.dotbackup(["--copy-method", method]) == 0
+        assert helper.validate_backup(self._config)
+        assert "copied 3 files: " in caplog.text
+        if method != "auto":
+            assert f"copied 3 files: {method} 3" in caplog.text
+
+    def test_reflink(self):
+        expected = 0 if reflink_supported() else 1
+        assert dotbackup.dotbackup(["--copy-method", "reflink"]) == expected
+        if expected == 0:
+            assert helper.validate_backup(self._config)
+
+    def test_sendfile(self, monkeypatch):
+        def copy_file_range(*args):
+            raise OSError("not supported")
+
+        monkeypatch.setattr(os, "copy_file_range", copy_file_range, raising=False)
+        assert dotbackup.dotbackup(["--copy-method", "kernel"]) == 0
+        assert helper.validate_backup(self._config)
+
+    def test_fallback(self, monkeypatch, caplog):
+        def not_supported(*args):
+            raise OSError("not supported")
+
+        monkeypatch.setattr(fcntl, "ioctl", not_supported)
+        monkeypatch.delattr(os, "copy_file_range", raising=False)
+        monkeypatch.setattr(os, "sendfile", not_supported)
+        assert dotbackup.dotbackup() == 0
+        assert helper.validate_backup(self._config)
+        assert "copied 3 files: buffered 3" in caplog.text
+
+    def test_invalid_method(self):
+        config = helper.get_config("basic")
+        config._dict["copy_method"] = "invalid"
+        config._dict["selected_apps"] = []
+
+        with pytest.raises(RuntimeError, match="invalid copy_method: invalid"):
+            config.backup()
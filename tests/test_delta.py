@@ -0,0 +1,90 @@
+"""Test delta copy of large files with basic.yml."""
+
+import json
+import os
+
+import helper
+import pytest
+
+import dotbackup
+from dotbackup import Config
+
+
+@pytest.fixture(autouse=True)
+def _clean_test(monkeypatch):
+    helper.clean_test(monkeypatch)
+
+
+class TestDelta:
+    _config = helper.get_config("basic")
+    _large_file = "~/.config/app_b/b1.txt"
+    _backup_file = str(_config._get_backup_file_path(_large_file))
+    _metrics_file = f"{helper.TEST_HOME}/metrics.json"
+    _size = 4 * Config._DELTA_READ_SIZE + 123
+
+    @pytest.fixture(autouse=True)
+    def _prepare(self):
+        helper.cp(helper.get_config_path("basic"), helper.CONFIG_FILE)
+        helper.create_file("~/.config/app_a/a.txt", helper.random_str())
+        helper.create_file("~/.config/app_b/b2.txt", helper.random_str())
+        with open(Config._normpath(self._large_file), "wb") as f:
+            f.write(os.urandom(self._size))
+
+    def _patch(self, offset, data) -> None:
+        with open(Config._normpath(self._large_file), "r+b") as f:
+            f.seek(offset)
+            f.write(data)
+
+    def _backup(self, *args) -> dict:
+        args = [
+            "--delta-threshold",
+            "1024",
+            "--metrics-file",
+            self._metrics_file,
+            *args,
+        ]
+        assert dotbackup.dotbackup(args) == 0
+        with open(self._metrics_file, encoding="utf-8") as f:
+            return json.load(f)
+
+    def test_delta(self, caplog):
+        self._backup()
+        inode = os.stat(self._backup_file).st_ino
+
+        self._patch(Config._DELTA_READ_SIZE + 10, b"changed")
+        self._patch(3 * Config._DELTA_READ_SIZE - 2, b"across")
+        metrics = self._backup()
+
+        assert helper.validate_backup(self._config)
+        assert os.stat(self._backup_file).st_ino == inode
+        assert metrics["copy_methods"]["delta"] == 1
+        assert metrics["copy_methods"]["delta_written"] == 3 * Config._DELTA_BLOCK_SIZE
+        assert "updated 1 files in place" in caplog.text
+
+    @pytest.mark.parametrize("size", [1024, 2 * Config._DELTA_READ_SIZE, 10**7])
+    def test_resize(self, size):
+        self._backup()
+
+        with open(Config._normpath(self._large_file), "r+b") as f:
+            f.truncate(size)
+        self._backup()
+        assert helper.validate_backup(self._config)
+
+    def test_small_file(self):
+        helper.create_file(self._large_file, "small")
+        self._backup()
+
+        helper.create_file(self._large_file, "changed")
+        metrics = self._backup()
+        assert helper.validate_backup(self._config)
+        assert "delta" not in metrics["copy_methods"]
+
+    def test_new_file(self):
+        metrics = self._backup()
+        assert helper.validate_backup(self._config)
+        assert "delta" not in metrics["copy_methods"]
+
+    @pytest.mark.parametrize("threshold", ["0", "-1"])
+    def test_invalid_threshold(self, threshold, caplog):
+        assert dotbackup.dotbackup(["--delta-threshold", threshold]) == 1
+        assert f"invalid delta_threshold: {threshold}" in caplog.text
@@ -0,0 +1,62 @@
+"""Test with depends.yml."""
+
+import helper
+import pytest
+
+import dotbackup
+from dotbackup import Config
+
+
+@pytest.fixture(autouse=True)
+def _clean_test(monkeypatch):
+    helper.clean_test(monkeypatch)
+    helper.cp(helper.get_config_path("depends"), helper.CONFIG_FILE)
+
+
+def test_sequential(capfd):
+    assert dotbackup.dotbackup() == 0
+    assert capfd.readouterr().out == (
+        "pre_backup\nslow\nafter_slow\nfast\npost_backup\n"
+    )
+
+
+def test_concurrent(capfd):
+    assert dotbackup.dotbackup(["--app-jobs", "3"]) == 0
+    assert capfd.readouterr().out == (
+        "pre_backup\nfast\nslow\nafter_slow\npost_backup\n"
+    )
+
+
+def test_selected_apps(capfd):
+    # dependencies which are not selected are not run
+    assert dotbackup.dotbackup(["--app-jobs", "3", "after_slow", "fast"]) == 0
+    assert "slow" not in capfd.readouterr().out.splitlines()
+
+
+def test_failure(capfd, caplog):
+    config = helper.get_config("depends")
+    config._dict["apps"]["slow"]["pre_backup"].append("false")
+    config._dict["app_jobs"] = 3
+    config._dict["selected_apps"] = []
+
+    with pytest.raises(RuntimeError, match="command failed: false"):
+        config.backup()
+    assert "after_slow" not in capfd.readouterr().out
+
+
+@pytest.mark.parametrize(
+    ("apps", "message"),
+    [
+        ({"a": {"depends_on": ["b"]}}, "unknown dependency of a: b"),
+        ({"a": {"depends_on": ["a"]}}, "dependency cycle: a -> a"),
+        (
+            {"a": {"depends_on": ["b"]}, "b": {"depends_on": ["a"]}},
+            "dependency cycle: a -> b -> a",
+        ),
+    ],
+)
+def test_invalid_depends(apps, message):
+    config = Config({"backup_dir": "~/backup", "apps": apps, "selected_apps": []})
+
+    with pytest.raises(RuntimeError, match=message):
+        config._sort_apps()
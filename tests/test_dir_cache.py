@@ -0,0 +1,117 @@
+"""Test the directory cache of incremental backup with basic.yml."""
+
+import json
+import os
+
+import helper
+import pytest
+
+import dotbackup
+
+
+@pytest.fixture(autouse=True)
+def _clean_test(monkeypatch):
+    helper.clean_test(monkeypatch)
+
+
+class TestDirCache:
+    _config = helper.get_config("basic")
+    _files = [f"~/.config/app_a/{i // 10}/{i}.txt" for i in range(30)] + [
+        "~/.config/app_b/b1.txt",
+        "~/.config/app_b/b2.txt",
+    ]
+    _backup_files = list(
+        map(lambda file, func=_config._get_backup_file_path: str(func(file)), _files)
+    )
+    _args = ["--incremental", "--dir-cache"]
+
+    @pytest.fixture(autouse=True)
+    def _prepare(self):
+        helper.cp(helper.get_config_path("basic"), helper.CONFIG_FILE)
+        for file in self._files:
+            helper.create_file(file, helper.random_str())
+        self._age_dirs()
+
+    def _age_dirs(self):
+        # recently modified directories are not cached
+        for root, _, _ in os.walk(self._config._normpath("~/.config/app_a")):
+            os.utime(root, ns=(10**18, 10**18))
+
+    def _add_config(self, content):
+        with open(helper.CONFIG_FILE, mode="a", encoding="utf-8") as f:
+            f.write(content)
+
+    def test_backup(self):
+        assert dotbackup.dotbackup(self._args) == 0
+        assert helper.validate_backup(self._config)
+
+        with open(self._config._get_manifest_path(), encoding="utf-8") as f:
+            manifest = json.load(f)
+        assert len(manifest["dirs"]) == 4
+        assert len(manifest["files"]) == len(self._files)
+
+    def test_skip_unchanged(self, caplog):
+        assert dotbackup.dotbackup(self._args) == 0
+
+        # files in unchanged directories are not even checked
+        helper.create_file(self._backup_files[0], "dirty")
+        os.remove(self._backup_files[1])
+        assert dotbackup.dotbackup(self._args) == 0
+        assert "listed 0 directories, skipped 4 unchanged directories" in caplog.text
+        assert not helper.validate_backup(self._config)
+
+        # entries of skipped files are kept in the manifest
+        caplog.clear()
+        assert dotbackup.dotbackup(["--incremental", "--log-level", "DEBUG"]) == 0
+        assert caplog.text.count("skipping unchanged") == len(self._files) - 1
+        assert os.path.isfile(self._backup_files[1])
+
+    def test_changed_dir(self):
+        assert dotbackup.dotbackup(self._args) == 0
+
+        helper.create_file("~/.config/app_a/1/new.txt", helper.random_str())
+        os.remove(self._config._normpath(self._files[0]))
+        assert dotbackup.dotbackup(self._args) == 0
+        assert helper.validate_backup(self._config, recursive=False)
+        assert os.path.isfile(
+            self._config._get_backup_file_path("~/.config/app_a/1/new.txt")
+        )
+
+    def test_verify(self, caplog):
+        assert dotbackup.dotbackup(self._args) == 0
+
+        # in-place edits are found by full walks
+        helper.create_file(self._files[0], "edited")
+        self._age_dirs()
+        assert dotbackup.dotbackup(self._args) == 0
+        assert not helper.validate_backup(self._config)
+
+        self._add_config("verify_interval: 0.001\n")
+        assert dotbackup.dotbackup(self._args) == 0
+        assert "skipped 0 unchanged directories" in caplog.text
+        assert helper.validate_backup(self._config)
+
+    def test_ignore_changed(self):
+        assert dotbackup.dotbackup(self._args) == 0
+
+        with open(helper.CONFIG_FILE, encoding="utf-8") as f:
+            content = f.read()
+        content = content.replace(
+            "      - ~/.config/app_a\n",
+            "      - ~/.config/app_a\n    ignore:\n      - 1?.txt\n",
+        )
+        helper.create_file(helper.CONFIG_FILE, content)
+        assert dotbackup.dotbackup(self._args) == 0
+
+        with open(self._config._get_manifest_path(), encoding="utf-8") as f:
+            manifest = json.load(f)
+        assert (
+            self._config._normpath("~/.config/app_a/1/10.txt") not in manifest["files"]
+        )
+
+    @pytest.mark.parametrize("interval", ["0", "-1", "'1'"])
+    def test_invalid_verify_interval(self, interval, caplog):
+        self._add_config(f"verify_interval: {interval}\n")
+
+        assert dotbackup.dotbackup(self._args) == 1
+        assert "invalid verify_interval" in caplog.text
@@ -0,0 +1,259 @@
+"""Test hook modes with hooks.yml."""
+
+import os
+import signal
+import threading
+import time
+
+import helper
+import pytest
+
+import dotbackup
+from dotbackup import Config
+
+_HOOK_MODES = ["command", "batch", "shell"]
+
+
+@pytest.fixture(autouse=True)
+def _clean_test(monkeypatch):
+    helper.clean_test(monkeypatch)
+    helper.cp(helper.get_config_path("hooks"), helper.CONFIG_FILE)
+
+
+@pytest.mark.parametrize("hook_mode", _HOOK_MODES)
+def test_hook_mode(hook_mode, capfd):
+    assert dotbackup.dotbackup(["--hook-mode", hook_mode]) == 0
+    assert capfd.readouterr().out == (
+        "pre_backup\napp_a 1\nhello app_a\n~/backup\n"
+        "app_b eof\napp_b 2\npost_backup\n"
+    )
+
+
+@pytest.mark.parametrize("hook_mode", _HOOK_MODES)
+def test_app_jobs(hook_mode, capfd):
+    assert dotbackup.dotbackup(["--hook-mode", hook_mode, "--app-jobs", "2"]) == 0
+    lines = capfd.readouterr().out.splitlines()
+    assert sorted(lines) == sorted(
+        ["pre_backup", "app_a 1", "hello app_a", "~/backup"]
+        + ["app_b eof", "app_b 2", "post_backup"]
+    )
+    assert lines[0] == "pre_backup"
+    assert lines[-1] == "post_backup"
+
+
+@pytest.mark.parametrize("hook_mode", _HOOK_MODES)
+def test_failure(hook_mode, capfd, caplog):
+    config = helper.get_config("hooks")
+    config._dict["apps"]["app_a"]["pre_backup"][1:1] = ["exit 3", "echo unreachable"]
+    config._dict["hook_mode"] = hook_mode
+    config._dict["selected_apps"] = []
+
+    with pytest.raises(RuntimeError, match="command failed: exit 3"):
+        config.backup()
+    out = capfd.readouterr().out
+    assert "app_a 1" in out
+    assert "unreachable" not in out
+
+
+@pytest.mark.parametrize("hook_mode", _HOOK_MODES)
+def test_syntax_error(hook_mode):
+    config = helper.get_config("hooks")
+    config._dict["pre_backup"] = ["echo '", "echo next"]
+    config._dict["hook_mode"] = hook_mode
+    config._dict["selected_apps"] = []
+
+    with pytest.raises(RuntimeError, match="command failed: echo '"):
+        config.backup()
+
+
+@pytest.mark.parametrize(("hook_mode", "shells"), [("batch", 2), ("shell", 1)])
+def test_shells(hook_mode, shells, capfd):
+    config = helper.get_config("hooks")
+    # $$ is the PID of the shell session even in subshells
+    config._dict["pre_backup"] = ["echo $$", "echo $$"]
+    config._dict["post_backup"] = ["echo $$"]
+    config._dict["apps"] = {}
+    config._dict["hook_mode"] = hook_mode
+    config._dict["selected_apps"] = []
+
+    config.backup()
+    assert len(set(capfd.readouterr().out.splitlines())) == shells
+
+
+def test_invalid_hook_mode(caplog):
+    config = helper.get_config("hooks")
+    config._dict["hook_mode"] = "invalid"
+    config._dict["selected_apps"] = []
+
+    with pytest.raises(RuntimeError, match="invalid hook_mode: invalid"):
+        config.backup()
+
+
+class TestMemoizedHooks:
+    @pytest.fixture(autouse=True)
+    def _prepare(self):
+        helper.cp(helper.get_config_path("hooks_memo"), helper.CONFIG_FILE)
+        helper.create_file("~/input/a.txt", helper.random_str())
+        helper.create_file("~/input/sub/b.txt", helper.random_str())
+        helper.create_file("~/input.txt", helper.random_str())
+
+    @pytest.mark.parametrize("hook_mode", _HOOK_MODES)
+    def test_skip_unchanged(self, hook_mode, capfd, caplog):
+        assert dotbackup.dotbackup(["--hook-mode", hook_mode]) == 0
+        assert capfd.readouterr().out == "files\ncommand\nalways\n"
+
+        assert dotbackup.dotbackup(["--hook-mode", hook_mode]) == 0
+        assert capfd.readouterr().out == "always\n"
+        assert caplog.text.count("inputs unchanged") == 2
+
+    def test_changed_inputs(self, capfd):
+        assert dotbackup.dotbackup() == 0
+        capfd.readouterr()
+
+        helper.create_file("~/input/sub/b.txt", helper.random_str(60))
+        assert dotbackup.dotbackup() == 0
+        assert capfd.readouterr().out == "files\nalways\n"
+
+        helper.create_file("~/input.txt", helper.random_str(60))
+        assert dotbackup.dotbackup() == 0
+        assert capfd.readouterr().out == "command\nalways\n"
+
+    def test_missing_outputs(self, capfd):
+        assert dotbackup.dotbackup() == 0
+        capfd.readouterr()
+
+        helper.rmdir("~/backup/output")
+        assert dotbackup.dotbackup() == 0
+        assert capfd.readouterr().out == "files\nalways\n"
+
+    def test_failure(self, capfd):
+        config = helper.get_config("hooks_memo")
+        config._dict["apps"]["app"]["pre_backup"].append("false")
+        config._dict["selected_apps"] = []
+
+        with pytest.raises(RuntimeError, match="command failed: false"):
+            config.backup()
+        capfd.readouterr()
+
+        # hooks succeeded before the failure are remembered
+        assert dotbackup.dotbackup() == 0
+        assert capfd.readouterr().out == "always\n"
+
+    def test_invalid_hook(self):
+        config = helper.get_config("hooks_memo")
+        config._dict["apps"]["app"]["pre_backup"].append({"inputs": []})
+        config._dict["selected_apps"] = []
+
+        with pytest.raises(RuntimeError, match="invalid hook of app pre_backup"):
+            config.backup()
+
+    @pytest.mark.parametrize(
+        "hook",
+        [
+            {"run": "true", "inputs": "/etc/hostname"},
+            {"run": "true", "inputs": ["~/input.txt"], "outputs": "~/output"},
+            {"run": "true", "input_command": ["date"]},
+        ],
+    )
+    def test_invalid_keys(self, hook):
+        config = helper.get_config("hooks_memo")
+        config._dict["apps"]["app"]["pre_backup"].append(hook)
+        config._dict["selected_apps"] = []
+
+        with pytest.raises(
+            RuntimeError, match="invalid (inputs|outputs|input_command)"
+        ):
+            config.backup()
+
+
+class TestHookTimeout:
+    @pytest.mark.parametrize("hook_mode", [*_HOOK_MODES, "async"])
+    def test_timeout(self, hook_mode):
+        config = helper.get_config("hooks")
+        config._dict["pre_backup"] = ["echo fast", "sleep 10"]
+        config._dict["hook_mode"] = hook_mode
+        config._dict["hook_timeout"] = 0.5
+        config._dict["selected_apps"] = []
+
+        start = time.monotonic()
+        with pytest.raises(RuntimeError, match="command timed out after 0.5s: sleep"):
+            config.backup()
+        assert time.monotonic() - start < 5
+
+    @pytest.mark.parametrize("hook_mode", [*_HOOK_MODES, "async"])
+    def test_hook_timeout(self, hook_mode):
+        config = helper.get_config("hooks")
+        config._dict["pre_backup"] = [{"run": "sleep 10", "timeout": 0.5}, "sleep 1"]
+        config._dict["apps"] = {}
+        config._dict["hook_mode"] = hook_mode
+        config._dict["hook_timeout"] = 10
+        config._dict["selected_apps"] = []
+
+        with pytest.raises(RuntimeError, match="timed out after 0.5s: sleep 10"):
+            config.backup()
+
+    @staticmethod
+    def _is_running(pid) -> bool:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                # zombies wait for their reaper only
+                return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+        except FileNotFoundError:
+            return False
+
+    @pytest.mark.parametrize("hook_mode", [*_HOOK_MODES, "async"])
+    def test_interrupt(self, hook_mode):
+        pid_file = Config._normpath("~/sleep.pid")
+        config = helper.get_config("hooks")
+        config._dict["pre_backup"] = [f"sleep 30 & echo $! >{pid_file}; wait"]
+        config._dict["apps"] = {}
+        config._dict["hook_mode"] = hook_mode
+        config._dict["hook_timeout"] = 60
+        config._dict["selected_apps"] = []
+        os.makedirs(os.path.dirname(pid_file), exist_ok=True)
+
+        timer = threading.Timer(1, os.kill, (os.getpid(), signal.SIGINT))
+        timer.start()
+        try:
+            with pytest.raises(KeyboardInterrupt):
+                config.backup()
+        finally:
+            timer.cancel()
+
+        with open(pid_file) as f:
+            pid = int(f.read())
+        for _ in range(50):
+            if not self._is_running(pid):
+                break
+            time.sleep(0.1)
+        assert not self._is_running(pid)
+
+    @pytest.mark.parametrize("timeout", [0, -1, "1", True])
+    def test_invalid_timeout(self, timeout):
+        config = helper.get_config("hooks")
+        config._dict["hook_timeout"] = timeout
+        config._dict["selected_apps"] = []
+
+        with pytest.raises(RuntimeError, match="invalid hook_timeout"):
+            config.backup()
+
+
+def test_async(capfd):
+    config = helper.get_config("hooks")
+    config._dict["pre_backup"] = ["sleep 0.5; echo slow", "echo fast; echo err >&2"]
+    config._dict["apps"] = {}
+    config._dict["hook_mode"] = "async"
+    config._dict["selected_apps"] = []
+
+    config.backup()
+    captured = capfd.readouterr()
+    assert captured.out == (
+        "[pre_backup 2] fast\n[pre_backup 1] slow\n[post_backup 1] post_backup\n"
+    )
+    assert "[pre_backup 2] err\n" in captured.err
+    assert [hook_title for hook_title, _, _ in config._hook_durations] == [
+        "pre_backup",
+        "pre_backup",
+        "post_backup",
+    ]
+    assert config._hook_durations[0][2] >= 0.5
@@ -50,3 +50,84 @@ class TestIgnore:
         assert helper.validate_setup(self._config, False)
         for file in self._ignore_files:
             assert not os.path.isfile(self._config._normpath(file))
+
+
+class TestIgnoreGlob:
+    @pytest.fixture(autouse=True)
+    def _prepare(self, monkeypatch):
+        helper.clean_test(monkeypatch)
+        helper.cp(helper.get_config_path("ignore_glob"), helper.CONFIG_FILE)
+
+    _config = helper.get_config("ignore_glob")
+    _files = [
+        "~/.config/app/a.txt",
+        "~/.config/app/sub/cache/a.txt",
+        "~/.config/app/build/a.c",
+        "~/.config/app/tmp",
+    ]
+    _ignore_files = [
+        "~/.config/app/a.log",
+        "~/.config/app/sub/a.log",
+        "~/.config/app/cache/a.txt",
+        "~/.config/app/cache/sub/a.txt",
+        "~/.config/app/build/a.o",
+        "~/.config/app/sub/build/a.o",
+        "~/.config/app/sub/tmp/a.txt",
+    ]
+
+    def test_backup(self, caplog):
+        for file in chain(self._files, self._ignore_files):
+            helper.create_file(file, helper.random_str())
+
+        assert dotbackup.dotbackup(["--log-level", "DEBUG"]) == 0
+        for file in self._files:
+            assert os.path.isfile(self._config._get_backup_file_path(file))
+        for file in self._ignore_files:
+            assert not os.path.exists(self._config._get_backup_file_path(file))
+        assert "app: ignored 2 entries matching *.log" in caplog.text
+        assert "app: ignored 1 entries matching tmp/" in caplog.text
+
+    def test_setup_file(self):
+        for file in chain(self._files, self._ignore_files):
+            helper.create_file(self._config._get_backup_file_path(file), "backup")
+
+        assert dotbackup.dotsetup(["--file", "~/.config/app/sub"]) == 0
+        # anchored patterns are relative to the configured file, not the selected one
+        assert os.path.isfile(self._config._normpath("~/.config/app/sub/cache/a.txt"))
+        for file in ("sub/a.log", "sub/build/a.o", "sub/tmp/a.txt"):
+            assert not os.path.exists(self._config._normpath(f"~/.config/app/{file}"))
+
+    def test_setup_file_anchored(self):
+        helper.create_file(self._config._get_backup_file_path(self._files[1]), "b")
+        with open(helper.CONFIG_FILE, encoding="utf-8") as f:
+            content = f.read()
+        helper.create_file(
+            helper.CONFIG_FILE, content.replace("- /cache/**", "- sub/cache")
+        )
+
+        assert dotbackup.dotsetup(["--file", "~/.config/app/sub"]) == 0
+        assert not os.path.exists(self._config._normpath(self._files[1]))
+
+    @pytest.mark.parametrize(
+        ("pattern", "rel_path", "expected"),
+        [
+            ("*.log", "a.log", True),
+            ("*.log", "sub/a.log", True),
+            ("*.log", "a.txt", False),
+            ("a?[0-9]", "ab1", True),
+            ("a[!0-9]", "a1", False),
+            ("/a/b", "a/b", True),
+            ("/a/b", "c/a/b", False),
+            ("a/*", "a/b", True),
+            ("a/*", "a/b/c", False),
+            ("a/**", "a/b/c", True),
+            ("**/b", "a/c/b", True),
+            ("a/**/b", "a/b", True),
+            ("a/**/b", "a/c/d/b", True),
+            ("a/**/b", "c/a/b", False),
+        ],
+    )
+    def test_matcher(self, pattern, rel_path, expected):
+        matcher = dotbackup.IgnoreMatcher([pattern]).bind("/root")
+        path, _, name = f"/root/{rel_path}".rpartition("/")
+        assert (name in matcher(path, [name])) == expected
@@ -0,0 +1,76 @@
+"""Test incremental backup with basic.yml."""
+
+import os
+
+import helper
+import pytest
+
+import dotbackup
+
+
+@pytest.fixture(autouse=True)
+def _clean_test(monkeypatch):
+    helper.clean_test(monkeypatch)
+
+
+class TestIncremental:
+    _config = helper.get_config("basic")
+    _files = [
+        "~/.config/app_a/a.txt",
+        "~/.config/app_a/sub/a.txt",
+        "~/.config/app_b/b1.txt",
+        "~/.config/app_b/b2.txt",
+    ]
+    _backup_files = list(
+        map(lambda file, func=_config._get_backup_file_path: str(func(file)), _files)
+    )
+
+    @pytest.fixture(autouse=True)
+    def _prepare(self):
+        helper.cp(helper.get_config_path("basic"), helper.CONFIG_FILE)
+        for file in self._files:
+            helper.create_file(file, helper.random_str())
+
+    def test_backup(self):
+        assert dotbackup.dotbackup(["--incremental"]) == 0
+        assert helper.validate_backup(self._config)
+        assert os.path.isfile(self._config._get_manifest_path())
+
+    def test_skip_unchanged(self, caplog):
+        assert dotbackup.dotbackup(["--incremental"]) == 0
+
+        # unchanged source files are not copied again
+        helper.create_file(self._backup_files[0], "dirty")
+        assert dotbackup.dotbackup(["--incremental", "--log-level", "DEBUG"]) == 0
+        assert not helper.validate_backup(self._config)
+        assert "skipping unchanged" in caplog.text
+
+        # changed source files are copied
+        helper.create_file(self._files[0], helper.random_str(60))
+        assert dotbackup.dotbackup(["--incremental"]) == 0
+        assert helper.validate_backup(self._config)
+
+    def test_missing_backup_file(self):
+        assert dotbackup.dotbackup(["--incremental"]) == 0
+
+        os.remove(self._backup_files[2])
+        assert dotbackup.dotbackup(["--incremental"]) == 0
+        assert helper.validate_backup(self._config)
+
+    def test_corrupt_manifest(self, caplog):
+        assert dotbackup.dotbackup(["--incremental"]) == 0
+
+        helper.create_file(self._backup_files[0], "dirty")
+        helper.create_file(str(self._config._get_manifest_path()), "{")
+        assert dotbackup.dotbackup(["--incremental"]) == 0
+        assert "corrupt manifest" in caplog.text
+        assert helper.validate_backup(self._config)
+
+    def test_selected_apps(self):
+        assert dotbackup.dotbackup(["--incremental"]) == 0
+        assert dotbackup.dotbackup(["--incremental", "app_a"]) == 0
+
+        # entries of app_b are kept in the manifest
+        helper.create_file(self._backup_files[2], "dirty")
+        assert dotbackup.dotbackup(["--incremental"]) == 0
+        assert not helper.validate_backup(self._config)
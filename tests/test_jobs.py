@@ -0,0 +1,56 @@
+"""Test parallel file copies with basic.yml."""
+
+import os
+
+import helper
+import pytest
+
+import dotbackup
+
+
+@pytest.fixture(autouse=True)
+def _clean_test(monkeypatch):
+    helper.clean_test(monkeypatch)
+
+
+class TestJobs:
+    _config = helper.get_config("basic")
+    _files = [f"~/.config/app_a/{i // 10}/{i}.txt" for i in range(100)] + [
+        "~/.config/app_b/b1.txt",
+        "~/.config/app_b/b2.txt",
+    ]
+    _backup_files = list(
+        map(lambda file, func=_config._get_backup_file_path: str(func(file)), _files)
+    )
+
+    @pytest.fixture(autouse=True)
+    def _prepare(self):
+        helper.cp(helper.get_config_path("basic"), helper.CONFIG_FILE)
+
+    @pytest.mark.parametrize("jobs", ["1", "2", "16"])
+    def test_backup(self, jobs):
+        for file in self._files:
+            helper.create_file(file, helper.random_str())
+
+        assert dotbackup.dotbackup(["--jobs", jobs]) == 0
+        assert helper.validate_backup(self._config)
+
+    @pytest.mark.parametrize("jobs", ["1", "2", "16"])
+    def test_setup(self, jobs):
+        for file in self._backup_files:
+            helper.create_file(file, helper.random_str())
+
+        assert dotbackup.dotsetup(["-j", jobs]) == 0
+        assert helper.validate_setup(self._config)
+
+    @pytest.mark.parametrize("jobs", ["0", "-1"])
+    def test_invalid_jobs(self, jobs, caplog):
+        assert dotbackup.dotbackup(["--jobs", jobs]) == 1
+        assert f"invalid jobs: {jobs}" in caplog.text
+
+    def test_copy_error(self, caplog):
+        helper.mkdir("~/.config/app_a")
+        os.symlink("not_found", self._config._normpath("~/.config/app_a/dangling"))
+
+        assert dotbackup.dotbackup(["--jobs", "4"]) == 1
+        assert "failed to copy" in caplog.text
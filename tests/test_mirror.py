@@ -0,0 +1,80 @@
+"""Test mirror backup and setup with ignore.yml."""
+
+import os
+
+import helper
+import pytest
+
+import dotbackup
+
+
+class TestMirror:
+    _config = helper.get_config("ignore")
+    _files = ["~/.config/app/a.txt", "~/.config/app/sub/b.txt"]
+
+    @pytest.fixture(autouse=True)
+    def _prepare(self, monkeypatch):
+        helper.clean_test(monkeypatch)
+        helper.cp(helper.get_config_path("ignore"), helper.CONFIG_FILE)
+
+    def _path(self, file) -> str:
+        return self._config._normpath(file)
+
+    def test_backup(self, caplog):
+        for file in self._files:
+            helper.create_file(file, helper.random_str())
+        assert dotbackup.dotbackup(["--mirror"]) == 0
+
+        # stale backup files
+        helper.create_file("~/backup/.config/app/stale.txt")
+        helper.create_file("~/backup/.config/app/stale/c.txt")
+        # ignored backup files are left alone
+        helper.create_file("~/backup/.config/app/global_ignore")
+        helper.create_file("~/backup/.config/app/sub/app_ignore")
+        # type changes
+        os.remove(self._path(self._files[0]))
+        helper.create_file(f"{self._files[0]}/c.txt", helper.random_str())
+        os.remove(self._path("~/backup/.config/app/sub/b.txt"))
+        helper.create_file("~/backup/.config/app/sub/b.txt/d.txt")
+
+        assert dotbackup.dotbackup(["--mirror", "--log-level", "DEBUG"]) == 0
+        assert helper.filediff(
+            f"{self._files[0]}/c.txt", "~/backup/.config/app/a.txt/c.txt"
+        )
+        assert helper.filediff(self._files[1], "~/backup/.config/app/sub/b.txt")
+        assert "deleting stale" in caplog.text
+        assert not os.path.exists(self._path("~/backup/.config/app/stale.txt"))
+        assert not os.path.exists(self._path("~/backup/.config/app/stale"))
+        assert os.path.isfile(self._path("~/backup/.config/app/global_ignore"))
+        assert os.path.isfile(self._path("~/backup/.config/app/sub/app_ignore"))
+
+    def test_skip_unchanged(self, caplog):
+        for file in self._files:
+            helper.create_file(file, helper.random_str())
+        assert dotbackup.dotbackup(["--mirror"]) == 0
+
+        assert dotbackup.dotbackup(["--mirror", "--log-level", "DEBUG"]) == 0
+        assert "copying" not in caplog.text.split("skipping unchanged", 1)[1]
+        assert helper.validate_backup(self._config, False)
+
+        helper.create_file(self._files[1], helper.random_str(60))
+        assert dotbackup.dotbackup(["--mirror"]) == 0
+        assert helper.dirdiff("~/.config/app/sub", "~/backup/.config/app/sub")
+
+    def test_setup(self):
+        for file in self._files:
+            helper.create_file(f"~/backup/{file[2:]}", helper.random_str())
+        helper.create_file("~/.config/app/stale.txt")
+        helper.create_file("~/.config/app/global_ignore")
+
+        assert dotbackup.dotsetup(["--mirror"]) == 0
+        assert not os.path.exists(self._path("~/.config/app/stale.txt"))
+        assert os.path.isfile(self._path("~/.config/app/global_ignore"))
+        for file in self._files:
+            assert helper.filediff(file, f"~/backup/{file[2:]}")
+
+    def test_source_not_found(self):
+        helper.create_file("~/backup/.config/app/a.txt")
+
+        assert dotbackup.dotbackup(["--mirror"]) == 0
+        assert os.path.isfile(self._path("~/backup/.config/app/a.txt"))
@@ -0,0 +1,110 @@
+"""Test with objects.yml."""
+
+import os
+
+import helper
+import pytest
+
+import dotbackup
+from dotbackup import Config
+
+
+class TestObjects:
+    _config = helper.get_config("objects")
+    _files = [
+        "~/.config/app_a/a.txt",
+        "~/.config/app_a/sub/a.txt",
+        "~/.config/app_b/b1.txt",
+        "~/.config/app_b/b2.txt",
+    ]
+
+    @pytest.fixture(autouse=True)
+    def _prepare(self, monkeypatch):
+        helper.clean_test(monkeypatch)
+        helper.cp(helper.get_config_path("objects"), helper.CONFIG_FILE)
+        # files with identical contents
+        for file in self._files:
+            helper.create_file(file, "same content")
+        helper.create_file("~/.config/app_a/ignored.log", "ignored")
+
+    def _objects(self) -> list:
+        objects = []
+        for root, _, files in os.walk(Config._normpath("~/backup/.dotbackup/objects")):
+            objects.extend(os.path.join(root, file) for file in files)
+        return objects
+
+    def test_dedup(self):
+        assert dotbackup.dotbackup() == 0
+        assert len(self._objects()) == 1
+        # no mirrored backup files
+        assert not os.path.exists(Config._normpath("~/backup/.config"))
+
+        helper.create_file(self._files[0], "new content")
+        assert dotbackup.dotbackup() == 0
+        assert len(self._objects()) == 2
+
+    def test_unchanged(self, caplog):
+        assert dotbackup.dotbackup() == 0
+        objects = self._objects()
+        mtime = os.stat(objects[0]).st_mtime_ns
+
+        assert dotbackup.dotbackup(["--log-level", "DEBUG"]) == 0
+        assert "skipping unchanged" in caplog.text
+        assert self._objects() == objects
+        assert os.stat(objects[0]).st_mtime_ns == mtime
+
+    def test_setup(self):
+        os.chmod(Config._normpath(self._files[2]), 0o600)
+        assert dotbackup.dotbackup() == 0
+        stats = [os.stat(Config._normpath(file)) for file in self._files]
+
+        helper.rmdir("~/.config/app_a")
+        helper.rmdir("~/.config/app_b")
+        assert dotbackup.dotsetup() == 0
+
+        for file, st in zip(self._files, stats):
+            path = Config._normpath(file)
+            with open(path) as f:
+                assert f.read() == "same content"
+            assert os.stat(path).st_mode == st.st_mode
+            assert os.stat(path).st_mtime_ns == st.st_mtime_ns
+        assert not os.path.exists(Config._normpath("~/.config/app_a/ignored.log"))
+
+    def test_setup_selected_app(self):
+        assert dotbackup.dotbackup() == 0
+        helper.rmdir("~/.config/app_a")
+        helper.rmdir("~/.config/app_b")
+
+        assert dotbackup.dotsetup(["app_b"]) == 0
+        assert os.path.isfile(Config._normpath(self._files[2]))
+        assert not os.path.exists(Config._normpath(self._files[0]))
+
+    def test_clean(self):
+        assert dotbackup.dotbackup() == 0
+        os.remove(Config._normpath(self._files[1]))
+        helper.create_file(self._files[0], "new content")
+
+        assert dotbackup.dotbackup(["--clean"]) == 0
+        # the object of the old content is still used by app_b
+        assert len(self._objects()) == 2
+
+        helper.rmdir("~/.config/app_a")
+        helper.rmdir("~/.config/app_b")
+        assert dotbackup.dotsetup() == 0
+        assert not os.path.exists(Config._normpath(self._files[1]))
+
+    def test_unused_objects(self):
+        assert dotbackup.dotbackup() == 0
+        for file in self._files:
+            helper.create_file(file, "new content")
+
+        assert dotbackup.dotbackup() == 0
+        assert len(self._objects()) == 1
+
+    def test_file_not_found(self, caplog):
+        assert dotbackup.dotsetup() == 0
+        assert "file not found in index: .config/app_a" in caplog.text
+
+    def test_snapshot(self, caplog):
+        assert dotbackup.dotbackup(["--snapshot"]) == 1
+        assert "snapshot is not supported by objects storage" in caplog.text
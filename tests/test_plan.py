@@ -0,0 +1,82 @@
+"""Test the application plan with basic.yml."""
+
+import os
+import re
+from pathlib import Path
+
+import helper
+import pytest
+
+from dotbackup import Config
+
+
+@pytest.fixture(autouse=True)
+def _clean_test(monkeypatch):
+    helper.clean_test(monkeypatch)
+
+
+class TestPlan:
+    _config = helper.get_config("basic")
+
+    def test_plan(self):
+        plan = self._config._build_plan()
+
+        assert list(plan) == list(self._config._apps_dict)
+        for app, spec in plan.items():
+            assert not hasattr(spec, "__dict__")
+            assert spec.name == app
+            assert [file.file for file in spec.files] == (
+                self._config._apps_dict[app]["files"]
+            )
+            for file in spec.files:
+                assert file.path == Path(Config._normpath(file.file))
+                assert self._config._get_backup_root() / file.rel_path == (
+                    self._config._get_backup_file_path(file.file)
+                )
+
+    @pytest.mark.parametrize(
+        ("config_dict", "message"),
+        [
+            ({}, "backup_dir not configured"),
+            ({"backup_dir": 1}, "invalid backup_dir: 1"),
+            ({"backup_dir": "~/backup", "apps": []}, "invalid apps: []"),
+            ({"backup_dir": "~/backup", "apps": {"a": 1}}, "invalid app: a"),
+            (
+                {"backup_dir": "~/backup", "apps": {"a": {"files": "~/a"}}},
+                "invalid files of a: ~/a",
+            ),
+            (
+                {"backup_dir": "~/backup", "apps": {"a": {"files": ["/etc/a"]}}},
+                "invalid file of a: /etc/a: must be in the home directory",
+            ),
+            (
+                {"backup_dir": "~/backup", "apps": {"a": {"ignore": [1]}}},
+                "invalid ignore of a: [1]",
+            ),
+            ({"backup_dir": "~/backup", "ignore": "*.log"}, "invalid ignore: *.log"),
+        ],
+    )
+    def test_invalid_config(self, config_dict, message):
+        config = Config({**config_dict, "selected_apps": []})
+
+        with pytest.raises(RuntimeError, match=re.escape(message)):
+            config.backup()
+        with pytest.raises(RuntimeError, match=re.escape(message)):
+            config.setup()
+
+    def test_validate_before_copying(self):
+        config = helper.get_config("basic")
+        config._dict["apps"]["app_b"]["files"].append("/etc/hosts")
+        config._dict["selected_apps"] = []
+        helper.create_file("~/.config/app_a/a.txt", helper.random_str())
+
+        with pytest.raises(RuntimeError, match="invalid file of app_b"):
+            config.backup()
+        assert not os.path.exists(Config._normpath(config._backup_dir))
+
+    def test_empty_app(self):
+        config = Config({"backup_dir": "~/backup", "apps": {"a": None}})
+        config._dict["selected_apps"] = []
+
+        assert config.backup() == 0
+        assert config._build_plan()["a"].files == []
@@ -0,0 +1,124 @@
+"""Test profiling with basic.yml."""
+
+import os
+import pstats
+
+import helper
+import pytest
+
+import dotbackup
+
+
+@pytest.fixture(autouse=True)
+def _clean_test(monkeypatch):
+    helper.clean_test(monkeypatch)
+
+
+class TestProfile:
+    _config = helper.get_config("basic")
+    _files = [
+        "~/.config/app_a/a.txt",
+        "~/.config/app_a/sub/a.txt",
+        "~/.config/app_b/b1.txt",
+        "~/.config/app_b/b2.txt",
+    ]
+    _profile_file = f"{helper.TEST_HOME}/profile/report.txt"
+
+    @pytest.fixture(autouse=True)
+    def _prepare(self):
+        helper.cp(helper.get_config_path("basic"), helper.CONFIG_FILE)
+        for file in self._files:
+            helper.create_file(file, helper.random_str())
+        # large enough for the copy phase not to round to zero
+        helper.create_file(self._files[0], "x" * 2**24)
+
+    def _get_rows(self) -> dict:
+        with open(self._profile_file, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+
+        header = lines[2].split()
+        rows = dict()
+        for line in lines[3:]:
+            if not line:
+                break
+            name, *values = line.split()
+            rows[name] = dict(zip(header[1:], map(float, values)))
+        return rows
+
+    @pytest.mark.parametrize("typ", ["backup", "setup"])
+    def test_profile(self, typ):
+        assert dotbackup.dotbackup() == 0
+        run = dotbackup.dotbackup if typ == "backup" else dotbackup.dotsetup
+
+        assert run(["--profile", self._profile_file]) == 0
+        rows = self._get_rows()
+        assert list(rows) == ["app_a", "app_b", "(global)"]
+        for row in rows.values():
+            assert list(row) == [
+                "TOTAL",
+                "WALK",
+                "IGNORE",
+                "COPY",
+                "METADATA",
+                "HOOK",
+                "OTHER",
+            ]
+            total = sum(row.values()) - row["TOTAL"]
+            assert row["TOTAL"] == pytest.approx(total, abs=0.01)
+        assert rows["app_a"]["HOOK"] > 0
+        assert rows["app_a"]["COPY"] > 0
+
+        stats = pstats.Stats(f"{self._profile_file}.pstats")
+        assert stats.total_tt > 0
+
+    def test_force_serial(self, caplog):
+        args = ["--profile", self._profile_file, "-j", "4", "--app-jobs", "2"]
+
+        assert dotbackup.dotbackup(args) == 0
+        assert helper.validate_backup(self._config)
+        assert "profiling in one thread, ignoring jobs" in caplog.text
+        assert "profiling in one thread, ignoring app_jobs" in caplog.text
+        assert list(self._get_rows()) == ["app_a", "app_b", "(global)"]
+
+    def test_phase_timer(self, monkeypatch):
+        clock = iter(range(100))
+        monkeypatch.setattr(dotbackup.time, "perf_counter", lambda: next(clock))
+        timer = dotbackup.PhaseTimer()
+
+        with timer.phase("copy"):
+            pass
+        timer.start()
+        with timer.app(None):  # 0
+            with timer.app("app"):  # 1
+                with timer.phase("walk"):  # 2
+                    with timer.phase("copy"):  # 3
+                        pass  # 4
+                    with timer.phase("ignore"):  # 5
+                        pass  # 6
+                    pass  # 7
+                pass  # 8
+            pass  # 9
+
+        assert timer.stop() == {
+            None: {"other": 2},
+            "app": {"other": 2, "walk": 3, "copy": 1, "ignore": 1},
+        }
+        assert timer.times is None
+
+    def test_sqlite(self):
+        helper.cp(helper.get_config_path("sqlite"), helper.CONFIG_FILE)
+
+        assert dotbackup.dotbackup(["--profile", self._profile_file]) == 0
+        row = self._get_rows()["app_a"]
+        # statements storing files are counted as copies
+        assert row["COPY"] > row["OTHER"]
+
+    def test_failed_run(self):
+        helper.create_file(
+            helper.CONFIG_FILE,
+            "backup_dir: ~/backup\napps:\n  app_a:\n    pre_backup:\n      - 'false'\n",
+        )
+
+        assert dotbackup.dotbackup(["--profile", self._profile_file]) == 1
+        assert os.path.isfile(self._profile_file)
+        assert list(self._get_rows()) == ["app_a", "(global)"]
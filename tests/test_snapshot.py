@@ -0,0 +1,106 @@
+"""Test snapshot backup and setup with basic.yml."""
+
+import os
+
+import helper
+import pytest
+
+import dotbackup
+from dotbackup import Config
+
+
+class TestSnapshot:
+    _config = helper.get_config("basic")
+    _files = [
+        "~/.config/app_a/a.txt",
+        "~/.config/app_b/b1.txt",
+        "~/.config/app_b/b2.txt",
+    ]
+
+    @pytest.fixture(autouse=True)
+    def _prepare(self, monkeypatch):
+        helper.clean_test(monkeypatch)
+        helper.cp(helper.get_config_path("basic"), helper.CONFIG_FILE)
+        for file in self._files:
+            helper.create_file(file, helper.random_str())
+
+    def _snapshot_file(self, snapshot, file) -> str:
+        rel_path = os.path.relpath(Config._normpath(file), Config._normpath("~"))
+        return Config._normpath(f"~/backup/{snapshot}/{rel_path}")
+
+    def _snapshots(self) -> list:
+        config = helper.get_config("basic")
+        return config._list_snapshots()
+
+    def test_backup(self, capfd):
+        assert dotbackup.dotbackup(["--snapshot"]) == 0
+        assert dotbackup.dotbackup(["--snapshot"]) == 0
+
+        snapshots = self._snapshots()
+        assert len(snapshots) == 2
+        assert os.readlink(Config._normpath("~/backup/latest")) == snapshots[1]
+        # hooks get the snapshot directory
+        assert f"pre_backup {Config._normpath('~/backup')}/{snapshots[1]}\n" in (
+            capfd.readouterr().out
+        )
+
+        for file in self._files:
+            old = os.stat(self._snapshot_file(snapshots[0], file))
+            new = os.stat(self._snapshot_file(snapshots[1], file))
+            assert old.st_ino == new.st_ino
+            assert helper.filediff(file, self._snapshot_file(snapshots[1], file))
+
+    def test_changed_file(self):
+        assert dotbackup.dotbackup(["--snapshot"]) == 0
+        old_content = helper.random_str(60)
+        helper.create_file(self._files[1], old_content)
+        assert dotbackup.dotbackup(["--snapshot"]) == 0
+        helper.create_file(self._files[1], helper.random_str(70))
+        assert dotbackup.dotbackup(["--snapshot"]) == 0
+
+        old, new = self._snapshots()[1:]
+        assert os.stat(self._snapshot_file(old, self._files[1])).st_ino != (
+            os.stat(self._snapshot_file(new, self._files[1])).st_ino
+        )
+        with open(self._snapshot_file(old, self._files[1])) as f:
+            assert f.read() == old_content
+
+        # set up from the old snapshot
+        assert dotbackup.dotsetup(["--snapshot", old]) == 0
+        with open(Config._normpath(self._files[1])) as f:
+            assert f.read() == old_content
+
+        # set up from the latest snapshot
+        helper.create_file(self._files[1], helper.random_str(80))
+        assert dotbackup.dotsetup(["--snapshot", "latest"]) == 0
+        assert helper.filediff(self._files[1], self._snapshot_file(new, self._files[1]))
+
+    def test_selected_apps(self):
+        assert dotbackup.dotbackup(["--snapshot"]) == 0
+        assert dotbackup.dotbackup(["--snapshot", "app_a"]) == 0
+
+        old, new = self._snapshots()
+        for file in self._files:
+            assert os.stat(self._snapshot_file(old, file)).st_ino == (
+                os.stat(self._snapshot_file(new, file)).st_ino
+            )
+
+    def test_keep_snapshots(self):
+        config = helper.get_config("basic")
+        config._dict["snapshot"] = True
+        config._dict["keep_snapshots"] = 2
+        config._dict["selected_apps"] = []
+
+        for _ in range(3):
+            assert config.backup() == 0
+
+        snapshots = self._snapshots()
+        assert len(snapshots) == 2
+        assert os.readlink(Config._normpath("~/backup/latest")) == snapshots[1]
+
+    def test_snapshot_not_found(self, caplog):
+        assert dotbackup.dotsetup(["--snapshot", "latest"]) == 1
+        assert "snapshot not found: latest" in caplog.text
+        assert dotbackup.dotbackup(["--snapshot"]) == 0
+        assert dotbackup.dotsetup(["--snapshot", "20000101T000000"]) == 1
+        assert "snapshot not found: 20000101T000000" in caplog.text
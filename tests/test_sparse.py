@@ -0,0 +1,80 @@
+"""Test sparse file copy with basic.yml."""
+
+import os
+
+import helper
+import pytest
+
+import dotbackup
+from dotbackup import Config
+
+
+@pytest.fixture(autouse=True)
+def _clean_test(monkeypatch):
+    helper.clean_test(monkeypatch)
+
+
+class TestSparse:
+    _config = helper.get_config("basic")
+    _sparse_file = "~/.config/app_b/b1.txt"
+    _backup_file = str(_config._get_backup_file_path(_sparse_file))
+    _size = 2**24
+
+    @pytest.fixture(autouse=True)
+    def _prepare(self):
+        helper.cp(helper.get_config_path("basic"), helper.CONFIG_FILE)
+        helper.create_file("~/.config/app_a/a.txt", helper.random_str())
+        helper.create_file("~/.config/app_b/b2.txt", helper.random_str())
+
+        path = Config._normpath(self._sparse_file)
+        with open(path, "wb") as f:
+            f.truncate(self._size)
+            f.seek(2**20)
+            f.write(os.urandom(2**16))
+            f.seek(self._size - 100)
+            f.write(b"end")
+        if not Config._is_sparse(os.stat(path)):
+            pytest.skip("filesystem doesn't support sparse files")
+
+    @pytest.mark.parametrize("method", ["auto", "kernel", "buffered"])
+    def test_backup(self, method, caplog):
+        assert dotbackup.dotbackup(["--copy-method", method]) == 0
+
+        assert helper.validate_backup(self._config)
+        st = os.stat(self._backup_file)
+        assert st.st_size == self._size
+        assert Config._is_sparse(st)
+        if method != "auto":
+            assert "copied data of 1 sparse files" in caplog.text
+
+    def test_buffered(self, monkeypatch):
+        def copy_file_range(*args):
+            raise AssertionError("copied in the kernel")
+
+        monkeypatch.setattr(os, "copy_file_range", copy_file_range, raising=False)
+        assert dotbackup.dotbackup(["--copy-method", "buffered"]) == 0
+        assert helper.validate_backup(self._config)
+        assert Config._is_sparse(os.stat(self._backup_file))
+
+    def test_setup(self):
+        assert dotbackup.dotbackup(["--copy-method", "kernel"]) == 0
+        os.remove(Config._normpath(self._sparse_file))
+
+        assert dotbackup.dotsetup(["--copy-method", "kernel"]) == 0
+        assert helper.validate_setup(self._config)
+        assert Config._is_sparse(os.stat(Config._normpath(self._sparse_file)))
+
+    def test_objects(self):
+        helper.create_file(
+            helper.CONFIG_FILE,
+            "backup_dir: ~/backup\nstorage: objects\napps:\n  app_b:\n    files:\n"
+            f"      - {self._sparse_file}\n",
+        )
+
+        assert dotbackup.dotbackup(["--copy-method", "kernel"]) == 0
+        os.remove(Config._normpath(self._sparse_file))
+        assert dotbackup.dotsetup(["--copy-method", "kernel"]) == 0
+
+        st = os.stat(Config._normpath(self._sparse_file))
+        assert st.st_size == self._size
+        assert Config._is_sparse(st)
@@ -0,0 +1,118 @@
+"""Test with sqlite.yml."""
+
+import os
+import sqlite3
+
+import helper
+import pytest
+
+import dotbackup
+from dotbackup import Config, SqliteStorage
+
+
+class TestSqlite:
+    _config = helper.get_config("sqlite")
+    _files = [
+        "~/.config/app_a/a.txt",
+        "~/.config/app_a/sub/a.txt",
+        "~/.config/app_b/b1.txt",
+        "~/.config/app_b/b2.txt",
+    ]
+    _database = "~/backup/.dotbackup/files.sqlite3"
+
+    @pytest.fixture(autouse=True)
+    def _prepare(self, monkeypatch):
+        helper.clean_test(monkeypatch)
+        helper.cp(helper.get_config_path("sqlite"), helper.CONFIG_FILE)
+        for file in self._files:
+            helper.create_file(file, helper.random_str())
+        helper.create_file("~/.config/app_a/ignored.log", "ignored")
+
+    def _rows(self) -> dict:
+        db = sqlite3.connect(Config._normpath(self._database))
+        try:
+            return dict(db.execute("SELECT path, size FROM files"))
+        finally:
+            db.close()
+
+    def _restore(self, args=()):
+        contents = {}
+        for file in self._files:
+            with open(Config._normpath(file)) as f:
+                contents[file] = f.read()
+        helper.rmdir("~/.config/app_a")
+        helper.rmdir("~/.config/app_b")
+
+        assert dotbackup.dotsetup(list(args)) == 0
+        return contents
+
+    def test_backup(self):
+        assert dotbackup.dotbackup() == 0
+        assert sorted(self._rows()) == sorted(file[2:] for file in self._files)
+        # no mirrored backup files
+        assert not os.path.exists(Config._normpath("~/backup/.config"))
+
+    def test_unchanged(self, caplog):
+        assert dotbackup.dotbackup() == 0
+
+        assert dotbackup.dotbackup(["--log-level", "DEBUG"]) == 0
+        assert caplog.text.count("skipping unchanged") == len(self._files)
+
+    def test_setup(self):
+        os.chmod(Config._normpath(self._files[2]), 0o600)
+        assert dotbackup.dotbackup() == 0
+        stats = [os.stat(Config._normpath(file)) for file in self._files]
+
+        contents = self._restore()
+        for file, st in zip(self._files, stats):
+            path = Config._normpath(file)
+            with open(path) as f:
+                assert f.read() == contents[file]
+            assert os.stat(path).st_mode == st.st_mode
+            assert os.stat(path).st_mtime_ns == st.st_mtime_ns
+            assert os.stat(path).st_uid == st.st_uid
+        assert not os.path.exists(Config._normpath("~/.config/app_a/ignored.log"))
+
+    def test_large_file(self, monkeypatch):
+        monkeypatch.setattr(SqliteStorage, "_DATABASE_CHUNK_SIZE", 1000)
+        monkeypatch.setattr(SqliteStorage, "_DATABASE_BATCH", 2)
+        helper.create_file(self._files[1], helper.random_str(10000))
+
+        assert dotbackup.dotbackup(["--jobs", "4"]) == 0
+        assert self._rows()[".config/app_a/sub/a.txt"] == 10000
+
+        contents = self._restore(["--jobs", "4"])
+        with open(Config._normpath(self._files[1])) as f:
+            assert f.read() == contents[self._files[1]]
+
+    def test_failed_file(self, caplog):
+        assert dotbackup.dotbackup() == 0
+        os.symlink("not_found", Config._normpath("~/.config/app_a/dangling"))
+
+        assert dotbackup.dotbackup() == 1
+        assert "failed to copy" in caplog.text
+        assert ".config/app_a/dangling" not in self._rows()
+
+    def test_clean(self):
+        assert dotbackup.dotbackup() == 0
+        os.remove(Config._normpath(self._files[1]))
+
+        assert dotbackup.dotbackup(["--clean"]) == 0
+        assert ".config/app_a/sub/a.txt" not in self._rows()
+
+    def test_file_not_found(self, caplog):
+        assert dotbackup.dotbackup() == 0
+        os.remove(Config._normpath(self._database))
+
+        assert dotbackup.dotsetup() == 1
+        assert "database not found" in caplog.text
+
+    def test_corrupt_database(self, caplog):
+        helper.create_file(self._database, "corrupt")
+
+        assert dotbackup.dotbackup() == 1
+        assert "corrupt database" in caplog.text
+
+    def test_snapshot(self, caplog):
+        assert dotbackup.dotbackup(["--snapshot"]) == 1
+        assert "snapshot is not supported by sqlite storage" in caplog.text
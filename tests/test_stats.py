@@ -0,0 +1,107 @@
+"""Test run statistics with basic.yml."""
+
+import json
+import os
+
+import helper
+import pytest
+
+import dotbackup
+
+
+@pytest.fixture(autouse=True)
+def _clean_test(monkeypatch):
+    helper.clean_test(monkeypatch)
+
+
+class TestStats:
+    _config = helper.get_config("basic")
+    _files = [
+        "~/.config/app_a/a.txt",
+        "~/.config/app_a/sub/a.txt",
+        "~/.config/app_b/b1.txt",
+        "~/.config/app_b/b2.txt",
+    ]
+    _metrics_file = f"{helper.TEST_HOME}/metrics.json"
+    _prometheus_file = f"{helper.TEST_HOME}/textfile/dotbackup.prom"
+
+    @pytest.fixture(autouse=True)
+    def _prepare(self):
+        helper.cp(helper.get_config_path("basic"), helper.CONFIG_FILE)
+        for file in self._files:
+            helper.create_file(file, helper.random_str())
+
+    def _get_metrics(self) -> dict:
+        with open(self._metrics_file, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _get_bytes(self, files) -> int:
+        return sum(os.path.getsize(self._config._normpath(f)) for f in files)
+
+    @pytest.mark.parametrize(
+        "args", [[], ["--jobs", "4", "--app-jobs", "2"]], ids=["serial", "parallel"]
+    )
+    def test_metrics_file(self, args):
+        assert dotbackup.dotbackup(["--metrics-file", self._metrics_file, *args]) == 0
+
+        metrics = self._get_metrics()
+        assert metrics["command"] == "backup"
+        assert metrics["success"]
+        assert metrics["totals"]["files_copied"] == 4
+        assert metrics["totals"]["bytes_copied"] == self._get_bytes(self._files)
+        assert list(metrics["apps"]) == ["app_a", "app_b"]
+        for app, files in (("app_a", self._files[:2]), ("app_b", self._files[2:])):
+            stats = metrics["apps"][app]
+            assert stats["files_copied"] == 2
+            assert stats["bytes_copied"] == self._get_bytes(files)
+            assert stats["seconds"] >= stats["hook_seconds"] + stats["copy_seconds"]
+        assert metrics["seconds"] >= metrics["hook_seconds"]
+        assert len(metrics["hooks"]) == 6
+
+    def test_skipped_and_missing(self):
+        assert dotbackup.dotbackup(["--incremental"]) == 0
+        os.remove(self._config._normpath(self._files[2]))
+
+        args = ["--incremental", "--metrics-file", self._metrics_file]
+        assert dotbackup.dotbackup(args) == 0
+        totals = self._get_metrics()["totals"]
+        assert totals["files_copied"] == 0
+        assert totals["files_skipped"] == 3
+        assert totals["files_missing"] == 1
+
+    def test_setup(self):
+        assert dotbackup.dotbackup() == 0
+
+        assert dotbackup.dotsetup(["--metrics-file", self._metrics_file]) == 0
+        metrics = self._get_metrics()
+        assert metrics["command"] == "setup"
+        assert metrics["totals"]["files_copied"] == 4
+
+    def test_print_stats(self, capfd):
+        assert dotbackup.dotbackup(["--stats"]) == 0
+
+        lines = capfd.readouterr().out.splitlines()[-4:]
+        assert lines[0].split()[:3] == ["APP", "TIME", "HOOKS"]
+        assert [line.split()[0] for line in lines[1:]] == ["app_a", "app_b", "total"]
+        assert lines[-1].split()[3] == "4"
+
+    def test_prometheus_file(self):
+        assert dotbackup.dotbackup(["--prometheus-file", self._prometheus_file]) == 0
+
+        with open(self._prometheus_file, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        assert 'dotbackup_last_run_success{command="backup"} 1' in lines
+        assert 'dotbackup_last_run_files_copied{command="backup"} 4' in lines
+        assert 'dotbackup_app_files_copied{command="backup",app="app_a"} 2' in lines
+        assert "# TYPE dotbackup_app_seconds gauge" in lines
+
+    def test_failed_run(self):
+        helper.create_file(
+            helper.CONFIG_FILE,
+            "backup_dir: ~/backup\napps:\n  app_a:\n    pre_backup:\n      - 'false'\n",
+        )
+
+        assert dotbackup.dotbackup(["--metrics-file", self._metrics_file]) == 1
+        metrics = self._get_metrics()
+        assert not metrics["success"]
+        assert metrics["hooks"][0]["command"] == "false"
@@ -0,0 +1,97 @@
+"""Test the storage interface with basic.yml, objects.yml, archive.yml and
+sqlite.yml.
+"""
+
+import os
+
+import helper
+import pytest
+
+import dotbackup
+from dotbackup import ArchiveStorage, Config
+
+
+@pytest.fixture(autouse=True)
+def _clean_test(monkeypatch):
+    helper.clean_test(monkeypatch)
+
+
+class TestStorage:
+    _files = [
+        "~/.config/app_a/a.txt",
+        "~/.config/app_a/sub/a.txt",
+        "~/.config/app_b/b1.txt",
+        "~/.config/app_b/b2.txt",
+    ]
+
+    def _backup(self, name) -> Config:
+        helper.cp(helper.get_config_path(name), helper.CONFIG_FILE)
+        for file in self._files:
+            helper.create_file(file, helper.random_str())
+        assert dotbackup.dotbackup() == 0
+
+        config = helper.get_config(name)
+        config._check_storage()
+        return config
+
+    def _check_keys(self, config) -> None:
+        backend = config._backend
+        backend.begin("setup")
+        with backend.open("setup"):
+            assert sorted(backend.iter_keys(".config/app_a")) == [
+                ".config/app_a/a.txt",
+                ".config/app_a/sub/a.txt",
+            ]
+            assert list(backend.iter_keys(".config/app_b/b1.txt")) == [
+                ".config/app_b/b1.txt"
+            ]
+            assert not list(backend.iter_keys(".config/app_c"))
+
+    @pytest.mark.parametrize("name", ["basic", "objects", "archive", "sqlite"])
+    def test_iter_keys(self, name):
+        self._check_keys(self._backup(name))
+
+    def test_iter_archive_keys(self):
+        config = self._backup("archive")
+        # members are listed by scanning the archive without its index
+        os.remove(
+            Config._normpath(f"~/backup.tar.gz{ArchiveStorage._ARCHIVE_INDEX_SUFFIX}")
+        )
+
+        self._check_keys(config)
+        assert config._backend._archive_index is None
+
+    @pytest.mark.parametrize("name", ["basic", "objects", "archive", "sqlite"])
+    def test_restore_ignore_dir(self, name):
+        helper.create_file("~/.config/app_a/tmp/a.txt", "ignored")
+        helper.create_file("~/.config/app_a/sub/tmp", "not a directory")
+        self._backup(name)
+        with open(helper.CONFIG_FILE, mode="a", encoding="utf-8") as f:
+            f.write("ignore:\n  - tmp/\n")
+        helper.rmdir("~/.config/app_a")
+
+        assert dotbackup.dotsetup() == 0
+        # the destination doesn't exist yet, but tmp is a directory in the backup
+        assert not os.path.exists(Config._normpath("~/.config/app_a/tmp"))
+        assert os.path.isfile(Config._normpath("~/.config/app_a/sub/tmp"))
+        assert os.path.isfile(Config._normpath(self._files[1]))
+
+    @pytest.mark.parametrize("name", ["objects", "archive", "sqlite"])
+    @pytest.mark.parametrize("option", ["mirror", "incremental", "snapshot"])
+    def test_unsupported_option(self, name, option, caplog):
+        helper.cp(helper.get_config_path(name), helper.CONFIG_FILE)
+        with open(helper.CONFIG_FILE, mode="a", encoding="utf-8") as f:
+            f.write(f"{option}: true\n")
+
+        assert dotbackup.dotbackup() == 1
+        assert dotbackup.dotsetup() == 1
+        assert f"{option} is not supported by {name} storage" in caplog.text
+
+    @pytest.mark.parametrize("storage", ["unknown", "['files']"])
+    def test_invalid_storage(self, storage, caplog):
+        helper.cp(helper.get_config_path("basic"), helper.CONFIG_FILE)
+        with open(helper.CONFIG_FILE, mode="a", encoding="utf-8") as f:
+            f.write(f"storage: {storage}\n")
+
+        assert dotbackup.dotbackup() == 1
+        assert "invalid storage" in caplog.text
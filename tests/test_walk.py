@@ -0,0 +1,157 @@
+"""Test the streaming tree walker with basic.yml."""
+
+import os
+
+import helper
+import pytest
+
+import dotbackup
+from dotbackup import Config
+
+
+@pytest.fixture(autouse=True)
+def _clean_test(monkeypatch):
+    helper.clean_test(monkeypatch)
+
+
+class TestWalk:
+    _config = helper.get_config("basic")
+    _files = [f"~/.config/app_a/flat/{i}.txt" for i in range(50)] + [
+        "~/.config/app_a/sub/deep/a.txt",
+        "~/.config/app_b/b1.txt",
+        "~/.config/app_b/b2.txt",
+    ]
+
+    @pytest.fixture(autouse=True)
+    def _prepare(self, monkeypatch):
+        helper.cp(helper.get_config_path("basic"), helper.CONFIG_FILE)
+        for file in self._files:
+            helper.create_file(file, helper.random_str())
+        # stream directories in several batches
+        monkeypatch.setattr(Config, "_WALK_BATCH", 8)
+
+    def test_backup(self):
+        assert dotbackup.dotbackup([]) == 0
+        assert helper.validate_backup(self._config)
+
+    def test_setup(self):
+        assert dotbackup.dotbackup([]) == 0
+        helper.rmdir("~/.config/app_a")
+
+        assert dotbackup.dotsetup([]) == 0
+        assert helper.validate_setup(self._config)
+
+    @pytest.mark.parametrize(
+        "args",
+        [[], ["--jobs", "4"], ["--mirror"], ["--incremental"], ["--snapshot"]],
+    )
+    def test_dir_mtime(self, args):
+        mtime = 1577836800 * 10**9
+        for root, _, _ in os.walk(Config._normpath("~/.config/app_a")):
+            os.utime(root, ns=(mtime, mtime))
+
+        assert dotbackup.dotbackup(args) == 0
+        if "--snapshot" in args:
+            root = Config._normpath("~/backup")
+            (name,) = [name for name in os.listdir(root) if name[0].isdigit()]
+            backup_root = os.path.join(root, name)
+        else:
+            backup_root = Config._normpath("~/backup")
+        for path in ("app_a", "app_a/flat", "app_a/sub", "app_a/sub/deep"):
+            path = os.path.join(backup_root, ".config", path)
+            assert os.stat(path).st_mtime_ns == mtime
+
+    @pytest.mark.parametrize("args", [[], ["--mirror"], ["--incremental"]])
+    def test_stat_once(self, args, monkeypatch):
+        flat = Config._normpath("~/.config/app_a/flat")
+        stat = os.stat
+        paths = []
+
+        def fake_stat(path, *args, **kwargs):
+            paths.append(os.fspath(path))
+            return stat(path, *args, **kwargs)
+
+        monkeypatch.setattr(os, "stat", fake_stat)
+        assert dotbackup.dotbackup(args) == 0
+        # stat results of walked files are cached in their DirEntry objects
+        assert not [path for path in paths if path.startswith(flat + os.sep)]
+
+    def test_setup_dir_mtime(self):
+        assert dotbackup.dotbackup([]) == 0
+        mtime = 1577836800 * 10**9
+        for root, _, _ in os.walk(Config._normpath("~/backup/.config/app_a")):
+            os.utime(root, ns=(mtime, mtime))
+        helper.rmdir("~/.config/app_a")
+
+        assert dotbackup.dotsetup(["--jobs", "4"]) == 0
+        assert os.stat(Config._normpath("~/.config/app_a/sub")).st_mtime_ns == mtime
+        assert os.stat(Config._normpath("~/.config/app_a")).st_mtime_ns == mtime
+
+    def test_unreadable_dir(self, monkeypatch, caplog):
+        sub = Config._normpath("~/.config/app_a/sub")
+        scandir = os.scandir
+
+        def fake_scandir(path="."):
+            if path == sub:
+                raise PermissionError(13, "Permission denied", path)
+            return scandir(path)
+
+        monkeypatch.setattr(os, "scandir", fake_scandir)
+        assert dotbackup.dotbackup([]) == 1
+        assert f"failed to list {sub}" in caplog.text
+        assert not os.path.exists(Config._normpath("~/backup/.config/app_a/sub/deep"))
+
+    def test_batches(self):
+        top = Config._normpath("~/.config/app_a")
+        walked = list(Config._walk(top))
+
+        roots = [root for root, _ in walked]
+        assert roots[0] == top
+        assert roots.count(os.path.join(top, "flat")) == 7
+        names = [entry.name for _, entries in walked for entry in entries]
+        assert sorted(names) == sorted([f"{i}.txt" for i in range(50)] + ["a.txt"])
+
+    def test_ignore(self):
+        top = Config._normpath("~/.config/app_a")
+
+        def ignore(root, names):
+            return {name for name in names if name in ("sub", "0.txt")}
+
+        walked = list(Config._walk(top, ignore))
+        assert os.path.join(top, "sub") not in [root for root, _ in walked]
+        names = [entry.name for _, entries in walked for entry in entries]
+        assert len(names) == 49
+        assert "0.txt" not in names
+
+    def test_mirror(self):
+        assert dotbackup.dotbackup([]) == 0
+        for i in range(0, 50, 2):
+            os.remove(Config._normpath(f"~/.config/app_a/flat/{i}.txt"))
+        helper.rmdir("~/.config/app_a/sub")
+
+        assert dotbackup.dotbackup(["--mirror"]) == 0
+        assert helper.validate_backup(self._config)
+
+    def test_remove_tree(self):
+        outside = Config._normpath("~/outside")
+        helper.create_file(os.path.join(outside, "keep.txt"), "keep")
+        top = Config._normpath("~/.config/app_a")
+        os.symlink(outside, os.path.join(top, "sub/link"))
+
+        Config._remove_tree(top)
+        assert not os.path.lexists(top)
+        # symbolic links are removed, not followed
+        assert os.path.isfile(os.path.join(outside, "keep.txt"))
+
+    def test_leave(self):
+        top = Config._normpath("~/.config/app_a")
+        walked = list(Config._walk(top, leave=True))
+
+        left = [root for root, entries in walked if entries is None]
+        assert sorted(left) == sorted(
+            [top] + [os.path.join(top, path) for path in ("flat", "sub", "sub/deep")]
+        )
+        # each directory is left after everything under it is walked
+        for i, (root, entries) in enumerate(walked):
+            if entries is None:
+                assert all(not r.startswith(root + os.sep) for r, _ in walked[i:])
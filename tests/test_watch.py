@@ -0,0 +1,173 @@
+"""Test watch mode with basic.yml."""
+
+import json
+import logging
+import os
+import threading
+import time
+
+import helper
+import pytest
+
+import dotbackup
+
+
+@pytest.fixture(autouse=True)
+def _clean_test(monkeypatch):
+    helper.clean_test(monkeypatch)
+
+
+def _wait_until(predicate, timeout=10) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+class TestWatch:
+    _config = helper.get_config("basic")
+    _files = [
+        "~/.config/app_a/a.txt",
+        "~/.config/app_a/sub/a.txt",
+        "~/.config/app_b/b1.txt",
+        "~/.config/app_b/b2.txt",
+    ]
+    _backup_files = list(
+        map(lambda file, func=_config._get_backup_file_path: str(func(file)), _files)
+    )
+
+    @pytest.fixture(autouse=True)
+    def _prepare(self):
+        helper.cp(helper.get_config_path("basic"), helper.CONFIG_FILE)
+        for file in self._files:
+            helper.create_file(file, helper.random_str())
+
+    @pytest.fixture(params=["inotify", "poll"])
+    def _watcher(self, request, monkeypatch):
+        if request.param == "poll":
+
+            def no_inotify(paths):
+                raise OSError("disabled")
+
+            monkeypatch.setattr(dotbackup, "InotifyWatcher", no_inotify)
+
+    @pytest.fixture
+    def watch(self, _watcher, caplog):
+        """Start watching in a thread and return the Config object."""
+
+        caplog.set_level(logging.INFO, logger="dotbackup")
+        threads = []
+
+        def start(**options):
+            config = dotbackup.Config.fromfile(helper.CONFIG_FILE)
+            config._dict.update(
+                selected_apps=[],
+                watch=True,
+                watch_delay=0.1,
+                watch_interval=0.1,
+                **options,
+            )
+            result = []
+            thread = threading.Thread(target=lambda: result.append(config.backup()))
+            thread.start()
+            threads.append((config, thread, result))
+            assert _wait_until(lambda: "watching" in caplog.text)
+            return config
+
+        yield start
+
+        for config, thread, result in threads:
+            config._watch_stop.set()
+            thread.join()
+            assert result == [0]
+
+    def test_watch(self, watch, capfd):
+        watch()
+        assert helper.validate_backup(self._config)
+        capfd.readouterr()
+
+        helper.create_file(self._files[0], "changed")
+        helper.create_file("~/.config/app_a/new/new.txt", "new")
+        assert _wait_until(lambda: helper.validate_backup(self._config))
+        assert _wait_until(
+            lambda: os.path.isfile(
+                self._config._get_backup_file_path("~/.config/app_a/new/new.txt")
+            )
+        )
+
+        # only hooks of the changed application are run
+        time.sleep(0.3)
+        out = capfd.readouterr().out
+        assert "app_a pre_backup" in out
+        assert "app_b pre_backup" not in out
+
+    def test_ignore(self, watch):
+        helper.create_file(
+            helper.CONFIG_FILE,
+            "backup_dir: ~/backup\napps:\n  app_a:\n    files:\n"
+            "      - ~/.config/app_a\n    ignore:\n      - '*.log'\n",
+        )
+        watch()
+
+        helper.create_file("~/.config/app_a/a.log", "ignored")
+        helper.create_file(self._files[0], "changed")
+        assert _wait_until(
+            lambda: helper.filediff(self._files[0], self._backup_files[0])
+        )
+        assert not os.path.exists(
+            self._config._get_backup_file_path("~/.config/app_a/a.log")
+        )
+
+    def test_ignore_anchored(self, watch):
+        helper.create_file(
+            helper.CONFIG_FILE,
+            "backup_dir: ~/backup\napps:\n  app_a:\n    files:\n"
+            "      - ~/.config/app_a\n    ignore:\n      - new/cache\n",
+        )
+        watch()
+
+        helper.create_file("~/.config/app_a/new/cache/a.txt", "ignored")
+        helper.create_file("~/.config/app_a/new/a.txt", "new")
+        assert _wait_until(
+            lambda: os.path.isfile(
+                self._config._get_backup_file_path("~/.config/app_a/new/a.txt")
+            )
+        )
+        assert not os.path.exists(
+            self._config._get_backup_file_path("~/.config/app_a/new/cache")
+        )
+
+    def test_mirror(self, watch):
+        watch(mirror=True)
+
+        os.remove(self._config._normpath(self._files[2]))
+        assert _wait_until(lambda: not os.path.exists(self._backup_files[2]))
+        assert os.path.exists(self._backup_files[3])
+
+    def test_dir_cache(self, watch):
+        config = watch(incremental=True, dir_cache=True)
+        manifest_path = config._get_manifest_path()
+        with open(manifest_path, encoding="utf-8") as f:
+            dir_roots = json.load(f)["dir_roots"]
+        assert sorted(dir_roots) == sorted(
+            self._config._normpath(file)
+            for file in ("~/.config/app_a", *self._files[2:])
+        )
+
+        new_file = self._config._normpath("~/.config/app_a/new/new.txt")
+        helper.create_file(new_file, "new")
+
+        def backed_up():
+            with open(manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+            return new_file in manifest["files"] and manifest
+
+        assert _wait_until(backed_up)
+        # changed paths are recorded by their configured file
+        assert backed_up()["dir_roots"] == dir_roots
+
+    def test_unsupported(self, caplog):
+        assert dotbackup.dotbackup(["--watch", "--snapshot"]) == 1
+        assert "watch is not supported with snapshot" in caplog.text